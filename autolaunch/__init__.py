@@ -4,24 +4,26 @@
     URLFS as the file backend.
 
     TODO:
-    1. Due to (re)writing of files on disk on the server, these endpoints are currently *not thread-safe*, and *will fail
-       catastrophically* if multiple endpoints are handling requests in parallel. In current usage, this is not a problem,
-       but this should be rectified at some point.
-    2. Right now, the number of files added in a single call is limited by the maximum length of a GET request (typically ~8 kB).
-       Adding the OTS ("one-time storage") callback can remove this limitation.
-    3. Right now, the only auth provider supported is polyauth (as used on data.paradim.org). An oauth2 implementation should
-       be added, to enable accessing most data from most places (since most places support oauth2).
+    1. (Done) Launch and refresh state used to be (re)written directly in files on disk, which was not safe when
+       multiple endpoints handled requests in parallel. It is now kept in a transactional store (see store.py), from
+       which the files URLFS reads are exported.
+    2. (Done) The number of files added in a single call used to be limited by the maximum length of a GET request (typically
+       ~8 kB). The OTS ("one-time storage") callback (see ots.py) removes this limitation.
+    3. (Done) The only auth provider supported used to be polyauth (as used on data.paradim.org). An oauth2 implementation
+       (see auth/oauth2.py) now enables accessing most data from most places (since most places support oauth2).
     4. Right now, secrets are stored local to the jupyter server, but otherwise unprotected. They should be stored in a
        device-bound session as that becomes more widely supported.
     5. There are a couple of configuration parameters (notebook source directory, names of key files) that should be
        stored in extension settings and adjustable in the usual way for a jupyter extension.
-    6. Right now the glue logic for refreshing authentication tokens is handled within notebooks. This extension should
-       proactively watch for IO errors on URLFS and automatically kick off authentication refreshes when needed.
+    6. (Done) The glue logic for refreshing authentication tokens used to be handled entirely within notebooks. Credentials
+       that can be refreshed without the user are now refreshed ahead of their expiry, and as soon as IO errors on URLFS
+       are reported (see refresh.py). Notebooks are still needed to send the user on when a refresh needs them.
 
 """
 
 from jupyter_server.utils import url_path_join
 from tornado.web import StaticFileHandler
+from tornado.ioloop import IOLoop
 import os
 
 
@@ -43,14 +45,37 @@ def _load_jupyter_server_extension(app):
 
     # need base class before importing handler
     from .handlers import (
+        AuthErrorHandler,
         AutoLaunchHandler,
+        BatchLaunchHandler,
+        CompactHandler,
+        LaunchJobHandler,
+        LaunchJobEventsHandler,
+        LaunchLandingHandler,
+        MetricsHandler,
         RefreshAuthHandler,
         RefreshAuthCallbackHandler,
     )
+    from .analysis import analysis_handlers
+    from .auth import auth_handlers
+    from .jobs import LaunchJobs
+    from .launch import Launcher
+    from .refresh import RefreshScheduler
+
+    # look up installed handlers while the server is not serving yet, rather than on the event loop once it is
+    analysis_handlers.discover()
+    auth_handlers.discover()
 
     web_app = app.web_app
     handlers = [
         (url_path_join(web_app.settings['base_url'], 'autolaunch'), AutoLaunchHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'batch'), BatchLaunchHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'compact'), CompactHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'auth-error'), AuthErrorHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'jobs', '([0-9a-f]+)'), LaunchJobHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'jobs', '([0-9a-f]+)', 'events'), LaunchJobEventsHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'landing'), LaunchLandingHandler),
+        (url_path_join(web_app.settings['base_url'], 'autolaunch', 'metrics'), MetricsHandler),
         (url_path_join(web_app.settings['base_url'], 'autolaunch', 'refresh-auth'), RefreshAuthHandler),
         (url_path_join(web_app.settings['base_url'], 'autolaunch', 'refresh-auth', 'callback'), RefreshAuthCallbackHandler),
     ]
@@ -58,8 +83,33 @@ def _load_jupyter_server_extension(app):
     #        https://github.com/jupyterhub/nbgitpuller/pull/242#pullrequestreview-854968180
     #
     web_app.settings['nbapp'] = app
+    web_app.settings['autolaunch_jobs'] = LaunchJobs()
     web_app.add_handlers('.*', handlers)
 
+    # once the server is up, drop whatever earlier sessions left behind in the URLFS configuration, and get
+    # everything the first launch needs (directories, URLFS mount, handlers) ready in the background
+    basedir = os.path.expanduser(web_app.settings['server_root_dir'])
+    launcher = Launcher(basedir, web_app.settings['base_url'])
+    IOLoop.current().add_callback(_warm_up, app, launcher)
+
+    # and keep credentials fresh from then on
+    web_app.settings['autolaunch_refresh'] = RefreshScheduler(basedir)
+    IOLoop.current().add_callback(web_app.settings['autolaunch_refresh'].start)
+
+
+async def _warm_up(app, launcher):
+    try:
+        removed = await launcher.compact()
+        if removed is not None and any(removed.values()):
+            app.log.info("autolaunch: compacted configuration, removed %s", removed)
+    except Exception:
+        app.log.exception("autolaunch: failed to compact configuration")
+    try:
+        await launcher.warm_up()
+    except Exception as e:
+        # the first launch will try again
+        app.log.warning("autolaunch: unable to prepare for launches at startup: %r", e)
+
 
 # For compatibility with both notebook and jupyter_server, we define
 # _jupyter_server_extension_paths alongside _jupyter_server_extension_points.
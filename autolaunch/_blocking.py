@@ -0,0 +1,84 @@
+"""
+Helpers to keep blocking work (disk writes, reads through the URLFS mount, subprocesses) off of the
+tornado event loop.
+
+Blocking calls are run in a small, bounded pool of worker threads, and every step is given its own
+timeout so that a single slow remote server cannot stall the jupyter server (including kernel websocket
+traffic). Note that a python thread blocked inside a read on a FUSE mount cannot be interrupted; on a
+timeout the caller stops waiting for it, but the worker stays busy until the read returns. Bounding the
+pool keeps such stuck reads from piling up without limit.
+
+Anything that may touch the mount (reads of launched files, even a stat of the mount point) is run with
+remote=True, in a separate and smaller pool, so that however many workers are stuck on a slow remote server,
+the configuration store and other local work still get theirs. The timeout of a remote call only starts once a
+worker picks it up, so waiting behind other reads for a worker does not use up its time.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import subprocess
+
+max_workers = 8
+remote_workers = 4
+_executor = None
+_remote_executor = None
+
+
+def get_executor(remote=False):
+    """Return the shared (bounded) executor used for blocking autolaunch work, or the one for reads through the mount."""
+    global _executor, _remote_executor
+    if remote:
+        if _remote_executor is None:
+            _remote_executor = ThreadPoolExecutor(max_workers=remote_workers, thread_name_prefix='autolaunch-remote')
+        return _remote_executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='autolaunch')
+    return _executor
+
+
+async def run_blocking(func, *args, timeout=None, remote=False):
+    """
+    Run func(*args) in the shared executor (the remote one if remote) and return its result. Raises
+    asyncio.TimeoutError if it does not finish within timeout seconds (None waits forever). For remote calls,
+    the timeout counts from when a worker starts on func; waiting for the worker is limited to another timeout.
+    """
+    loop = asyncio.get_running_loop()
+    if not remote:
+        return await asyncio.wait_for(loop.run_in_executor(get_executor(), func, *args), timeout)
+    started = loop.create_future()
+
+    def call():
+        loop.call_soon_threadsafe(_set_started, started)
+        return func(*args)
+
+    fut = loop.run_in_executor(get_executor(remote=True), call)
+    try:
+        await asyncio.wait_for(asyncio.shield(started), timeout)
+    except asyncio.TimeoutError:
+        fut.cancel() # still queued: it never runs
+        raise
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    return await asyncio.wait_for(fut, timeout)
+
+
+def _set_started(started):
+    if not started.done():
+        started.set_result(None)
+
+
+async def run_process(args, timeout=None, capture_output=False):
+    """
+    Run an external command without blocking the event loop. Returns (returncode, stdout), where
+    stdout is None unless capture_output is set. The process is killed if it exceeds timeout seconds,
+    and asyncio.TimeoutError raised.
+    """
+    stdout = asyncio.subprocess.PIPE if capture_output else None
+    proc = await asyncio.create_subprocess_exec(*args, stdout=stdout, stdin=subprocess.DEVNULL)
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, out
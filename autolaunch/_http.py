@@ -0,0 +1,145 @@
+"""
+Shared asynchronous HTTP client for talking to remote services (OTS callbacks, token endpoints).
+
+The client is shared by all requests handled by the server, and limits the number of requests in flight.
+Connections are only kept open and reused with the curl based client, so pooling needs pycurl (pip install
+autolaunch[pooling]); without it, tornado's simple client opens a new connection for every request.
+
+Responses streamed to a slow consumer are fetched with fetch_streaming instead, whose streaming_callback may
+return an awaitable: the response is not read any further until it is done, so the sender is held back (by TCP
+flow control) instead of the response piling up in memory. Neither stock client waits on the callback, so this
+is a minimal HTTP/1.1 client of its own, on tornado's public connection classes.
+"""
+from urllib.parse import urljoin, urlsplit
+import asyncio
+import copy
+import ssl
+
+from tornado import httputil, iostream
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.httpclient import HTTPClientError, HTTPResponse
+from tornado.ioloop import IOLoop
+from tornado.tcpclient import TCPClient
+
+max_clients = 16
+max_streamed_size = 1 << 40 # streamed responses are not held in memory, so only a sanity limit
+
+_clients = {}
+_streaming_slots = {}
+
+
+def get_http_client():
+    """Return the shared AsyncHTTPClient of the current IOLoop."""
+    loop = IOLoop.current()
+    if loop not in _clients:
+        try:
+            from tornado.curl_httpclient import CurlAsyncHTTPClient as cls
+        except ImportError:
+            from tornado.simple_httpclient import SimpleAsyncHTTPClient as cls
+        _clients[loop] = cls(force_instance=True, max_clients=max_clients)
+    return _clients[loop]
+
+
+def fetch_streaming(request):
+    """
+    Fetch request (a tornado HTTPRequest with a streaming_callback, whose url, method, headers, body,
+    request_timeout, follow_redirects, max_redirects and header_callback are honoured), pausing whenever
+    streaming_callback returns an awaitable. Returns a future of the HTTPResponse (without body); raises
+    HTTPClientError for responses other than 2xx. As with AsyncHTTPClient.fetch, cancelling the wait does not
+    stop the response from being read (and dropped).
+    """
+    task = asyncio.ensure_future(_fetch_streaming(request))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception()) # nobody may be waiting on it any more
+    return asyncio.shield(task)
+
+
+async def _fetch_streaming(request):
+    loop = IOLoop.current()
+    if loop not in _streaming_slots:
+        _streaming_slots[loop] = asyncio.Semaphore(max_clients)
+    async with _streaming_slots[loop]:
+        try:
+            return await asyncio.wait_for(_fetch_following(request), request.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPClientError(599, "Timeout")
+
+
+async def _fetch_following(request):
+    if request.max_redirects is None:
+        request = copy.copy(request)
+        request.max_redirects = 5 # as tornado's clients
+    while True:
+        delegate = await _fetch_once(request)
+        if not (delegate.code in (301, 302, 303, 307, 308) and request.follow_redirects is not False and
+                (request.max_redirects or 0) > 0 and 'Location' in delegate.headers):
+            break
+        request = copy.copy(request)
+        request.url = urljoin(request.url, delegate.headers['Location'])
+        request.max_redirects -= 1
+        if delegate.code in (302, 303) or (delegate.code == 301 and request.method == 'POST'):
+            request.method = 'GET'
+            request.body = None
+    response = HTTPResponse(request, delegate.code, reason=delegate.reason, headers=delegate.headers,
+                            effective_url=request.url)
+    if not (200 <= delegate.code < 300):
+        raise HTTPClientError(delegate.code, delegate.reason, response)
+    return response
+
+
+async def _fetch_once(request):
+    url = urlsplit(request.url)
+    if not (url.scheme in ('http', 'https')):
+        raise ValueError("unsupported URL scheme: %s" % url.scheme)
+    https = url.scheme == 'https'
+    stream = await TCPClient().connect(url.hostname, url.port or (443 if https else 80),
+                                       ssl_options=ssl.create_default_context() if https else None)
+    try:
+        connection = HTTP1Connection(stream, True, HTTP1ConnectionParameters(no_keep_alive=True,
+                                                                             max_body_size=max_streamed_size))
+        headers = httputil.HTTPHeaders(request.headers)
+        headers.setdefault('Host', url.netloc.rsplit('@', 1)[-1])
+        headers['Connection'] = 'close'
+        body = request.body or b''
+        if len(body) > 0 or request.method in ('POST', 'PUT', 'PATCH'):
+            headers['Content-Length'] = str(len(body))
+        path = (url.path or '/') + ('?' + url.query if len(url.query) > 0 else '')
+        connection.write_headers(httputil.RequestStartLine(request.method, path, 'HTTP/1.1'), headers)
+        if len(body) > 0:
+            connection.write(body)
+        connection.finish()
+        delegate = _StreamingDelegate(request)
+        try:
+            await connection.read_response(delegate)
+        except iostream.StreamClosedError:
+            pass
+        if not delegate.finished:
+            raise HTTPClientError(599, "Connection closed")
+        return delegate
+    finally:
+        stream.close()
+
+
+class _StreamingDelegate(httputil.HTTPMessageDelegate):
+    # hands the body of the final response to streaming_callback, which may return an awaitable to pause reading
+    def __init__(self, request):
+        self.request = request
+        self.code = None
+        self.reason = None
+        self.headers = None
+        self.finished = False
+
+    def headers_received(self, start_line, headers):
+        self.code, self.reason, self.headers = start_line.code, start_line.reason, headers
+        if self.request.header_callback is not None:
+            self.request.header_callback("%s %d %s\r\n" % (start_line.version, start_line.code, start_line.reason))
+            for k, v in headers.get_all():
+                self.request.header_callback("%s: %s\r\n" % (k, v))
+            self.request.header_callback("\r\n")
+
+    def data_received(self, chunk):
+        if self.code in (301, 302, 303, 307, 308) and 'Location' in self.headers:
+            return None # body of a redirect
+        return self.request.streaming_callback(chunk)
+
+    def finish(self):
+        self.finished = True
@@ -0,0 +1,84 @@
+"""
+Lazily loaded registries of handlers (analysis handlers, auth handlers), keyed by hint.
+
+Handlers are found among the built-in ones and those other packages declare as entry points, e.g. in setup.py:
+
+    entry_points={'autolaunch.analysis_handlers': ['XRD = mypackage.xrd:XRDHandler']}
+
+The entry point name is the handler's hint, so telling which hints exist only takes looking up the entry points
+(once, on first use), and a handler's module is only imported once the handler itself is needed. As that lookup
+scans every installed distribution, the server extension does it (see discover) before requests are served, so
+that it never holds up the event loop.
+"""
+from collections.abc import Mapping
+from importlib import import_module
+from importlib.metadata import entry_points
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class HandlerRegistry(Mapping):
+    """
+    Read-only dictionary of hint: handler. builtin maps the hints of built-in handlers (which come first, in order)
+    to where they are defined ('module:attribute'); those of the entry points of group follow, by hint.
+    """
+    def __init__(self, group, builtin):
+        self.group = group
+        self.builtin = builtin
+        self._targets = None # hint -> 'module:attribute' or entry point, once discovered
+        self._loaded = {}
+        self._lock = threading.Lock() # as handlers are also looked up from worker threads
+
+    def _discover(self):
+        if self._targets is None:
+            targets = dict(self.builtin)
+            try:
+                found = sorted(_entry_points(self.group), key=lambda ep: ep.name)
+            except Exception as e:
+                log.warning("autolaunch: unable to look up %s entry points: %r", self.group, e)
+                found = []
+            for ep in found:
+                if not (ep.name in targets):
+                    targets[ep.name] = ep
+            self._targets = targets
+        return self._targets
+
+    def discover(self):
+        """Look up the installed handlers now, rather than on first use."""
+        self._discover()
+
+    def __getitem__(self, hint):
+        handler = self._loaded.get(hint)
+        if handler is None:
+            target = self._discover()[hint]
+            with self._lock:
+                if not (hint in self._loaded):
+                    self._loaded[hint] = _load(target)
+                handler = self._loaded[hint]
+        return handler
+
+    def __contains__(self, hint):
+        return hint in self._discover()
+
+    def __iter__(self):
+        return iter(self._discover())
+
+    def __len__(self):
+        return len(self._discover())
+
+
+def _entry_points(group):
+    # entry_points(group=...) needs python 3.10; before that, entry_points() is a dictionary of group: entry points
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return found.select(group=group)
+    return found.get(group, [])
+
+
+def _load(target):
+    if not isinstance(target, str):
+        return target.load()
+    module, attr = target.split(':')
+    return getattr(import_module(module), attr)
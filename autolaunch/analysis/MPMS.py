@@ -1,4 +1,6 @@
 from .base import AnalysisBaseHandlerClass
+from .signatures import Signature, non_data_globs
+from . import qd
 from shutil import copyfile
 from io import BytesIO
 import os
@@ -19,6 +21,19 @@ class MPMSMTHandlerClass(AnalysisBaseHandlerClass):
     def getHint(self):
         return "MPMS-MT"
 
+    def getSignatures(self):
+        # only check first 100 lines; usually saved as .dat, but may be renamed
+        return [Signature(pattern=b'MPMS3', max_lines=100, exclude_globs=non_data_globs, likely_globs=['*.dat'])]
+
+    def parseData(self, f):
+        return qd.read_dat(f)
+
+    def readHeader(self, f):
+        return qd.read_header(f)
+
+    def parseRows(self, data, columns):
+        return qd.parse_rows(data, columns)
+
     def checkIsDataType(self, data, filename=None):
         i = 0
         with BytesIO(data) as f:
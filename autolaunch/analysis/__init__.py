@@ -1,12 +1,11 @@
 """
-This imports all known data analysis handlers. At some point, it should be
-rewritten to automatically discover all handlers installed here, so that
-adding a handler is as easy as adding a file. But for now, it is a small
-enough number, we do it manually.
+The known data analysis handlers: the built-in ones, and those installed as entry points of the
+autolaunch.analysis_handlers group (named after their hint, see _registry.py), so that adding a handler
+only takes installing it. A handler's module is imported only once the handler is first needed.
 """
-from .MPMS import MPMSMTHandler
-from .PPMS import PPMSMTHandler
+from .._registry import HandlerRegistry
 
-analysis_handlers = {MPMSMTHandler.getHint(): MPMSMTHandler,
-                     PPMSMTHandler.getHint(): PPMSMTHandler,
-                   }
+analysis_handlers = HandlerRegistry('autolaunch.analysis_handlers', {
+    'MPMS-MT': __name__ + '.MPMS:MPMSMTHandler',
+    'PPMS-MT': __name__ + '.PPMS:PPMSMTHandler',
+})
@@ -19,3 +19,37 @@ class AnalysisBaseHandlerClass(ABC):
     def checkIsDataType(self, data, filename=None):
         pass
 
+    def getSignatures(self):
+        """
+        Optionally, return a list of signatures.Signature recognizing this handler's data, to be matched
+        together with those of all other handlers in a single pass. If None (the default), checkIsDataType
+        is used instead.
+        """
+        return None
+
+
+    def parseData(self, f):
+        """
+        Optionally, parse a data file of this handler's type (f, open in binary mode) for the columnar cache (see
+        columnar.py). Returns (header, batches): header a JSON-serializable description of the file, and batches an
+        iterable of dictionaries of column name: 1-d numpy array, each with the same columns. If None (the default),
+        this handler's data is not parsed.
+        """
+        return None
+
+    def readHeader(self, f):
+        """
+        Optionally (along with parseRows), read the header of a data file of this handler's type (f, open in binary
+        mode), leaving f at the start of its first line of data, so that the data can be parsed in pieces as the
+        file grows (see tail.py). Returns (header, column names), header as in parseData. If None (the default),
+        this handler's data cannot be read incrementally.
+        """
+        return None
+
+    def parseRows(self, data, columns):
+        """
+        Optionally (along with readHeader), parse whole lines of data (bytes, from after the header read by
+        readHeader) with the given column names. Returns a dictionary of column name: 1-d numpy array. If None (the
+        default), this handler's data cannot be read incrementally.
+        """
+        return None
@@ -0,0 +1,177 @@
+"""
+Columnar cache of parsed analysis data.
+
+Instrument data files are large text files, and parsing them through the URLFS mount every time a notebook runs
+is slow. Files whose analysis handler can parse them (see AnalysisBaseHandlerClass.parseData) are instead parsed
+once, into one .npy file per column stored locally (under .remote-config/parsed), which notebooks then
+memory-map in milliseconds:
+
+    from autolaunch.analysis.columnar import load_columns
+    header, data = load_columns('remote/MPMS3/sample/run.dat')
+    data['Temperature (K)']
+
+Entries are keyed by the URL and validators (size, mtime or ETag) of the file's URLFS index line, or, for files
+not served by URLFS, by their path, size and mtime; a changed file is parsed again. Files are parsed from their
+prefetched local copy, if any (see prefetch.py). The least recently used entries are evicted once the cache grows
+beyond max_cache_size.
+
+numpy is needed (pip install autolaunch[parse]).
+"""
+from io import BytesIO
+from secrets import token_hex
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ..prefetch import local_copy
+from ..store import get_store
+from ..urlfs import index_entry_key, locate
+from .signatures import get_matcher
+
+cache_subdir = 'parsed'
+max_cache_size = 20 * 1024 * 1024 * 1024 # bytes
+identify_read_size = 65536 # bytes read to identify a file's handler, if not given
+format_version = 1 # of the cache entries; bumping it invalidates all of them
+
+
+def load_columns(path, hint=None):
+    """
+    Return (header, columns) of the data file at path: header as given by its analysis handler's parseData, and
+    columns a dictionary of column name: read-only, memory-mapped numpy array. The file is parsed (into the cache)
+    first, unless already cached. hint selects the analysis handler; by default, it is identified from the data.
+    """
+    if np is None:
+        raise ImportError("numpy is needed to load parsed data (pip install autolaunch[parse])")
+    path = os.path.abspath(path)
+    handler = handler_for(path, hint)
+    hint = handler.getHint()
+
+    cachedir, source, validators = _locate(path)
+    key = hashlib.sha256("\t".join([str(format_version), hint, source, validators]).encode()).hexdigest()
+    entrydir = os.path.join(cachedir, key)
+    if not os.path.isfile(os.path.join(entrydir, 'meta.json')):
+        _build(path, handler, entrydir, {'source': source, 'validators': validators, 'hint': hint})
+        _evict(cachedir, keep=key)
+    with open(os.path.join(entrydir, 'meta.json'), "r") as f:
+        meta = json.load(f)
+    os.utime(os.path.join(entrydir, 'meta.json')) # recently used
+    columns = {}
+    for i, c in enumerate(meta['columns']):
+        columns[c] = np.load(os.path.join(entrydir, 'c%d.npy' % i), mmap_mode='r')
+    return meta['header'], columns
+
+
+def handler_for(path, hint=None):
+    """Return the analysis handler of hint, or if None, the one recognizing the data file at path."""
+    from . import analysis_handlers
+    if hint is None:
+        with open(path, "rb") as f:
+            hint = get_matcher(analysis_handlers).first(f.read(identify_read_size), path)
+        if hint is None:
+            raise ValueError("no analysis handler recognizes " + path)
+    return analysis_handlers[hint]
+
+
+def _locate(path):
+    # the cache directory for path, and the (source, validators) identifying its content
+    found = locate(path)
+    if found is not None:
+        store = get_store(found[0], readonly=True)
+        entry = None if store is None else store.find_index_entry(found[1])
+        key = None if entry is None else index_entry_key(entry[1])
+        if key is not None:
+            return os.path.join(found[0], cache_subdir), key[0], key[1]
+    st = os.stat(path)
+    return (os.path.join(os.path.expanduser('~'), '.cache', 'autolaunch', cache_subdir), path,
+            "%d\t%d" % (st.st_size, st.st_mtime_ns))
+
+
+def _build(path, handler, entrydir, meta):
+    # parse path into entrydir, built aside and then moved in place (so readers never see a partial entry)
+    tmp = entrydir + '.tmp-' + token_hex(8)
+    os.makedirs(tmp)
+    try:
+        with open(local_copy(path) or path, "rb") as f:
+            parsed = handler.parseData(f)
+            if parsed is None:
+                raise ValueError(handler.getHint() + " data cannot be parsed")
+            header, batches = parsed
+            columns = None
+            writers = []
+            try:
+                for batch in batches:
+                    if columns is None:
+                        columns = list(batch)
+                        writers = [_NpyWriter(os.path.join(tmp, 'c%d.npy' % i), batch[c].dtype) for i, c in enumerate(columns)]
+                    for c, w in zip(columns, writers):
+                        w.append(batch[c])
+            finally:
+                for w in writers:
+                    w.close()
+        meta.update({'header': header, 'columns': columns or [], 'rows': writers[0].rows if len(writers) > 0 else 0})
+        with open(os.path.join(tmp, 'meta.json'), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, entrydir)
+        except OSError:
+            shutil.rmtree(tmp) # built concurrently by someone else
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def _evict(cachedir, keep=None):
+    # drop least recently used entries (other than keep) until the cache fits in max_cache_size
+    entries = []
+    total = 0
+    for name in os.listdir(cachedir):
+        entrydir = os.path.join(cachedir, name)
+        try:
+            size = sum(os.path.getsize(os.path.join(entrydir, fil)) for fil in os.listdir(entrydir))
+            used = os.path.getmtime(os.path.join(entrydir, 'meta.json'))
+        except OSError:
+            continue # being built (or removed)
+        entries.append((used, name, size))
+        total += size
+    for used, name, size in sorted(entries):
+        if total <= max_cache_size:
+            break
+        if name != keep:
+            shutil.rmtree(os.path.join(cachedir, name), ignore_errors=True)
+            total -= size
+
+
+class _NpyWriter:
+    """Writer of a 1-d .npy file, appended to batch by batch (so its length is only known once closed)."""
+    def __init__(self, fil, dtype):
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.f = open(fil, "wb")
+        self.header_size = len(self._header(2 ** 62))
+        self.f.write(b'\0' * self.header_size)
+
+    def append(self, data):
+        np.ascontiguousarray(data, dtype=self.dtype).tofile(self.f)
+        self.rows += len(data)
+
+    def close(self):
+        if self.f.closed:
+            return
+        header = self._header(self.rows)
+        if len(header) != self.header_size:
+            raise ValueError("unexpected .npy header size")
+        self.f.seek(0)
+        self.f.write(header)
+        self.f.close()
+
+    def _header(self, rows):
+        out = BytesIO()
+        np.lib.format.write_array_header_1_0(out, {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                                                   'fortran_order': False, 'shape': (rows,)})
+        return out.getvalue()
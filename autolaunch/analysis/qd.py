@@ -0,0 +1,173 @@
+"""
+Reading of Quantum Design instrument data files (.dat), as written by both the MPMS3 and the PPMS (ACMS) software.
+
+A file is a header block (after a "[Header]" line, one comma-separated entry per line, ";" starting comments),
+then a "[Data]" line, a line of comma-separated column names, and a line of comma-separated values per measurement.
+Fields are blank wherever a quantity was not measured; those (and any other non-numeric fields) are read as NaN.
+
+Files can be many GB, so the data is read in chunks of chunk_size bytes, each converted by numpy in one go (blank
+fields having been filled in first), and yielded in batches of batch_rows rows, keeping memory use bounded. Lines
+the fast conversion cannot handle (text such as comments, quoted fields, or missing or extra fields) are picked out
+beforehand, also with numpy, and only those are converted field by field. Lines made of the same characters as numbers
+but that are not (such as "-" or "1.2.3") only show when numpy fails to convert them; the lines are then split in
+halves until those are found, so that the rest of the chunk is still converted at once.
+
+numpy is needed (pip install autolaunch[parse]).
+"""
+from io import BytesIO
+import csv
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+else:
+    _nan = np.frombuffer(b'nan', dtype=np.uint8)
+
+# bytes.translate table marking (with 1) the bytes that cannot make up lines of numbers
+_non_numeric = bytes(0 if c in b'0123456789.+-eEnaNAifIF \t,\n' else 1 for c in range(256))
+
+batch_rows = 65536 # rows per batch yielded
+chunk_size = 8 * 1024 * 1024 # bytes read (and converted) at once
+min_convert_lines = 16 # fewest lines converted at once, when looking for those numpy cannot convert
+
+
+def read_header(f):
+    """
+    Read the header of a .dat file (f, open in binary mode), up to and including the line of column names.
+    Returns (header lines, column names).
+    """
+    header = []
+    for l in f:
+        l = l.decode('latin-1').rstrip('\r\n')
+        if l.strip() == '[Data]':
+            break
+        if l.strip() != '[Header]':
+            header.append(l)
+    columns = f.readline().decode('latin-1').rstrip('\r\n').split(',')
+    return header, columns
+
+
+def read_dat(f, nrows=None):
+    """
+    Parse a .dat file (f, open in binary mode). Returns (header lines, batches), where batches yields dictionaries of
+    column name: float64 array of at most nrows (default: batch_rows) rows; at least one, possibly empty, is yielded.
+    """
+    if np is None:
+        raise ImportError("numpy is needed to parse data (pip install autolaunch[parse])")
+    header, columns = read_header(f)
+    return header, _batches(f, columns, nrows if nrows is not None else batch_rows)
+
+
+def parse_rows(data, columns):
+    """Parse whole lines of data (bytes, from the [Data] section) into a dictionary of column name: float64 array."""
+    if np is None:
+        raise ImportError("numpy is needed to parse data (pip install autolaunch[parse])")
+    return _to_batch(_parse_lines(data, len(columns)), columns)
+
+
+def _batches(f, columns, nrows):
+    ncols = len(columns)
+    rows = np.empty((0, ncols))
+    rest = b''
+    yielded = False
+    while True:
+        chunk = f.read(chunk_size)
+        data = rest + chunk
+        if len(chunk) > 0:
+            # only whole lines are converted; the partial last one waits for the next chunk
+            cut = data.rfind(b'\n') + 1
+            data, rest = data[:cut], data[cut:]
+        if len(data) > 0:
+            rows = np.concatenate([rows, _parse_lines(data, ncols)])
+        while len(rows) >= nrows or (len(chunk) == 0 and (len(rows) > 0 or not yielded)):
+            yield _to_batch(rows[:nrows], columns)
+            yielded = True
+            rows = rows[nrows:]
+        if len(chunk) == 0:
+            return
+
+
+def _parse_lines(data, ncols):
+    # data: whole lines, as bytes. Returns a 2-d array of their values, a row per (non blank) line.
+    text = data.replace(b'\r', b'') if b'\r' in data else data
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    buf = np.frombuffer(text, dtype=np.uint8)
+    seps = np.flatnonzero((buf == ord(',')) | (buf == ord('\n')))
+    newlines = np.flatnonzero(buf[seps] == ord('\n')) # among seps
+    ends = seps[newlines]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    nlines = len(ends)
+    keep = ends > starts # not blank
+    # lines that can be converted at once: ncols fields (so ncols - 1 commas), made of nothing but numbers
+    fast = keep & (np.diff(newlines, prepend=-1) - 1 == ncols - 1)
+    fast[np.searchsorted(ends, np.flatnonzero(np.frombuffer(text.translate(_non_numeric), dtype=bool)))] = False
+    rows = np.full((nlines, ncols), np.nan)
+    if np.any(fast):
+        lines = np.flatnonzero(fast)
+        sizes = ends[lines] - starts[lines] + 1
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        values = np.empty((len(lines), ncols))
+        failed = []
+        _convert_range(text if len(lines) == nlines else buf[np.repeat(fast, ends - starts + 1)].tobytes(),
+                       offsets, 0, len(lines), ncols, values, failed)
+        rows[lines] = values
+        fast[lines[failed]] = False
+    for i in np.flatnonzero(keep & ~fast):
+        l = text[starts[i]:ends[i]]
+        if len(l.strip()) > 0:
+            rows[i] = _parse_line(l, ncols)
+        else:
+            keep[i] = False
+    return rows[keep]
+
+
+def _convert_range(text, offsets, a, b, ncols, values, failed):
+    # convert lines a to b (starting at offsets[a], ...) of text into values[a:b]; as numpy rejects all lines if one
+    # has something it cannot convert (such as "-" or "1.2.3"), the lines are split in halves until those are found,
+    # which are added to failed (to be converted field by field)
+    converted = _convert(text[offsets[a]:offsets[b]], ncols)
+    if converted is not None and len(converted) == b - a:
+        values[a:b] = converted
+    elif b - a <= min_convert_lines:
+        failed.extend(range(a, b))
+    else:
+        mid = (a + b) // 2
+        _convert_range(text, offsets, a, mid, ncols, values, failed)
+        _convert_range(text, offsets, mid, b, ncols, values, failed)
+
+
+def _convert(text, ncols):
+    # convert lines of ncols numeric (or blank) fields, or return None if numpy cannot make sense of them
+    buf = np.frombuffer(text, dtype=np.uint8)
+    sep = (buf == ord(',')) | (buf == ord('\n'))
+    # blank fields: between two separators, or before a comma at the very start
+    blanks = np.flatnonzero(sep[:-1] & sep[1:]) + 1
+    if buf[0] == ord(','):
+        blanks = np.concatenate([[0], blanks])
+    if len(blanks) > 0:
+        text = np.insert(buf, np.repeat(blanks, 3), np.tile(_nan, len(blanks))).tobytes()
+    try:
+        return np.loadtxt(BytesIO(text), delimiter=',', comments=None, dtype=np.float64, ndmin=2).reshape(-1, ncols)
+    except ValueError:
+        return None
+
+
+def _parse_line(l, ncols):
+    l = l.decode('latin-1').rstrip('\r')
+    fields = next(csv.reader([l])) if '"' in l else l.split(',')
+    return [_to_float(v) for v in fields[:ncols]] + [np.nan] * (ncols - len(fields))
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except ValueError:
+        return np.nan
+
+
+def _to_batch(rows, columns):
+    # column-major, so that each column is contiguous
+    data = np.ascontiguousarray(rows.T)
+    return {c: data[i] for i, c in enumerate(columns)}
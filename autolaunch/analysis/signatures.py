@@ -0,0 +1,272 @@
+"""
+Declarative data signatures for analysis handlers, and a matcher that checks all of them in a single pass.
+
+Rather than (or in addition to) implementing checkIsDataType, a handler can return a list of Signature
+objects from getSignatures. The signatures of all handlers are compiled into one alternation regex, so that
+a file prefix is scanned once no matter how many handlers are installed, and every handler matching it is
+reported. Handlers that do not declare signatures are still asked through checkIsDataType.
+
+Literal patterns are merged into a trie, giving the effect of an Aho-Corasick automaton within the regex
+engine; a literal that is a prefix of others is reported along with the longer ones it is part of. As the combined
+regex reports one alternative per position, the other signatures are checked on their own wherever it matches, so
+that every signature matching is seen (the same handlers are found as when checking signatures one at a time).
+Signature regexes must not use backreferences or named groups, or global inline flags (use scoped (?i:...)
+instead).
+"""
+from fnmatch import translate
+import os
+import re
+
+# globs of files that are (nearly) never measurement data, for handlers to exclude (see Signature)
+non_data_globs = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.bmp', '*.tif', '*.tiff', '*.svg', '*.pdf', '*.txt',
+                  '*.log', '*.md', '*.doc', '*.docx', '*.xls', '*.xlsx', '*.ppt', '*.pptx', '*.zip', '*.gz',
+                  '*.tar', '*.7z', '*.ipynb', '*.py', '*.html', '*.htm']
+
+
+class Signature:
+    """
+    Something an analysis handler recognizes its data by.
+
+    pattern		bytes that must appear in the data (literally)
+    regex		bytes regular expression that must match in the data (instead of pattern)
+    max_lines		(Optional) the match must lie within this many lines of the beginning of the data
+    filename_globs	(Optional) list of globs, one of which the filename must match (case-insensitively).
+			Globs containing a '/' are matched against the whole path, others against the base name.
+    exclude_globs	(Optional) list of globs (as filename_globs) of files that are never this data
+    likely_globs	(Optional) list of globs (as filename_globs) of files that are likely this data, and
+			so are read first when looking for it
+
+    A signature with neither pattern nor regex matches on filename_globs alone, without reading any data. Content
+    signatures with filename_globs also let files with other names be ruled out without reading them, but then data
+    saved under any other name (or without an extension) is never recognized: only restrict content signatures
+    for data that cannot be named otherwise. Excluding the types that are certainly not the data (non_data_globs)
+    rules out most other files just as well, while likely_globs makes the usual names found first.
+    """
+    def __init__(self, pattern=None, regex=None, max_lines=None, filename_globs=None, exclude_globs=None,
+                 likely_globs=None):
+        if pattern is not None:
+            regex = re.escape(pattern)
+        self.pattern = pattern
+        self.regex = regex
+        self.max_lines = max_lines
+        self.filename_globs = filename_globs
+        self.exclude_globs = exclude_globs
+        self.likely_globs = likely_globs
+        self._filename_re = _globs_regex(filename_globs)
+        self._exclude_re = _globs_regex(exclude_globs)
+        self._likely_re = _globs_regex(likely_globs)
+
+    def matchesFilename(self, filename):
+        if filename is not None and _globs_match(self._exclude_re, filename):
+            return False
+        if self.filename_globs is None:
+            return True
+        if filename is None:
+            return False
+        return _globs_match(self._filename_re, filename)
+
+    def isLikely(self, filename):
+        return filename is not None and _globs_match(self._likely_re, filename) and self.matchesFilename(filename)
+
+
+class SignatureMatcher:
+    """
+    Identifies data for all handlers (a dictionary of hint: handler) at once.
+    """
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self._sigs = [] # (hint, signature), indexed by regex group name s<index>
+        self._compiled = [] # regex of each of _sigs on its own
+        self._name_only = [] # (hint, signature) matching on filename alone
+        self._legacy = set() # hints of handlers without signatures
+        self._by_hint = {} # hint: list of its signatures
+        literals = {}
+        alternatives = []
+        window = 0
+        for hint in handlers:
+            sigs = handlers[hint].getSignatures()
+            if sigs is None:
+                self._legacy.add(hint)
+                continue
+            self._by_hint[hint] = sigs
+            for sig in sigs:
+                if sig.regex is None:
+                    self._name_only.append((hint, sig))
+                    continue
+                name = b"s" + str(len(self._sigs)).encode()
+                self._sigs.append((hint, sig))
+                self._compiled.append(re.compile(sig.regex))
+                if sig.pattern is not None:
+                    literals.setdefault(sig.pattern, []).append(name)
+                else:
+                    alternatives.append(b"(?:" + sig.regex + b")(?P<" + name + b">)")
+                if window is not None:
+                    window = None if sig.max_lines is None else max(window, sig.max_lines)
+        if len(literals) > 0:
+            # literal patterns are merged into a trie, so the regex engine does not need to try every one of
+            # them at every position (this is what keeps the scan cost flat in the number of handlers)
+            alternatives.insert(0, _trie_regex(literals))
+        self._regex = re.compile(b"|".join(alternatives)) if len(alternatives) > 0 else None
+        self._window = window # lines beyond which no signature can match (None: no limit)
+        self._content_hints = {hint for hint, _ in self._sigs}
+
+    def _scan(self, data, filename):
+        found = set()
+        for hint, sig in self._name_only:
+            if sig.matchesFilename(filename):
+                found.add(hint)
+        if self._regex is None:
+            return found
+        end = len(data)
+        if self._window is not None:
+            # no need to scan past the last line any signature could match in
+            pos = -1
+            for _ in range(self._window):
+                pos = data.find(b"\n", pos + 1)
+                if pos < 0:
+                    break
+            if pos >= 0:
+                end = pos + 1
+        todo = self._content_hints - found
+        pos = 0
+        while len(todo) > 0:
+            m = self._regex.search(data, pos, end)
+            if m is None:
+                break
+            start = m.start()
+            pos = start + 1 # resume right after the start, to also see overlapping matches
+            matched = set(_matched_names(m))
+            lines = None
+            for i, (hint, sig) in enumerate(self._sigs):
+                if hint not in todo:
+                    continue
+                # signatures the combined regex did not report here may still match here
+                if not (i in matched) and self._compiled[i].match(data, start, end) is None:
+                    continue
+                if sig.max_lines is not None:
+                    if lines is None:
+                        lines = data.count(b"\n", 0, start)
+                    if lines >= sig.max_lines:
+                        continue
+                if not sig.matchesFilename(filename):
+                    continue
+                found.add(hint)
+                todo.discard(hint)
+        return found
+
+    def fromMetadata(self, filename, size=None):
+        """
+        Classify a file without reading it, from its name (or path) and size (if known). Returns the hint of the
+        handler recognizing it, '' if no handler can, or None if its data must be read to tell.
+        """
+        for hint in self.handlers:
+            if hint in self._legacy:
+                return None # checkIsDataType needs the data
+            sigs = [sig for sig in self._by_hint[hint] if sig.matchesFilename(filename)]
+            if any(sig.regex is None for sig in sigs):
+                return hint
+            if size != 0 and len(sigs) > 0:
+                return None # could match, depending on the data
+        return ''
+
+    def isSettled(self, hint, data, filename=None):
+        """
+        Whether hint, the first handler recognizing data (a prefix of a file), also is for any longer prefix of the
+        same file, i.e. whether no handler ordered before it could recognize more data.
+        """
+        lines = None
+        for h in self.handlers:
+            if h == hint:
+                return True
+            if h in self._legacy:
+                return False # checkIsDataType could look anywhere
+            for sig in self._by_hint[h]:
+                if sig.regex is None or not sig.matchesFilename(filename):
+                    continue
+                if sig.max_lines is None:
+                    return False
+                if lines is None:
+                    lines = data.count(b"\n")
+                if lines < sig.max_lines:
+                    return False # its window is not all there yet
+        return True
+
+    def isLikely(self, filename):
+        """Whether the name of a file (that fromMetadata could not settle) makes it likely data of some handler."""
+        return any(sig.isLikely(filename) for hint, sig in self._sigs)
+
+    def match(self, data, filename=None):
+        """Return the hints of all handlers recognizing data, in handler order."""
+        found = self._scan(data, filename)
+        return [hint for hint in self.handlers
+                if hint in found or (hint in self._legacy and self.handlers[hint].checkIsDataType(data, filename))]
+
+    def first(self, data, filename=None):
+        """Return the hint of the first (in handler order) handler recognizing data, or None."""
+        found = self._scan(data, filename)
+        for hint in self.handlers:
+            if hint in found or (hint in self._legacy and self.handlers[hint].checkIsDataType(data, filename)):
+                return hint
+        return None
+
+
+def _trie_regex(literals):
+    """
+    Build a regex matching any of literals (a dictionary of bytes: list of group names), in which the literals
+    form a trie, and which marks the end of each literal with empty named groups.
+    """
+    trie = {}
+    for lit, names in literals.items():
+        node = trie
+        for c in lit:
+            node = node.setdefault(c, {})
+        node[None] = names
+
+    def emit(node):
+        alts = []
+        for c in node:
+            if c is not None:
+                alts.append(re.escape(bytes([c])) + emit(node[c]))
+        if None in node:
+            # the end of a literal: mark it, and go on to any longer ones it is a prefix of
+            marks = b"".join(b"(?P<" + name + b">)" for name in node[None])
+            if len(alts) == 0:
+                return marks
+            return marks + b"(?:" + b"|".join(alts) + b")?"
+        if len(alts) == 1:
+            return alts[0]
+        return b"(?:" + b"|".join(alts) + b")"
+
+    return emit(trie)
+
+
+def _globs_regex(globs):
+    # (regex of the globs matched against the whole path, regex of those matched against the base name)
+    if globs is None:
+        return None, None
+    path = [translate(g.lower()) for g in globs if '/' in g]
+    name = [translate(g.lower()) for g in globs if not ('/' in g)]
+    return tuple(re.compile("|".join(p)) if len(p) > 0 else None for p in (path, name))
+
+
+def _globs_match(compiled, filename):
+    path_re, name_re = compiled
+    path = filename.lower()
+    return ((path_re is not None and path_re.match(path) is not None) or
+            (name_re is not None and name_re.match(os.path.basename(path)) is not None))
+
+
+def _matched_names(m):
+    # indices of the signatures whose (empty) marker groups took part in match m
+    return [int(name[1:]) for name, value in m.groupdict().items() if value is not None]
+
+
+_matchers = {}
+
+
+def get_matcher(handlers):
+    """Return a (cached) SignatureMatcher for handlers."""
+    key = tuple((hint, id(handlers[hint])) for hint in handlers)
+    if key not in _matchers:
+        _matchers[key] = SignatureMatcher(handlers)
+    return _matchers[key]
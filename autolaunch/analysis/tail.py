@@ -0,0 +1,126 @@
+"""
+Incremental reading of data files that are still being written, such as those of instrument runs lasting hours.
+
+tail_columns(path) parses a file once, remembering how far it got, and on every later call only reads the bytes
+appended since (through URLFS, a range read starting where the previous call left off), appending their rows to
+the arrays already parsed, so that re-running a notebook costs in proportion to the new data only:
+
+    from autolaunch.analysis.tail import tail_columns
+    header, data = tail_columns('remote/MPMS3/sample/run.dat')
+
+A partially written last line is left for the next call. If the file shrank, or its first bytes or the bytes just
+before where reading left off changed (the file was truncated, rewritten or rotated), it is parsed again from the
+start.
+
+The analysis handler must be able to parse its data in pieces (see AnalysisBaseHandlerClass.readHeader and
+parseRows). numpy is needed (pip install autolaunch[parse]).
+"""
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .columnar import handler_for
+
+chunk_size = 8 * 1024 * 1024 # bytes read (and parsed) at once
+anchor_size = 256 # bytes before the read offset checked to be unchanged
+
+_readers = {}
+
+
+def tail_columns(path, hint=None):
+    """
+    Return (header, columns) of the data file at path, as load_columns does (but with columns in memory), having
+    parsed whatever was appended to it since the last call.
+    """
+    path = os.path.abspath(path)
+    reader = _readers.get(path)
+    if reader is None or (hint is not None and reader.handler.getHint() != hint):
+        reader = _readers[path] = TailReader(path, hint)
+    reader.refresh()
+    return reader.header, reader.columns()
+
+
+class TailReader:
+    """Incrementally parsed contents of a data file that may still be growing."""
+    def __init__(self, path, hint=None):
+        if np is None:
+            raise ImportError("numpy is needed to parse data (pip install autolaunch[parse])")
+        self.path = path
+        self.handler = handler_for(path, hint)
+        self._reset()
+
+    def _reset(self):
+        self.header = None
+        self.names = []
+        self.offset = 0 # of the first byte not parsed yet (the start of a line)
+        self.rows = 0
+        self.reparses = 0
+        self._data = {}
+        self._anchor = b'' # the bytes just before offset
+        self._head = b'' # the first bytes of the file (of its header)
+
+    def refresh(self):
+        """Parse what was appended since the last call (or everything, the first time). Returns the rows added."""
+        rows = self.rows
+        with open(self.path, "rb") as f:
+            if self.header is not None and not self._unchanged(f):
+                reparses = self.reparses + 1
+                self._reset()
+                self.reparses = reparses
+                rows = 0
+                f.seek(0)
+            if self.header is None:
+                parsed = self.handler.readHeader(f)
+                if parsed is None:
+                    raise ValueError(self.handler.getHint() + " data cannot be read incrementally")
+                self.header, self.names = parsed
+                self.offset = f.tell()
+                f.seek(0)
+                self._head = f.read(min(self.offset, anchor_size))
+                f.seek(max(self.offset - anchor_size, 0))
+                self._anchor = f.read(self.offset - f.tell())
+            buf = b''
+            while True:
+                chunk = f.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                buf += chunk
+                cut = buf.rfind(b'\n') + 1
+                if cut > 0:
+                    batch = self.handler.parseRows(buf[:cut], self.names)
+                    if batch is None:
+                        raise ValueError(self.handler.getHint() + " data cannot be read incrementally")
+                    self._append(batch)
+                    self._anchor = (self._anchor + buf[max(cut - anchor_size, 0):cut])[-anchor_size:]
+                    self.offset += cut
+                    buf = buf[cut:]
+        return self.rows - rows
+
+    def columns(self):
+        """Dictionary of column name: numpy array of the rows parsed so far."""
+        return {c: self._data[c][:self.rows] for c in self.names if c in self._data}
+
+    def _unchanged(self, f):
+        # whether the file still has, at its start and just before offset, the bytes it had when parsed up to there
+        if os.fstat(f.fileno()).st_size < self.offset:
+            return False
+        if f.read(len(self._head)) != self._head:
+            return False
+        f.seek(self.offset - len(self._anchor))
+        return f.read(len(self._anchor)) == self._anchor # leaves f at offset
+
+    def _append(self, batch):
+        n = len(batch[self.names[0]]) if len(self.names) > 0 else 0
+        for c in self.names:
+            data = self._data.get(c)
+            if data is None or len(data) < self.rows + n:
+                # grow geometrically, so that appending stays proportional to the rows appended
+                grown = np.empty(max(self.rows + n, 2 * (0 if data is None else len(data)), 1024), dtype=batch[c].dtype)
+                if data is not None:
+                    grown[:self.rows] = data[:self.rows]
+                self._data[c] = data = grown
+            data[self.rows:self.rows + n] = batch[c]
+        self.rows += n
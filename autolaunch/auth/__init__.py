@@ -1,11 +1,11 @@
 """
-This imports all known autolaunch auth handlers. At some point, it should be
-rewritten to automatically discover all handlers installed here, so that
-adding a handler is as easy as adding a file. But for now, it is a small
-enough number, we do it manually.
+The known autolaunch auth handlers: the built-in ones, and those installed as entry points of the
+autolaunch.auth_handlers group (named after their hint, see _registry.py), so that adding a handler
+only takes installing it. A handler's module is imported only once the handler is first needed.
 """
-from .polyauth import PolyauthAuthHandlerClass
-
-auth_handlers = {PolyauthAuthHandlerClass.getHint(): PolyauthAuthHandlerClass,
-                }
+from .._registry import HandlerRegistry
 
+auth_handlers = HandlerRegistry('autolaunch.auth_handlers', {
+    'polyauth': __name__ + '.polyauth:PolyauthAuthHandlerClass',
+    'oauth2': __name__ + '.oauth2:OAuth2AuthHandlerClass',
+})
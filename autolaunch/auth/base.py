@@ -19,4 +19,28 @@ class AuthBaseHandlerClass(ABC):
     @abstractmethod
     def getHint():
         pass
+    def getExpiry(self):
+        """When (as a unix timestamp) the credentials expire, or None if not known."""
+        refresh_info = self.getRefreshInfo()
+        if refresh_info is None:
+            return None
+        return refresh_info.get('expires')
+    @classmethod
+    async def getRedirectInfo(cls, refresh_info):
+        """Where (and how) to send the browser for the user to obtain new credentials, given refresh_info."""
+        return refresh_info['initial_redirect']
+    @classmethod
+    async def fromCallback(cls, auth_uuid, auth_token, refresh_info, handler):
+        """
+        Return an auth handler holding the new credentials that the refresh-auth callback for auth_uuid was given
+        (as auth_token), or None if they could not be obtained.
+        """
+        return cls(auth_token, refresh_info=refresh_info, handler=handler)
+    @classmethod
+    async def refreshSilently(cls, auth_uuid, refresh_info):
+        """
+        Obtain new credentials for auth_uuid from refresh_info (as returned by getRefreshInfo) without user interaction,
+        e.g. with an oauth2 refresh token. Returns an auth handler holding them, or None if the user is needed.
+        """
+        return None
 
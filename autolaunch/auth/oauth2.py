@@ -0,0 +1,172 @@
+"""
+OAuth2 auth handler.
+
+auth_token is base64 of a JSON object holding the token response of the authorization server (access_token, and
+optionally refresh_token, expires_in or expires_at), together with what is needed to refresh it: client_id (and
+client_secret for confidential clients), scope, and either the issuer (whose endpoints are then discovered) or the
+authorization_endpoint and token_endpoint themselves.
+
+Access tokens are renewed silently with the refresh token while it lasts; otherwise the user goes through the
+authorization code flow again (via /autolaunch/refresh-auth), the code being exchanged when the callback comes in.
+All requests to the authorization server go through the shared asynchronous HTTP client.
+"""
+from .base import AuthBaseHandlerClass
+
+import asyncio
+import json
+import time
+from base64 import urlsafe_b64decode
+from secrets import token_hex
+from urllib.parse import urlencode
+
+from tornado.httpclient import HTTPRequest
+
+from .._http import get_http_client
+
+client_fields = ('issuer', 'authorization_endpoint', 'token_endpoint', 'client_id', 'client_secret', 'scope')
+discovery_ttl = 3600 # seconds the metadata of an issuer is cached
+request_timeout = 30
+
+_discovery = {} # issuer -> (when fetched, metadata)
+_discovering = {} # issuer -> task fetching its metadata
+
+
+class OAuth2AuthHandlerClass(AuthBaseHandlerClass):
+    hint = "oauth2"
+    token = None
+    refresh_token = None
+    expires = None
+
+    def __init__(self, auth_token, refresh_info=None, handler=None):
+        self.uuid = token_hex(16)
+        if refresh_info is None:
+            if not (auth_token is None) and len(auth_token) > 0:
+                params = json.loads(urlsafe_b64decode(auth_token + '=' * ((4 - len(auth_token)) % 4)))
+            else:
+                params = {}
+            self.client = {k: params[k] for k in client_fields if k in params}
+        else:
+            # auth_token is then a token response obtained for the client of refresh_info
+            params = json.loads(auth_token) if not (auth_token is None) and len(auth_token) > 0 else {}
+            self.client = refresh_info.get('client', {})
+            params.setdefault('refresh_token', refresh_info.get('refresh_token'))
+        self.token = params.get('access_token')
+        self.refresh_token = params.get('refresh_token')
+        if 'expires_at' in params:
+            self.expires = float(params['expires_at'])
+        elif 'expires_in' in params:
+            self.expires = time.time() + float(params['expires_in'])
+
+    def getAuthUUID(self):
+        return self.uuid
+
+    def getAuthHeaders(self):
+        if not (self.token is None) and len(self.token) > 0:
+            return ["Authorization: Bearer " + self.token]
+        else:
+            return []
+
+    def getRefreshInfo(self):
+        refresh_info = {"client": self.client}
+        if 'authorization_endpoint' in self.client:
+            refresh_info["initial_redirect"] = _initial_redirect(self.client, self.client['authorization_endpoint'])
+        if not (self.refresh_token is None):
+            refresh_info["refresh_token"] = self.refresh_token
+        if not (self.expires is None):
+            refresh_info["expires"] = self.expires
+        return refresh_info
+
+    @staticmethod
+    def getHint():
+        return OAuth2AuthHandlerClass.hint
+
+    @classmethod
+    async def getRedirectInfo(cls, refresh_info):
+        if 'initial_redirect' in refresh_info:
+            return refresh_info['initial_redirect']
+        metadata = await _endpoints(refresh_info.get('client', {}))
+        return _initial_redirect(refresh_info['client'], metadata['authorization_endpoint'])
+
+    @classmethod
+    async def fromCallback(cls, auth_uuid, auth_token, refresh_info, handler):
+        redirect_uri = handler.request.protocol + "://" + handler.request.host + handler.base_url + "autolaunch/refresh-auth/callback"
+        response = await _token_request(refresh_info.get('client', {}), grant_type='authorization_code', code=auth_token,
+                                        redirect_uri=redirect_uri)
+        if response is None:
+            return None
+        authhandler = cls(json.dumps(response), refresh_info=refresh_info, handler=handler)
+        authhandler.uuid = auth_uuid
+        return authhandler
+
+    @classmethod
+    async def refreshSilently(cls, auth_uuid, refresh_info):
+        if refresh_info.get('refresh_token') is None:
+            return None
+        response = await _token_request(refresh_info.get('client', {}), grant_type='refresh_token',
+                                        refresh_token=refresh_info['refresh_token'])
+        if response is None:
+            return None # refresh token expired or revoked: the user is needed
+        authhandler = cls(json.dumps(response), refresh_info=refresh_info)
+        authhandler.uuid = auth_uuid
+        return authhandler
+
+
+def _initial_redirect(client, authorization_endpoint):
+    params = {"response_type": "code", "client_id": client.get('client_id', '')}
+    if 'scope' in client:
+        params["scope"] = client['scope']
+    return {"method": "GET", "endpoint": authorization_endpoint, "params": params}
+
+
+async def _endpoints(client):
+    # the endpoints of client's authorization server, as given or discovered
+    if 'authorization_endpoint' in client and 'token_endpoint' in client:
+        return client
+    if not ('issuer' in client):
+        raise ValueError("oauth2 client has neither endpoints nor issuer")
+    metadata = dict(await discover(client['issuer']))
+    metadata.update({k: client[k] for k in ('authorization_endpoint', 'token_endpoint') if k in client})
+    return metadata
+
+
+async def discover(issuer):
+    """
+    Return the (OpenID Connect or OAuth2 authorization server) metadata of issuer, cached for discovery_ttl seconds.
+    Concurrent requests for the same issuer share a single fetch.
+    """
+    cached = _discovery.get(issuer)
+    if not (cached is None) and time.monotonic() - cached[0] < discovery_ttl:
+        return cached[1]
+    task = _discovering.get(issuer)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_discovery(issuer))
+        _discovering[issuer] = task
+        task.add_done_callback(lambda t: _discovering.pop(issuer, None))
+    return await asyncio.shield(task)
+
+
+async def _fetch_discovery(issuer):
+    for path in ('/.well-known/openid-configuration', '/.well-known/oauth-authorization-server'):
+        response = await get_http_client().fetch(HTTPRequest(issuer.rstrip('/') + path, request_timeout=request_timeout,
+                                                             headers={'Accept': 'application/json'}), raise_error=False)
+        if response.code == 200:
+            metadata = json.loads(response.body)
+            _discovery[issuer] = (time.monotonic(), metadata)
+            return metadata
+    response.rethrow()
+    raise ValueError("no authorization server metadata for " + issuer)
+
+
+async def _token_request(client, **form):
+    # POST form to the token endpoint of client. Returns the token response, or None if the grant was refused.
+    metadata = await _endpoints(client)
+    form['client_id'] = client.get('client_id', '')
+    if 'client_secret' in client:
+        form['client_secret'] = client['client_secret']
+    request = HTTPRequest(metadata['token_endpoint'], method='POST', body=urlencode(form), request_timeout=request_timeout,
+                          headers={'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'})
+    response = await get_http_client().fetch(request, raise_error=False)
+    if response.code in (400, 401):
+        return None # e.g. invalid_grant
+    response.rethrow()
+    return json.loads(response.body)
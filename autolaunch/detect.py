@@ -0,0 +1,183 @@
+"""
+Identification of which analysis handler applies to a set of launched files.
+
+File prefixes are read through the URLFS mount, so every read costs (at least) one round trip to a remote
+server. To keep the time to first redirect low, prefixes of several files are read concurrently, reads
+start small and only grow when no handler has matched yet (or a handler ordered before the one that did could
+still match further on), and as soon as the answer is known, all outstanding reads are cancelled.
+
+For multi-type launches, every file is classified instead (see detect_analysis_hints), but reading still
+stops as soon as every handler has been found. As a launch seldom holds data of every type, reading also stops
+once max_fruitless_reads files in a row were read without turning up a new type: the scan is bounded however
+many files are launched, at the cost of missing a type whose first file comes after that many others.
+
+Files whose names make them likely data of some handler (see analysis.signatures.Signature.likely_globs, e.g.
+*.dat) are read first, and the others after them. Up to the bound above, the result is the same as checking files
+one at a time, in that order: the hint returned is that of the first file any handler recognizes, and for that
+file, the first (in dictionary order) handler that recognizes it. This assumes handlers recognize data
+monotonically, i.e. that a handler matching a prefix also matches any longer prefix of the same file (true of
+marker-in-first-lines checks).
+
+Before any data is read, files are classified from what their URLFS index lines tell about them (name, path
+and size), which is often enough to rule out every handler (or to pick one) without any I/O; see
+analysis.signatures.SignatureMatcher.fromMetadata.
+
+Results can be cached (see store.ConfigStore.lookup_detections) per remote file, keyed by its URL and the
+validators from its URLFS index line. Files with a cached result are never read, so relaunching the same
+data needs no remote reads at all. Cached results are only valid for the same set of handlers, as adding
+a handler can change the answer.
+"""
+from collections import deque
+import asyncio
+import threading
+import logging
+
+from ._blocking import run_blocking
+from .urlfs import index_entry_key, index_entry_size
+from .analysis.signatures import get_matcher
+
+log = logging.getLogger(__name__)
+
+initial_read_size = 4096
+max_read_size = 65536 # 64k should be enough for anyone
+max_fruitless_reads = 100 # consecutive reads turning up no new type after which identification stops (None: never)
+
+# counters since server start
+stats = {
+    'launches': 0, # identifications run
+    'launches_without_reads': 0, # ... of which were resolved without reading any remote data
+    'files_by_metadata': 0, # files resolved from their name and size alone
+    'files_by_cache': 0, # files resolved from the detection cache
+    'files_not_cached': 0, # files looked up in the detection cache, but not found there
+    'files_read': 0, # files whose data had to be read
+    'bytes_read': 0, # ... and how much of it
+    'launches_given_up': 0, # identifications stopped after max_fruitless_reads reads found nothing new
+}
+
+
+def _classify_file(fil, matcher, cancelled):
+    """
+    Read a growing prefix of fil until one of matcher's handlers recognizes it (its hint) and no handler ordered
+    before it could with more data, or until the end of file or max_read_size is reached (the hint of the first
+    handler recognizing what was read, or ''). Gives up early (None) once cancelled is set. Returns (hint, bytes read).
+    """
+    data = b''
+    size = initial_read_size
+    with open(fil, "rb") as f:
+        while not cancelled.is_set():
+            chunk = f.read(size - len(data))
+            data += chunk
+            ah = matcher.first(data, fil)
+            if ah is not None and matcher.isSettled(ah, data, fil):
+                return ah, len(data)
+            if len(data) < size or size >= max_read_size:
+                return ah or '', len(data) # whole file (or all we are willing to read) seen
+            size = min(size * 4, max_read_size)
+    return None, len(data)
+
+
+async def detect_analysis_hint(files, handlers, concurrency=4, timeout=None, index_lines=None, cache=None,
+                               max_fruitless_reads=max_fruitless_reads):
+    """
+    Return the hint of the analysis handler (from handlers, a dictionary of hint: handler) recognizing files,
+    or '' if none does (among the first max_fruitless_reads files read). At most concurrency files are read at
+    once, and each file is given timeout seconds.
+
+    If index_lines (the URLFS index line of each file) are given, files are first classified from their name and
+    size alone, and only read if that is not conclusive. If cache (a ConfigStore) is also given, cached results
+    are used in place of reading files, and new results are added to the cache.
+    """
+    hints = await _identify(files, handlers, concurrency, timeout, index_lines, cache, False, max_fruitless_reads)
+    return hints[0] if len(hints) > 0 else ''
+
+
+async def detect_analysis_hints(files, handlers, concurrency=4, timeout=None, index_lines=None, cache=None,
+                                max_fruitless_reads=max_fruitless_reads):
+    """
+    Like detect_analysis_hint, but classify every file, returning the hints of all handlers recognizing any of
+    them (in the order of the first file each recognizes). Stops early once every handler has been found, or
+    once max_fruitless_reads files in a row were read without finding a new one.
+    """
+    return await _identify(files, handlers, concurrency, timeout, index_lines, cache, True, max_fruitless_reads)
+
+
+async def _identify(files, handlers, concurrency, timeout, index_lines, cache, find_all, max_fruitless_reads):
+    cancelled = threading.Event()
+    matcher = get_matcher(handlers)
+    if index_lines is None:
+        index_lines = [None] * len(files)
+    sizes = [None if l is None else index_entry_size(l) for l in index_lines]
+    keys = [None] * len(files)
+    cached = {}
+    results = {}
+    if cache is not None:
+        fingerprint = "\t" + ",".join(handlers)
+        for i, l in enumerate(index_lines):
+            k = None if l is None else index_entry_key(l)
+            if k is not None:
+                keys[i] = (k[0], k[1] + fingerprint)
+        cached = await run_blocking(cache.lookup_detections, [k for k in keys if k is not None], timeout=timeout)
+    reads = [0]
+
+    async def classify(fil, size, key):
+        # cheapest first: metadata, then the cache, and only then the data itself; returns (hint, whether it was read)
+        hint = matcher.fromMetadata(fil, size)
+        if hint is not None:
+            stats['files_by_metadata'] += 1
+            return hint, False
+        if key in cached:
+            stats['files_by_cache'] += 1
+            results[key] = cached[key] # keeps it recently used
+            return cached[key], False
+        if key is not None:
+            stats['files_not_cached'] += 1
+        reads[0] += 1
+        stats['files_read'] += 1
+        try:
+            hint, size = await run_blocking(_classify_file, fil, matcher, cancelled, timeout=timeout, remote=True)
+        except (OSError, asyncio.TimeoutError):
+            log.warning("autolaunch: unable to read %s for identification, skipping", fil)
+            return None, True
+        stats['bytes_read'] += size
+        if key is not None and hint is not None:
+            results[key] = hint
+        return hint, True
+
+    found = []
+    fruitless = 0 # reads since the last new type was found
+    pending = deque()
+    # likely data first, each group in list order
+    order = sorted(range(len(files)), key=lambda i: not matcher.isLikely(files[i]))
+    remaining = ((files[i], sizes[i], keys[i]) for i in order)
+    try:
+        for entry in remaining:
+            pending.append(asyncio.ensure_future(classify(*entry)))
+            if len(pending) >= concurrency:
+                break
+        while len(pending) > 0:
+            # results are consumed in reading order, so the answer does not depend on which reads finish first
+            hint, read = await pending.popleft()
+            if hint and not (hint in found):
+                found.append(hint)
+                fruitless = 0
+                if not find_all or len(found) == len(handlers):
+                    return found
+            elif read:
+                fruitless += 1
+                if max_fruitless_reads is not None and fruitless >= max_fruitless_reads:
+                    stats['launches_given_up'] += 1
+                    return found
+            for entry in remaining:
+                pending.append(asyncio.ensure_future(classify(*entry)))
+                break
+        return found
+    finally:
+        cancelled.set()
+        for task in pending:
+            task.cancel()
+        stats['launches'] += 1
+        if reads[0] == 0:
+            stats['launches_without_reads'] += 1
+        log.debug("autolaunch: identification of %d files needed %d remote reads", len(files), reads[0])
+        if cache is not None and len(results) > 0:
+            await run_blocking(cache.record_detections, results, timeout=timeout)
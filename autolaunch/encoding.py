@@ -0,0 +1,73 @@
+"""
+Encodings of the "files" parameter of /autolaunch (a list of URLFS index lines).
+
+Two formats are accepted, told apart by their first character:
+
+- Plain: base64url of a JSON list of index lines (always begins with 'W', the encoding of '[').
+- Compact (version 1): '~1' followed by base64url of the raw deflate compression of the lines, one per line,
+  with every tab separated field front-coded against the same field of the previous line: written as the
+  number of leading characters it shares with that field, a ':', and the rest of the field. As consecutive
+  lines typically share their directory, URL prefix and most of their validators, this (and the compression
+  that follows) lets many more files fit in a GET request than the plain format does.
+
+'~' is not part of the base64url alphabet, so further versions can be added the same way.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import json
+import zlib
+
+compact_marker = '~1'
+max_decoded_size = 64 * 1024 * 1024 # refuse to inflate beyond this
+
+
+def _b64decode(data):
+    return urlsafe_b64decode(data + '=' * ((4 - len(data)) % 4))
+
+
+def decode_files(data):
+    """Decode a files parameter (in either format) into a list of URLFS index lines."""
+    if not data.startswith('~'):
+        return json.loads(_b64decode(data))
+    if not data.startswith(compact_marker):
+        raise ValueError("unknown files encoding " + data[:2])
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    text = inflater.decompress(_b64decode(data[len(compact_marker):]), max_decoded_size)
+    if not inflater.eof: # output still pending (whether or not all input was consumed), or cut short
+        raise ValueError("files list too large" if len(text) >= max_decoded_size else "files list truncated")
+    lines = []
+    prev = []
+    for l in text.decode().split('\n'):
+        if len(l) == 0:
+            continue
+        fields = []
+        for i, f in enumerate(l.split('\t')):
+            shared, rest = f.split(':', 1)
+            shared = int(shared)
+            fields.append((prev[i][:shared] if shared > 0 else '') + rest)
+        lines.append('\t'.join(fields))
+        prev = fields
+    return lines
+
+
+def encode_files(lines, compact=True):
+    """Encode a list of URLFS index lines as a files parameter (for use by whatever builds launch links)."""
+    if not compact:
+        return urlsafe_b64encode(json.dumps(lines).encode()).decode().rstrip('=')
+    out = []
+    prev = []
+    for l in lines:
+        fields = l.split('\t')
+        coded = []
+        for i, f in enumerate(fields):
+            shared = 0
+            if i < len(prev):
+                p = prev[i]
+                n = min(len(p), len(f))
+                while shared < n and p[shared] == f[shared]:
+                    shared += 1
+            coded.append(str(shared) + ':' + f[shared:])
+        out.append('\t'.join(coded))
+        prev = fields
+    deflater = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    packed = deflater.compress('\n'.join(out).encode()) + deflater.flush()
+    return compact_marker + urlsafe_b64encode(packed).decode().rstrip('=')
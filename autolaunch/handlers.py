@@ -1,22 +1,29 @@
 from tornado import web
-from base64 import urlsafe_b64decode
+from tornado.iostream import StreamClosedError
+from tornado.escape import xhtml_escape, url_escape
+from urllib.parse import urlencode
 from shutil import copyfile
 from pathlib import Path
-from signal import SIGUSR1
-import subprocess
 import json
 import os
 
 from io import BytesIO
 
-from .analysis import analysis_handlers
 from .auth import auth_handlers
+from ._blocking import run_blocking
+from .store import get_store
+from .urlfs import get_mount
+from .launch import Launcher
+from .jobs import LaunchJobs
+from .metrics import Trace, render
+from .refresh import RefreshScheduler
 
 from ._compat import get_base_handler
 JupyterHandler = get_base_handler()
 
 class AutoLaunchHandler(JupyterHandler):
-    analysis_notebooks_src = '/autolaunch/notebooks' # TODO: should be learned by inference, but for now, hard-coded
+    # whether launches run as background jobs (the browser being shown their progress), or the browser waits for them
+    background = True
     """
     The /autolaunch endpoint.
     """
@@ -35,112 +42,147 @@ class AutoLaunchHandler(JupyterHandler):
         to retrieve the actual parameters to this call. We deal with the latter by calling the secrets containing blob "auth_token"
         (even if it is not actually a token) so that jupyter server masks it in log files.
 
-        Parameters to this call should be either (TODO: OTS not yet implemented):
+        Parameters to this call should be either:
         ots_callback_url	URL to send a POST request to, to obtain our actual parameters. base64 encoded
-	ots_callback_hdrs	(Optional) If provided, headers to send along with the POST request
+	ots_callback_hdrs	(Optional) If provided, headers to send along with the POST request (see ots.py for formats)
         *OR*
         auth_token		Auth token data in format expected by chosen auth handler
 	auth_token_hint		(Optional) select auth handler. Default: polyauth
 	files			List of files/directory structure to present inside notebook, in URLFS index file format
+				(see encoding.py for how it is encoded)
 
         An optional parameter "title" can also be provided to change the name of where the resulting analysis is stored
         from the default.
+
+        The launch itself (see launch.py) runs as a background job, and the browser is sent to a page showing its progress.
         """
-        token_hint = self.get_argument('auth_token_hint', 'polyauth') # default is polyauth. Maybe change to oauth2 at some point?
-        if not (token_hint in auth_handlers):
-            return self.send_error()
+        params = {k: self.get_argument(k) for k in self.request.arguments}
+        basedir = os.path.expanduser(self.settings['server_root_dir'])
+        base_url = self.base_url
+        if not self.background:
+            return self.redirect(await Launcher(basedir, base_url).run(params))
 
-        authhandler = auth_handlers[token_hint](self.get_argument('auth_token', ''))
-        token_hdrs = authhandler.getAuthHeaders()
-        files_urlfs = self.get_argument('files', 'W10') # W10= is [], aka empty JSON list
-        files_urlfs = json.loads(urlsafe_b64decode(files_urlfs + '=' * ((4 - len(files_urlfs)) % 4)))
+        jobs = self.settings.setdefault('autolaunch_jobs', LaunchJobs())
+        job = jobs.start(params, lambda progress: Launcher(basedir, base_url, progress).run(params))
+        return self.redirect(self.base_url + 'autolaunch/jobs/' + job.id)
 
+
+class BatchLaunchHandler(JupyterHandler):
+    """
+    The /autolaunch/batch endpoint.
+
+    POST a JSON list of launches (or an object with the list as "launches"), each an object with the same parameters
+    as /autolaunch (auth_token, auth_token_hint, files, analysis_hint; OTS is not supported here), to provision
+    many datasets at once. All of them are registered with a single configuration change and URLFS reload.
+    Returns a JSON object whose "results" list holds, for each launch in turn, either the "url" of its analysis
+    and the "analysis_hints" found, or an "error".
+    """
+    @web.authenticated
+    async def post(self):
+        try:
+            batch = json.loads(self.request.body)
+            if isinstance(batch, dict):
+                batch = batch['launches']
+            batch = [{k: str(v) for k, v in params.items()} for params in batch]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise web.HTTPError(400, "malformed batch")
         basedir = os.path.expanduser(self.settings['server_root_dir'])
-        mountdir = os.path.join(basedir,'remote')
-        analysis_subpath = 'analysis'
-        analysisdir = os.path.join(basedir,analysis_subpath)
-        configdir = os.path.join(basedir,'.remote-config')
+        results = await Launcher(basedir, self.base_url).launch_batch(batch)
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        await self.finish(json.dumps({'results': results}))
+
+
+class CompactHandler(JupyterHandler):
+    """
+    The /autolaunch/compact endpoint.
+
+    POST to remove orphaned, expired and duplicated sources from the URLFS configuration (as is also done when the
+    server starts). Returns a JSON object counting what was removed.
+    """
+    @web.authenticated
+    async def post(self):
+        basedir = os.path.expanduser(self.settings['server_root_dir'])
+        removed = await Launcher(basedir, self.base_url).compact()
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        await self.finish(json.dumps(removed if removed is not None else {}))
+
+
+class LaunchJobHandler(JupyterHandler):
+    """
+    The /autolaunch/jobs/<id> endpoint.
+
+    Shows the progress of a launch job, and sends the browser on to the analysis once done.
+    """
+    @web.authenticated
+    async def get(self, job_id):
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        job = self.settings.setdefault('autolaunch_jobs', LaunchJobs()).get(job_id)
+        if job is None:
+            raise web.HTTPError(404)
+        if job.result() is not None:
+            return self.redirect(job.result())
+
+        events_url = self.base_url + 'autolaunch/jobs/' + job_id + '/events'
+        return_page = "<html><head><title>Launching...</title>"
+        return_page += "<noscript><meta http-equiv=\"refresh\" content=\"2\"/></noscript>"
+        return_page += "<script type=\"text/javascript\">function sf() {var es = new EventSource(\"" + events_url + "\");"
+        return_page += "es.onmessage = function(e) {var ev = JSON.parse(e.data);"
+        return_page += "if (ev.phase == \"done\") {es.close(); window.location.replace(ev.url); return;}"
+        return_page += "if (ev.phase == \"failed\") {es.close(); document.getElementById(\"phase\").textContent = \"Launch failed: \" + ev.error; return;}"
+        return_page += "document.getElementById(\"phase\").textContent = ev.phase + \"...\";};}</script></head>"
+        return_page += "<body><p>Preparing your data and analysis.</p><p id=\"phase\">Starting...</p>"
+        return_page += "<footer><script type=\"text/javascript\">sf();</script></footer>"
+        return_page += "</body></html>"
+        await self.finish(return_page)
+
+
+class LaunchJobEventsHandler(JupyterHandler):
+    """
+    The /autolaunch/jobs/<id>/events endpoint.
 
-        # Get files as will appear to us, not as needed by urlfs
-        files = []
-        for f in files_urlfs:
-            if f.split('\t')[0] == 'F':
-                files.append(os.path.join(mountdir,f.split('\t')[1][1:])) # [1:] needed to remove first slash in front of all URLFS names
-
-        # Ensure that requisite directories exist
-        if not os.path.isdir(analysisdir):
-            os.mkdir(analysisdir)
-        if not os.path.isdir(configdir):
-            os.mkdir(configdir)
-
-        # Add access to new files if provided.
-        if len(files) > 0:
-            # Find first available new index file
-            i = 0
-            while os.path.isfile(os.path.join(configdir,"remote."+str(i))):
-                i = i + 1
-            idxfile = os.path.join(configdir,"remote."+str(i))
-
-            # Add necessary refresh info to file in case we need to refresh this token later
-            with open(os.path.join(configdir,'token-refresh.config'),"a") as f:
-                f.write(idxfile)
-                f.write('\t')
-                f.write(authhandler.getAuthUUID())
-                f.write('\t')
-                f.write(token_hint)
-                f.write('\t')
-                f.write(json.dumps(authhandler.getRefreshInfo()))
-                f.write('\n')
-
-            # Add index file to that known to URLFS
-            with open(os.path.join(configdir,'remote.config'),"a") as f:
-                f.write(idxfile)
-                if len(token_hdrs) > 0:
-                    for h in token_hdrs:
-                        f.write("\t" + h)
-                f.write("\n")
-
-            with open(idxfile,"w") as f:
-                for fil in files_urlfs:
-                    f.write(fil + "\n")
-
-            # mount urlfs if not already mounted
-            if not os.path.ismount(mountdir):
-                # mount
-                os.mkdir(mountdir)
-                subprocess.run(["/urlfs/src/mount.urlfs", os.path.join(configdir,'remote.config'), mountdir])
-            else:
-                # reload urlfs (multiple should not be found, but in case user also used it separately from us,
-                # reload all instances)
-                for pid in map(int,subprocess.check_output(["pidof","mount.urlfs"]).split()):
-                    os.kill(pid,SIGUSR1)
-
-
-        analysis_hint = self.get_argument('analysis_hint','')
-        if not (analysis_hint in analysis_handlers):
-            # Try to figure out which type of analysis notebook we need to copy over
-            for fil in files:
-                # once we have figured out one, we are done. If working with multiple file types,
-                # autolaunch is called multiple times, once for each file type.
-                if len(analysis_hint) > 0:
+    Streams the phases of a launch job as server-sent events, ending with a "done" (carrying the URL to go to) or
+    "failed" event.
+    """
+    @web.authenticated
+    async def get(self, job_id):
+        job = self.settings.setdefault('autolaunch_jobs', LaunchJobs()).get(job_id)
+        if job is None:
+            raise web.HTTPError(404)
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        seen = 0
+        try:
+            while True:
+                while seen < len(job.events):
+                    self.write("data: " + json.dumps(job.events[seen]) + "\n\n")
+                    seen += 1
+                await self.flush()
+                if job.finished and seen == len(job.events):
                     break
-                # read only first part of file for ID purposes. 64k should be enough for anyone
-                pdat = ''
-                with open(fil, "rb") as f:
-                    pdat = f.read(65536)
-                # iterate over analysis handlers to find a suitable one
-                for ah in analysis_handlers:
-                    if analysis_handlers[ah].checkIsDataType(pdat, fil):
-                        analysis_hint = ah
-                        break
+                await job.wait(seen)
+        except StreamClosedError:
+            return # browser went away; the job carries on regardless
+        await self.finish()
 
-        if analysis_hint in analysis_handlers:
-            analysis_handlers[analysis_hint].copyTemplate(analysisdir, self.analysis_notebooks_src)
-            return_url = self.base_url + 'lab/tree/' + analysis_subpath + '/' + analysis_handlers[analysis_hint].getAnalysisFileName()
-        else:
-            return_url = self.base_url + 'lab/tree/' + analysis_subpath
 
-        return self.redirect(return_url)
+class LaunchLandingHandler(JupyterHandler):
+    """
+    The /autolaunch/landing endpoint.
+
+    Where a launch of several kinds of data ends up: lists the analysis notebook provisioned for each.
+    """
+    @web.authenticated
+    async def get(self):
+        notebooks = self.get_arguments('notebook')
+        return_page = "<html><head><title>Your analyses</title></head><body>"
+        return_page += "<p>Analysis notebooks were prepared for each kind of data launched:</p><ul>"
+        for nb in notebooks:
+            return_page += "<li><a href=\"" + xhtml_escape(self.base_url + 'lab/tree/' + Launcher.analysis_subpath + '/' + url_escape(nb, plus=False)) + "\">"
+            return_page += xhtml_escape(nb) + "</a></li>"
+        return_page += "</ul></body></html>"
+        await self.finish(return_page)
 
 
 class RefreshAuthHandler(JupyterHandler):
@@ -168,20 +210,22 @@ class RefreshAuthHandler(JupyterHandler):
         await self._handle_refresh_auth()
 
     async def _handle_refresh_auth(self):
+        with Trace('refresh_auth') as trace:
+            await self._redirect_for_refresh(trace)
+
+    async def _redirect_for_refresh(self, trace):
         auth_uuid = self.get_argument('auth_uuid', '')
 
         # lookup refresh info from auth_uuid (and error if not found)
         basedir = os.path.expanduser(self.settings['server_root_dir'])
         configdir = os.path.join(basedir,'.remote-config')
-        redirect_info = None
-        with open(os.path.join(configdir, 'token-refresh.config'), "r") as f:
-            for l in f:
-                if l.split("\t")[1] == auth_uuid:
-                    redirect_info = json.loads(l.split("\t")[3])['initial_redirect']
-                    break
-
-        if redirect_info is None:
+        with trace.span('lookup'):
+            found = await run_blocking(_find_refresh_info, configdir, auth_uuid, timeout=Launcher.config_timeout)
+        if found is None:
+            trace.outcome = 'not_found'
             return self.send_error()
+        with trace.span('redirect_info'):
+            redirect_info = await auth_handlers[found[0]].getRedirectInfo(found[1])
 
         return_page = "<html><head><script type=\"text/javascript\">function sf() {document.getElementById(\"redir\").submit();}</script></head>"
         return_page += "<body><form id=\"redir\" method=\"" + redirect_info['method'] + "\" action=\"" + redirect_info['endpoint'] + "\">"
@@ -211,51 +255,94 @@ class RefreshAuthCallbackHandler(JupyterHandler):
         await self._handle_refresh_auth_callback()
 
     async def _handle_refresh_auth_callback(self):
+        with Trace('refresh_auth_callback') as trace:
+            await self._replace_refreshed_auth(trace)
+
+    async def _replace_refreshed_auth(self, trace):
         auth_uuid = self.get_argument('state', '')
         auth_token = self.get_argument('code', '')
 
         # iteratively replace auth info with new info passed here
         basedir = os.path.expanduser(self.settings['server_root_dir'])
         configdir = os.path.join(basedir,'.remote-config')
-        idxfiles = {}
-        with open(os.path.join(configdir, 'token-refresh.config'), "r") as f:
-            with open(os.path.join(configdir, 'token-refresh.config.new'), "w") as fw:
-                for l in f:
-                    lin = l.split("\t")
-                    if lin[1] == auth_uuid:
-                        ah = auth_handlers[lin[2]](auth_token,refresh_info=json.loads(lin[3]),handler=self)
-                        idxfiles[lin[0]] = ah.getAuthHeaders()
-                        fw.write(lin[0])
-                        fw.write('\t')
-                        fw.write(ah.getAuthUUID())
-                        fw.write('\t')
-                        fw.write(lin[2])
-                        fw.write('\t')
-                        fw.write(json.dumps(ah.getRefreshInfo()))
-                        fw.write('\n')
-                    else:
-                        fw.write(l)
-        with open(os.path.join(configdir, 'remote.config'), "r") as f:
-            with open(os.path.join(configdir, 'remote.config.new'), "w") as fw:
-                for l in f:
-                    lin = l.split("\t")
-                    if lin[0] in idxfiles:
-                        fw.write(lin[0])
-                        if len(idxfiles[lin[0]]) > 0:
-                            for h in idxfiles[lin[0]]:
-                                fw.write("\t" + h)
-                        fw.write("\n")
-                    else:
-                        fw.write(l)
-        os.replace(os.path.join(configdir, 'remote.config.new'), os.path.join(configdir, 'remote.config'))
-        os.replace(os.path.join(configdir, 'token-refresh.config.new'), os.path.join(configdir, 'token-refresh.config'))
-
-        # reload urlfs (multiple should not be found, but in case user also used it separately from us,
-        # reload all instances)
-        for pid in map(int,subprocess.check_output(["pidof","mount.urlfs"]).split()):
-            os.kill(pid,SIGUSR1)
+        with trace.span('lookup'):
+            found = await run_blocking(_find_refresh_info, configdir, auth_uuid, timeout=Launcher.config_timeout)
+        if found is None:
+            trace.outcome = 'not_found'
+            return self.send_error()
+        with trace.span('exchange'):
+            authhandler = await auth_handlers[found[0]].fromCallback(auth_uuid, auth_token, found[1], self)
+        if authhandler is None:
+            trace.outcome = 'rejected'
+            return self.send_error()
+        with trace.span('write_config'):
+            idxfiles = await run_blocking(_replace_auth, configdir, auth_uuid, authhandler, timeout=Launcher.config_timeout)
+        if 'autolaunch_refresh' in self.settings:
+            self.settings['autolaunch_refresh'].refreshed(auth_uuid)
 
         if len(idxfiles) == 0:
-            self.send_error()
+            trace.outcome = 'not_found'
+            return self.send_error()
+
+        # only the refreshed sources were re-exported; URLFS has no per-index reload, but reloads are coalesced
+        mount = get_mount(os.path.join(configdir,'remote.config'), os.path.join(basedir,'remote'))
+        with trace.span('reload'):
+            await mount.reload(timeout=Launcher.reload_timeout)
+
         return_page = "<html><head><script type=\"text/javascript\">window.close();</script></head><body>Authentication refreshed. You can close this window.</body></html>"
         await self.finish(return_page)
+
+
+class AuthErrorHandler(JupyterHandler):
+    """
+    The /autolaunch/auth-error endpoint.
+
+    POSTed to (e.g. by the refresh glue in notebooks) when reading through URLFS fails for lack of valid credentials,
+    with either the auth_uuid of those credentials or the path (under the remote mount) that could not be read.
+    The credentials are refreshed right away if that needs no user interaction (simultaneous reports of the same
+    credentials causing a single refresh). Returns a JSON object with the "auth_uuid", whether it was "refreshed",
+    and if not, the "refresh_url" (see RefreshAuthHandler) to send the user to.
+    """
+    @web.authenticated
+    async def post(self):
+        scheduler = self.settings.get('autolaunch_refresh')
+        if scheduler is None:
+            scheduler = self.settings['autolaunch_refresh'] = RefreshScheduler(os.path.expanduser(self.settings['server_root_dir']))
+        auth_uuid = self.get_argument('auth_uuid', '')
+        if len(auth_uuid) == 0:
+            auth_uuid = await scheduler.find_auth(self.get_argument('path', ''))
+            if auth_uuid is None:
+                raise web.HTTPError(404, "no source serves path")
+        refreshed = await scheduler.refresh(auth_uuid)
+        result = {'auth_uuid': auth_uuid, 'refreshed': refreshed}
+        if not refreshed:
+            result['refresh_url'] = self.base_url + 'autolaunch/refresh-auth?' + urlencode({'auth_uuid': auth_uuid})
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        await self.finish(json.dumps(result))
+
+
+class MetricsHandler(JupyterHandler):
+    """
+    The /autolaunch/metrics endpoint.
+
+    Launch and refresh latencies (per phase) and counters, in the Prometheus text format (see metrics.py).
+    """
+    @web.authenticated
+    async def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.set_header('Cache-Control', 'no-store, no-cache, must-revalidate, max-age=0')
+        await self.finish(render())
+
+
+def _find_refresh_info(configdir, auth_uuid):
+    # lookup (token_hint, refresh_info) from auth_uuid
+    found = get_store(configdir).find_refresh_info(auth_uuid)
+    if found is None or found[1] is None or not (found[0] in auth_handlers):
+        return None
+    return found
+
+
+def _replace_auth(configdir, auth_uuid, authhandler):
+    # replace auth info with the new info held by authhandler
+    return get_store(configdir).replace_auth(auth_uuid, lambda token_hint, refresh_info: authhandler)
@@ -0,0 +1,89 @@
+"""
+Launches running as background jobs.
+
+/autolaunch starts a job and immediately sends the browser to a lightweight progress page, which follows the
+job's phases (as server-sent events) and moves on to the analysis notebook once the job is done. Jobs are
+registered with the server app (in its settings), and a launch with the same parameters as a running (or just
+finished) job is attached to that job instead of starting another one, so a double click launches only once.
+"""
+from secrets import token_hex
+import asyncio
+import hashlib
+import json
+import logging
+
+from .launch import describe_error
+
+log = logging.getLogger(__name__)
+
+
+class LaunchJob:
+    def __init__(self, key):
+        self.id = token_hex(16)
+        self.key = key
+        self.events = [] # phases so far, the last one being 'done' or 'failed' once finished
+        self.finished = False
+        self.task = None
+        self._changed = asyncio.get_running_loop().create_future()
+
+    def report(self, phase, **data):
+        """Record that the job has moved on to phase."""
+        data['phase'] = phase
+        self.events.append(data)
+        self._changed.set_result(None)
+        self._changed = asyncio.get_running_loop().create_future()
+
+    async def wait(self, seen):
+        """Wait until there are more than seen events."""
+        if len(self.events) <= seen and not self.finished:
+            await asyncio.shield(self._changed)
+
+    def result(self):
+        """URL to send the browser to once finished (None otherwise)."""
+        if self.finished and self.events[-1]['phase'] == 'done':
+            return self.events[-1]['url']
+        return None
+
+    async def _run(self, launch):
+        try:
+            url = await launch(self.report)
+            self.finished = True
+            self.report('done', url=url)
+        except Exception as e:
+            log.exception("autolaunch: launch failed")
+            self.finished = True
+            self.report('failed', error=describe_error(e))
+
+
+class LaunchJobs:
+    """Registry of launch jobs."""
+    keep_finished = 120 # seconds finished jobs are kept around (for late listeners, and to catch repeated launches)
+
+    def __init__(self):
+        self.jobs = {}
+        self._by_key = {}
+
+    def start(self, params, launch):
+        """
+        Start a job for params (a dictionary of launch parameters) running launch(progress) (a coroutine function,
+        returning the URL to finally send the browser to), unless one with the same params is already known and has
+        not failed. Returns the job.
+        """
+        key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        job = self._by_key.get(key)
+        if job is not None and (not job.finished or job.result() is not None):
+            return job
+        job = LaunchJob(key)
+        self.jobs[job.id] = job
+        self._by_key[key] = job
+        job.task = asyncio.ensure_future(job._run(launch))
+        job.task.add_done_callback(lambda t: asyncio.get_running_loop().call_later(self.keep_finished, self._forget, job))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _forget(self, job):
+        self.jobs.pop(job.id, None)
+        if self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
@@ -0,0 +1,338 @@
+"""
+The autolaunch pipeline: give URLFS access to the launched files, identify what kind(s) of data they hold, and
+provision the matching analysis notebook(s), all with a single configuration change and URLFS reload.
+
+This is kept independent of any request handler, so that a launch can run as a background job that outlives
+the request that started it (see jobs.py). Progress is reported, phase by phase, through a callback, and each
+phase is timed (see metrics.py).
+"""
+from base64 import urlsafe_b64decode
+from urllib.parse import urlencode
+from tornado import web
+import asyncio
+import logging
+import os
+
+from .analysis import analysis_handlers
+from .analysis.signatures import get_matcher
+from .auth import auth_handlers
+from ._blocking import run_blocking
+from .store import get_store
+from .detect import detect_analysis_hint, detect_analysis_hints
+from .metrics import Trace
+from .prefetch import get_prefetcher
+from .urlfs import get_mount, index_entry_size
+from .ots import stream_ots, decode_ots_headers
+from .encoding import decode_files
+
+log = logging.getLogger(__name__)
+
+
+class Launcher:
+    analysis_notebooks_src = '/autolaunch/notebooks' # TODO: should be learned by inference, but for now, hard-coded
+    analysis_subpath = 'analysis'
+    # per-step timeouts (seconds) for the blocking parts of a launch
+    config_timeout = 30
+    mount_timeout = 60
+    reload_timeout = 10
+    read_timeout = 30
+    # number of file prefixes read at once while identifying the data type (more than _blocking.remote_workers only queue)
+    detect_concurrency = 4
+    # reads in a row finding no new type of data after which identification stops (None: read until all are found)
+    detect_max_fruitless_reads = 100
+    # OTS callbacks: overall timeout (seconds), number of candidate files identification starts on early, and most
+    # candidate files kept for identification (of those likely to be data, and of the others)
+    ots_timeout = 300
+    ots_early_files = 64
+    ots_max_candidates = 1000
+    # provision notebooks for every type of data launched at once (instead of only for the first one found)
+    multi_type = True
+    # copy the launched files into a local cache in the background, once the launch is done (see prefetch.py); off by
+    # default, as files the notebook reads anyway are then fetched twice
+    prefetch = False
+
+    def __init__(self, basedir, base_url, progress=None):
+        self.base_url = base_url
+        self.mountdir = os.path.join(basedir,'remote')
+        self.analysisdir = os.path.join(basedir,self.analysis_subpath)
+        self.configdir = os.path.join(basedir,'.remote-config')
+        self.progress = progress if progress is not None else (lambda phase: None)
+        self.trace = Trace('launch')
+
+    async def run(self, params):
+        """
+        Launch with params (a dictionary of the /autolaunch parameters), returning the URL to send the browser to.
+        """
+        if len(params.get('ots_callback_url', '')) > 0:
+            with Trace('ots_launch') as self.trace:
+                return await self.launch_ots(params['ots_callback_url'], params.get('ots_callback_hdrs', ''))
+        with Trace('launch') as self.trace:
+            return await self.launch(params)
+
+    async def launch(self, params):
+        self.progress('decoding parameters')
+        with self.trace.span('decode'):
+            token_hint, authhandler, files_urlfs, files, file_lines = self._decode(params)
+
+        # Everything from here on touches the disk, spawns processes, or reads through the URLFS mount,
+        # so it is all done in worker threads / subprocesses so as to never stall the event loop.
+        store = await self._prepare()
+
+        # Add access to new files if provided.
+        if len(files) > 0:
+            self.progress('writing configuration')
+            with self.trace.span('write_config'):
+                await run_blocking(store.add_source, authhandler, token_hint, files_urlfs, timeout=self.config_timeout)
+            await self._sync_urlfs()
+
+        analysis_hints = await self._analysis_hints(params, files, file_lines, store)
+        self._prefetch(files, file_lines, analysis_hints)
+        return await self._provision(analysis_hints)
+
+    async def launch_batch(self, batch):
+        """
+        Launch many datasets at once: batch is a list of dictionaries of /autolaunch parameters (other than OTS ones).
+        All index files and credentials are written in a single transaction, followed by a single URLFS reload.
+        Returns, for each dataset, a dictionary with either the "url" to its analysis and the "analysis_hints" found,
+        or an "error".
+        """
+        with Trace('batch_launch') as self.trace:
+            return await self._launch_batch(batch)
+
+    async def _launch_batch(self, batch):
+        results = [None] * len(batch)
+        decoded = []
+        with self.trace.span('decode'):
+            for i, params in enumerate(batch):
+                try:
+                    decoded.append((i, params) + self._decode(params))
+                except Exception as e:
+                    results[i] = {'error': describe_error(e)}
+
+        store = await self._prepare()
+        sources = [(d[3], d[2], d[4]) for d in decoded if len(d[5]) > 0]
+        if len(sources) > 0:
+            self.progress('writing configuration')
+            with self.trace.span('write_config'):
+                await run_blocking(store.add_sources, sources, timeout=self.config_timeout)
+            await self._sync_urlfs()
+
+        async def finish(i, params, token_hint, authhandler, files_urlfs, files, file_lines):
+            try:
+                hints = await self._analysis_hints(params, files, file_lines, store)
+                self._prefetch(files, file_lines, hints)
+                results[i] = {'url': await self._provision(hints), 'analysis_hints': hints}
+            except Exception as e:
+                results[i] = {'error': describe_error(e)}
+
+        await asyncio.gather(*[finish(*d) for d in decoded])
+        return results
+
+    def _decode(self, params):
+        token_hint = params.get('auth_token_hint', 'polyauth') # default is polyauth. Maybe change to oauth2 at some point?
+        if not (token_hint in auth_handlers):
+            raise web.HTTPError(400, "unknown auth_token_hint")
+
+        authhandler = auth_handlers[token_hint](params.get('auth_token', ''))
+        files_urlfs = decode_files(params.get('files', 'W10')) # W10= is [], aka empty JSON list
+
+        # Get files as will appear to us, not as needed by urlfs (but keep their index lines, which describe them)
+        files = []
+        file_lines = []
+        for f in files_urlfs:
+            if f.split('\t')[0] == 'F':
+                files.append(os.path.join(self.mountdir,f.split('\t')[1][1:])) # [1:] needed to remove first slash in front of all URLFS names
+                file_lines.append(f)
+        return token_hint, authhandler, files_urlfs, files, file_lines
+
+    async def _analysis_hints(self, params, files, file_lines, store):
+        analysis_hints = [params.get('analysis_hint','')]
+        if not (analysis_hints[0] in analysis_handlers):
+            # Try to figure out which type(s) of analysis notebook we need to copy over.
+            self.progress('identifying data')
+            with self.trace.span('identify'):
+                analysis_hints = await self._identify(files, file_lines, store)
+        return analysis_hints
+
+    async def launch_ots(self, url, hdrs):
+        """
+        Launch with parameters obtained from an OTS callback. The file list is streamed straight into the index file
+        as it arrives, and identification starts on the first ots_early_files candidate files, while the rest of the
+        list is still arriving. Only up to ots_max_candidates candidate files likely to be data (see
+        SignatureMatcher.isLikely), and as many others, are kept for identification (and prefetch), so that lists of
+        any length are never held in memory.
+        """
+        self.progress('requesting parameters')
+        url = urlsafe_b64decode(url + '=' * ((4 - len(url)) % 4)).decode()
+        stream = stream_ots(url, decode_ots_headers(hdrs), timeout=self.ots_timeout)
+        detection = None
+        # candidate (file, index line) pairs likely to be data, and others; and how many of each were identified early
+        candidates = ([], [])
+        early = (0, 0)
+        try:
+            with self.trace.span('request_params'):
+                params = await stream.__anext__()
+            token_hint = params.get('auth_token_hint', 'polyauth')
+            if not (token_hint in auth_handlers):
+                raise web.HTTPError(400, "unknown auth_token_hint")
+            authhandler = auth_handlers[token_hint](params.get('auth_token', ''))
+            store = await self._prepare()
+
+            analysis_hint = params.get('analysis_hint', '')
+            detect = not (analysis_hint in analysis_handlers)
+            matcher = get_matcher(analysis_handlers)
+            idxfile = None
+            self.progress('receiving file list')
+            with self.trace.span('receive_list'):
+                async for lines in stream:
+                    if idxfile is None:
+                        idxfile = await run_blocking(store.add_source, authhandler, token_hint, [], timeout=self.config_timeout)
+                    await run_blocking(store.append_lines, idxfile, lines, timeout=self.config_timeout)
+                    if not detect:
+                        continue
+                    for f in lines:
+                        if f.split('\t')[0] == 'F':
+                            fil = os.path.join(self.mountdir,f.split('\t')[1][1:])
+                            if matcher.fromMetadata(fil, index_entry_size(f)) != '':
+                                group = candidates[0 if matcher.isLikely(fil) else 1]
+                                if len(group) < self.ots_max_candidates:
+                                    group.append((fil, f))
+                    if detection is None and len(candidates[0]) + len(candidates[1]) >= self.ots_early_files:
+                        # make what we have so far visible, and start identifying it
+                        await self._sync_urlfs()
+                        early = (len(candidates[0]), len(candidates[1]))
+                        detection = asyncio.ensure_future(self._identify(*_unzip(candidates[0] + candidates[1]), store))
+        except StopAsyncIteration:
+            raise web.HTTPError(502, "OTS callback returned no parameters")
+        except BaseException:
+            if detection is not None:
+                detection.cancel()
+            raise
+        finally:
+            await stream.aclose()
+
+        if idxfile is not None:
+            await self._sync_urlfs()
+        analysis_hints = [analysis_hint]
+        if detect:
+            self.progress('identifying data')
+            with self.trace.span('identify'):
+                analysis_hints = []
+                if detection is not None:
+                    analysis_hints = await detection
+                if len(analysis_hints) == 0 or (self.multi_type and len(analysis_hints) < len(analysis_handlers)):
+                    rest = candidates[0][early[0]:] + candidates[1][early[1]:]
+                    for hint in await self._identify(*_unzip(rest), store):
+                        if not (hint in analysis_hints):
+                            analysis_hints.append(hint)
+
+        self._prefetch(*_unzip(candidates[0] + candidates[1]), analysis_hints)
+        return await self._provision(analysis_hints)
+
+    async def warm_up(self):
+        """
+        Do ahead of the first launch what it would otherwise have to wait for: create the directories, mount URLFS,
+        and load the analysis handlers (and their signatures).
+        """
+        with Trace('warm_up') as self.trace:
+            store = await self._prepare()
+            if not await run_blocking(os.path.isfile, store.remote_config, timeout=self.config_timeout):
+                with self.trace.span('write_config'):
+                    await run_blocking(store.export, timeout=self.config_timeout)
+            with self.trace.span('mount'):
+                await get_mount(store.remote_config, self.mountdir).ensure_mounted(timeout=self.mount_timeout)
+            with self.trace.span('load_handlers'):
+                await run_blocking(get_matcher, analysis_handlers, timeout=self.config_timeout)
+                await run_blocking(len, auth_handlers, timeout=self.config_timeout) # looks up installed ones
+
+    async def compact(self):
+        """
+        Compact the configuration store (see ConfigStore.compact), reloading URLFS if that removed anything it serves.
+        Returns what was removed (None if nothing was ever launched here).
+        """
+        if not os.path.isdir(self.configdir):
+            return None
+        with Trace('compact') as self.trace:
+            store = await run_blocking(get_store, self.configdir, timeout=self.config_timeout)
+            with self.trace.span('compact'):
+                removed = await run_blocking(store.compact, timeout=self.config_timeout)
+            if any(removed.values()) and await run_blocking(os.path.ismount, self.mountdir,
+                                                            timeout=self.mount_timeout, remote=True):
+                await self._sync_urlfs()
+            return removed
+
+    async def _prepare(self):
+        # Ensure that requisite directories exist, and open the config store
+        with self.trace.span('prepare'):
+            await run_blocking(_ensure_dirs, self.analysisdir, self.configdir, timeout=self.config_timeout)
+            return await run_blocking(get_store, self.configdir, timeout=self.config_timeout)
+
+    async def _sync_urlfs(self):
+        # mount urlfs if not already mounted, otherwise reload it
+        mount = get_mount(os.path.join(self.configdir,'remote.config'), self.mountdir)
+        self.progress('mounting remote files')
+        with self.trace.span('mount'):
+            mounted = await mount.ensure_mounted(timeout=self.mount_timeout)
+        if not mounted:
+            self.progress('reloading remote files')
+            with self.trace.span('reload'):
+                await mount.reload(timeout=self.reload_timeout)
+
+    async def _identify(self, files, file_lines, store):
+        # hints of the analysis handlers for files: of all types found if multi_type, otherwise only of the first one
+        if self.multi_type:
+            return await detect_analysis_hints(files, analysis_handlers, concurrency=self.detect_concurrency,
+                                               timeout=self.read_timeout, index_lines=file_lines, cache=store,
+                                               max_fruitless_reads=self.detect_max_fruitless_reads)
+        hint = await detect_analysis_hint(files, analysis_handlers, concurrency=self.detect_concurrency,
+                                          timeout=self.read_timeout, index_lines=file_lines, cache=store,
+                                          max_fruitless_reads=self.detect_max_fruitless_reads)
+        return [hint] if len(hint) > 0 else []
+
+    def _prefetch(self, files, file_lines, analysis_hints):
+        # queue files for prefetch: those of the types found first, then those that may be of some type, then the rest
+        if not self.prefetch or len(files) == 0:
+            return
+        matcher = get_matcher(analysis_handlers)
+        entries = []
+        for fil, line in zip(files, file_lines):
+            hint = matcher.fromMetadata(fil, index_entry_size(line))
+            entries.append((fil, line, 0 if hint in analysis_hints else (2 if hint == '' else 1)))
+        get_prefetcher(self.mountdir, self.configdir).enqueue(entries)
+
+    async def _provision(self, analysis_hints):
+        # copy over the analysis notebook(s) (if any), and return where to send the browser
+        notebooks = []
+        for analysis_hint in analysis_hints:
+            if analysis_hint in analysis_handlers:
+                self.progress('copying analysis notebook')
+                with self.trace.span('provision'):
+                    await run_blocking(analysis_handlers[analysis_hint].copyTemplate, self.analysisdir,
+                                       self.analysis_notebooks_src, timeout=self.config_timeout)
+                notebooks.append(analysis_handlers[analysis_hint].getAnalysisFileName())
+        if len(notebooks) == 1:
+            return self.base_url + 'lab/tree/' + self.analysis_subpath + '/' + notebooks[0]
+        elif len(notebooks) > 1:
+            # several kinds of data: let the user pick among their notebooks
+            return self.base_url + 'autolaunch/landing?' + urlencode([('notebook', nb) for nb in notebooks])
+        else:
+            return self.base_url + 'lab/tree/' + self.analysis_subpath
+
+
+def describe_error(e):
+    """Short (and secret-free) description of why (part of) a launch failed."""
+    if isinstance(e, web.HTTPError) and e.log_message:
+        return e.log_message
+    return e.__class__.__name__
+
+
+def _unzip(pairs):
+    # ([first of each pair], [second of each pair])
+    return [p[0] for p in pairs], [p[1] for p in pairs]
+
+
+def _ensure_dirs(*dirs):
+    # Ensure that requisite directories exist
+    for d in dirs:
+        if not os.path.isdir(d):
+            os.mkdir(d)
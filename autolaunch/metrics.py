@@ -0,0 +1,120 @@
+"""
+Latency instrumentation of autolaunch operations, and its export in the Prometheus text format.
+
+Operations (launches, auth refreshes) are timed with a Trace, each of their phases (decoding parameters, writing
+the configuration, mounting or reloading URLFS, identifying data, copying notebooks, ...) with one of its spans:
+
+    with Trace('launch') as trace:
+        with trace.span('mount'):
+            ...
+
+Span and operation durations are recorded in histograms, operations are counted by outcome, and operations
+taking slow_trace_seconds or more are logged with the breakdown of their phases. render() exports all of this,
+along with the counters kept by the other modules (detect.stats, urlfs.stats, refresh.stats, prefetch.stats, whose
+hits and misses are recorded by other processes), as served by /autolaunch/metrics.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import time
+
+from . import detect, prefetch, refresh, urlfs
+
+log = logging.getLogger(__name__)
+
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds (upper bounds)
+slow_trace_seconds = 10 # operations taking longer are logged with their phases; None to never log them
+
+# counters kept by other modules, exported as autolaunch_<prefix>_<key>_total
+stats_sources = {
+    'detect': detect.stats,
+    'urlfs': urlfs.stats,
+    'refresh': refresh.stats,
+    'prefetch': prefetch.stats,
+}
+
+_histograms = {} # name -> {labels: [count per bucket (the last one for +Inf), sum]}
+_counters = {} # name -> {labels: count}
+
+
+def observe(name, value, **labels):
+    """Record value (in seconds) in histogram name."""
+    series = _histograms.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    if key not in series:
+        series[key] = [[0] * (len(buckets) + 1), 0.0]
+    series[key][0][bisect_left(buckets, value)] += 1
+    series[key][1] += value
+
+
+def increment(name, **labels):
+    """Add one to counter name."""
+    series = _counters.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    series[key] = series.get(key, 0) + 1
+
+
+class Trace:
+    """Timing of one operation, phase by phase. Used as a context manager around the whole operation."""
+    def __init__(self, operation):
+        self.operation = operation
+        self.outcome = None # 'ok' or 'error' by default, from how the operation ended
+        self.spans = [] # (phase, start, duration), in seconds since the start of the operation
+        self.start = time.monotonic()
+
+    @contextmanager
+    def span(self, phase):
+        """Time phase (the block run within)."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            self.spans.append((phase, start - self.start, duration))
+            observe('autolaunch_phase_seconds', duration, operation=self.operation, phase=phase)
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self.start
+        outcome = self.outcome or ('ok' if exc_type is None else 'error')
+        observe('autolaunch_operation_seconds', duration, operation=self.operation)
+        increment('autolaunch_operations_total', operation=self.operation, outcome=outcome)
+        if slow_trace_seconds is not None and duration >= slow_trace_seconds:
+            log.warning("autolaunch: slow %s (%s) took %.3f s: %s", self.operation, outcome, duration,
+                        ", ".join("%s %.3f s at +%.3f s" % (phase, d, s) for phase, s, d in self.spans))
+        return False
+
+
+def render():
+    """All metrics, in the Prometheus text exposition format."""
+    prefetch.collect_reader_stats()
+    out = []
+    for name in sorted(_histograms):
+        out.append("# TYPE %s histogram" % name)
+        for key, (counts, total) in sorted(_histograms[name].items()):
+            cumulative = 0
+            for le, n in zip(list(map(repr, buckets)) + ['+Inf'], counts):
+                cumulative += n
+                out.append("%s_bucket%s %d" % (name, _labels(key + (('le', le),)), cumulative))
+            out.append("%s_sum%s %r" % (name, _labels(key), total))
+            out.append("%s_count%s %d" % (name, _labels(key), cumulative))
+    for name in sorted(_counters):
+        out.append("# TYPE %s counter" % name)
+        for key, n in sorted(_counters[name].items()):
+            out.append("%s%s %d" % (name, _labels(key), n))
+    for prefix, stats in sorted(stats_sources.items()):
+        for k, n in stats.items():
+            name = "autolaunch_%s_%s_total" % (prefix, k)
+            out.append("# TYPE %s counter" % name)
+            out.append("%s %d" % (name, n))
+    return "\n".join(out) + "\n"
+
+
+def _labels(key):
+    if len(key) == 0:
+        return ''
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in key) + "}"
@@ -0,0 +1,117 @@
+"""
+Client side of the OTS ("one-time storage") callback, used to obtain launch parameters that do not fit in
+(or should not appear in) the /autolaunch GET request.
+
+A POST request is sent to the callback URL (with any headers given), and the response holds the launch
+parameters in one of two forms:
+
+1. Content-Type application/json: a JSON object with the same keys as the GET parameters of /autolaunch
+   (auth_token, auth_token_hint, analysis_hint, title), except that files is a plain JSON list of URLFS
+   index lines (not base64 encoded).
+2. Any other Content-Type (e.g. text/plain): streamed. The first line is a JSON object with the parameters
+   other than files, and every following line is one URLFS index line. This form is parsed as it arrives,
+   so file lists of any length can be passed without holding them in memory: reading the response pauses
+   whenever queue_batches batches of lines are waiting to be consumed.
+
+Only a 2xx response is parsed; the body of any other is ignored, and an HTTPClientError raised instead.
+"""
+from base64 import urlsafe_b64decode
+import asyncio
+import json
+
+from tornado.httpclient import HTTPRequest
+
+from ._http import fetch_streaming
+
+batch_lines = 1000 # index lines handed over at once
+queue_batches = 8 # batches received ahead of the consumer, before reading the response pauses
+
+
+def decode_ots_headers(hdrs):
+    """Decode ots_callback_hdrs: base64 of a JSON object, or of a JSON list of "Name: value" strings."""
+    if hdrs is None or len(hdrs) == 0:
+        return {}
+    hdrs = json.loads(urlsafe_b64decode(hdrs + '=' * ((4 - len(hdrs)) % 4)))
+    if isinstance(hdrs, dict):
+        return hdrs
+    return dict(h.split(':', 1) for h in hdrs)
+
+
+async def stream_ots(url, headers=None, timeout=None):
+    """
+    Async generator requesting the launch parameters from the OTS callback at url. Yields the parameters (a
+    dictionary, without files) first, and then lists of URLFS index lines as they arrive.
+    """
+    queue = asyncio.Queue(maxsize=queue_batches)
+    state = {'buf': b'', 'json': None, 'params': False, 'ok': False, 'closed': False}
+
+    async def put_all(batches):
+        for batch in batches:
+            if state['closed']:
+                return
+            await queue.put(batch)
+
+    def on_chunk(chunk):
+        if state['closed'] or not state['ok']:
+            return None # error body (raised as such once the response is complete)
+        if state['json'] is not None:
+            state['json'].append(chunk)
+            return None
+        lines = (state['buf'] + chunk).split(b'\n')
+        state['buf'] = lines.pop()
+        if len(lines) == 0:
+            return None
+        return put_all([lines[i:i+batch_lines] for i in range(0, len(lines), batch_lines)])
+
+    def on_header(line):
+        if line.startswith('HTTP/'):
+            # status line, of this response or of one redirected to: start over
+            state['ok'] = line.split(' ')[1].startswith('2')
+            state['json'] = None
+            state['buf'] = b''
+        elif line.lower().startswith('content-type:') and 'application/json' in line.lower():
+            state['json'] = []
+
+    request = HTTPRequest(url, method='POST', body='', headers=headers, request_timeout=timeout,
+                          streaming_callback=on_chunk, header_callback=on_header)
+
+    async def fetch():
+        try:
+            await fetch_streaming(request)
+            if state['json'] is not None:
+                params = json.loads(b''.join(state['json']))
+                files = params.pop('files', [])
+                await queue.put(params)
+                await put_all([files[i:i+batch_lines] for i in range(0, len(files), batch_lines)])
+            elif len(state['buf']) > 0:
+                await queue.put([state['buf']])
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.ensure_future(fetch())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, dict):
+                state['params'] = True
+                yield item
+                continue
+            lines = [l.decode() if isinstance(l, bytes) else l for l in item]
+            if not state['params']:
+                # streamed form: parameters on the first line
+                state['params'] = True
+                yield json.loads(lines.pop(0))
+            lines = [l.rstrip('\r') for l in lines if len(l.strip()) > 0]
+            if len(lines) > 0:
+                yield lines
+    finally:
+        # nobody reads on: let the response (if still coming) be read to its end and dropped, rather than wait forever
+        state['closed'] = True
+        task.cancel()
+        while not queue.empty():
+            queue.get_nowait()
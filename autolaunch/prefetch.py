@@ -0,0 +1,263 @@
+"""
+Background prefetch of launched data into a local cache.
+
+Once a launch has sent the browser on, the launched files are copied (through the URLFS mount) into a local cache
+directory (.remote-config/prefetch), so that the notebook's first reads need not wait on the network. Files of the
+data types found by the launch go first, then files that may be of some type, then the rest; smaller files first
+within each group. At most max_fetches files are copied at once, and the cache is kept within max_bytes by evicting
+the least recently used copies.
+
+Prefetching never competes with interactive reads: while any other process (such as the user's kernel) has files
+under the mount open, it pauses, and a file such a process opens is no longer prefetched at all.
+
+Copies are named after the URL and validators (size, mtime or ETag) of their URLFS index line, so they are only used
+for the very same remote content. Readers (such as analysis.columnar, in the user's kernel) find them with
+local_copy(path), which records each hit or miss by appending a byte to a counter file next to the cache, so that the
+server can report them (see collect_reader_stats).
+
+Prefetching is off unless enabled (Launcher.prefetch).
+"""
+from itertools import count
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import threading
+import time
+
+from ._blocking import run_blocking
+from .store import get_store
+from .urlfs import index_entry_key, index_entry_size, locate
+
+log = logging.getLogger(__name__)
+
+cache_subdir = 'prefetch'
+
+# counters since server start (but for hits and misses, which are totals of the caches in use, see collect_reader_stats)
+stats = {
+    'queued': 0, # files queued for prefetch
+    'already_cached': 0, # ... of which a copy was already there
+    'prefetched_files': 0,
+    'prefetched_bytes': 0,
+    'cancelled': 0, # files whose prefetch was cancelled, as someone else started reading them
+    'evicted_bytes': 0,
+    'hits': 0, # local_copy lookups finding a copy
+    'misses': 0, # ... or not
+}
+counter_prefix = 'prefetch-' # of the files (in the configuration directory) counting local_copy hits and misses
+
+_prefetchers = {}
+
+
+def get_prefetcher(mountdir, configdir):
+    """Return the (shared) Prefetcher for the URLFS mount at mountdir, configured from configdir."""
+    key = (mountdir, configdir)
+    if key not in _prefetchers:
+        _prefetchers[key] = Prefetcher(mountdir, configdir)
+    return _prefetchers[key]
+
+
+def cache_key(line):
+    """Name of the local copy of the file of a URLFS index line, or None if it cannot be prefetched."""
+    key = index_entry_key(line)
+    if key is None:
+        return None
+    return hashlib.sha256((key[0] + "\t" + key[1]).encode()).hexdigest()
+
+
+def local_copy(path):
+    """
+    Return the path of the local copy of the file at path (under the URLFS mount), or None if it has not been
+    prefetched (or is not under the mount).
+    """
+    found = locate(os.path.abspath(path))
+    if found is None:
+        return None
+    store = get_store(found[0], readonly=True)
+    entry = None if store is None else store.find_index_entry(found[1])
+    key = None if entry is None else cache_key(entry[1])
+    if key is not None:
+        copy = os.path.join(found[0], cache_subdir, key)
+        try:
+            os.utime(copy) # recently used
+            _count(found[0], 'hits')
+            return copy
+        except FileNotFoundError:
+            pass
+    _count(found[0], 'misses')
+    return None
+
+
+def collect_reader_stats():
+    """Update the hits and misses in stats from the counter files of the caches of all prefetchers in use."""
+    totals = {'hits': 0, 'misses': 0}
+    for mountdir, configdir in _prefetchers:
+        for k in totals:
+            try:
+                totals[k] += os.path.getsize(os.path.join(configdir, counter_prefix + k))
+            except OSError:
+                pass
+    stats.update(totals)
+
+
+def _count(configdir, what):
+    # one byte per event: appends are atomic, so any number of processes can count at once without locking
+    try:
+        with open(os.path.join(configdir, counter_prefix + what), "ab") as f:
+            f.write(b".")
+    except OSError:
+        pass
+
+
+class Prefetcher:
+    """Queue of files to prefetch from one URLFS mount. Must only be used from the event loop."""
+    max_bytes = 4 * 1024 * 1024 * 1024 # of local copies
+    max_fetches = 2 # files copied at once
+    chunk_size = 1024 * 1024 # bytes copied at once
+    check_interval = 0.5 # seconds between looks at which files other processes have open
+    read_timeout = 30 # seconds per chunk
+
+    def __init__(self, mountdir, configdir):
+        self.mountdir = mountdir
+        self.cachedir = os.path.join(configdir, cache_subdir)
+        self._queue = [] # heap of (priority, size, sequence, path, key)
+        self._queued = set() # keys queued or being copied
+        self._sequence = count()
+        self._fetches = 0
+        self._cache_lock = threading.Lock()
+        self._others = set() # files under the mount open in other processes (relative to it), as of _checked
+        self._checked = None
+
+    def enqueue(self, entries):
+        """
+        Queue files for prefetch: entries are (path under the mount, URLFS index line, priority), lower priorities
+        going first.
+        """
+        for path, line, priority in entries:
+            key = cache_key(line)
+            if key is None or key in self._queued:
+                continue
+            size = index_entry_size(line)
+            if size is not None and size > self.max_bytes:
+                continue
+            heapq.heappush(self._queue, (priority, size if size is not None else float('inf'), next(self._sequence),
+                                         path, key))
+            self._queued.add(key)
+            stats['queued'] += 1
+        while self._fetches < self.max_fetches and len(self._queue) > 0:
+            self._fetches += 1
+            asyncio.ensure_future(self._work())
+
+    async def _work(self):
+        try:
+            while len(self._queue) > 0:
+                priority, size, sequence, path, key = heapq.heappop(self._queue)
+                try:
+                    await self._fetch(path, key)
+                except Exception as e:
+                    log.warning("autolaunch: unable to prefetch %s: %r", path, e)
+                finally:
+                    self._queued.discard(key)
+        finally:
+            self._fetches -= 1
+
+    async def _fetch(self, path, key):
+        target = os.path.join(self.cachedir, key)
+        if await run_blocking(os.path.isfile, target):
+            stats['already_cached'] += 1
+            return
+        await run_blocking(os.makedirs, self.cachedir, 0o700, True)
+        part = target + '.part'
+        src = await run_blocking(open, path, "rb", timeout=self.read_timeout, remote=True)
+        try:
+            with open(part, "wb") as dst:
+                copied = 0
+                while True:
+                    if not await self._quiet(path):
+                        stats['cancelled'] += 1
+                        await run_blocking(os.remove, part)
+                        return
+                    chunk = await run_blocking(src.read, self.chunk_size, timeout=self.read_timeout, remote=True)
+                    if len(chunk) == 0:
+                        break
+                    await run_blocking(dst.write, chunk)
+                    copied += len(chunk)
+        except BaseException:
+            await run_blocking(_remove, part)
+            raise
+        finally:
+            src.close()
+        await run_blocking(self._admit, part, target, copied)
+        stats['prefetched_files'] += 1
+        stats['prefetched_bytes'] += copied
+
+    async def _quiet(self, path):
+        # wait until no other process reads from the mount; False if one has path open (and it should be left alone)
+        while True:
+            if self._checked is None or time.monotonic() - self._checked > self.check_interval:
+                self._others = await run_blocking(_open_files, self.mountdir, timeout=self.read_timeout)
+                self._checked = time.monotonic()
+            if os.path.relpath(path, self.mountdir) in self._others:
+                return False
+            if len(self._others) == 0:
+                return True
+            await asyncio.sleep(self.check_interval)
+
+    def _admit(self, part, target, size):
+        # move a copy in place, evicting the least recently used ones as needed to stay within max_bytes
+        with self._cache_lock:
+            entries = []
+            total = size
+            for name in os.listdir(self.cachedir):
+                if name.endswith('.part'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.cachedir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, name, st.st_size))
+                total += st.st_size
+            for used, name, esize in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                _remove(os.path.join(self.cachedir, name))
+                stats['evicted_bytes'] += esize
+                total -= esize
+            os.replace(part, target)
+
+
+def _remove(fil):
+    try:
+        os.remove(fil)
+    except FileNotFoundError:
+        pass
+
+
+def _open_files(mountdir):
+    """
+    The files under mountdir (relative to it) that processes other than this one have open (from /proc, where
+    available).
+    """
+    found = set()
+    if not os.path.isdir('/proc'):
+        return found
+    mountdir = os.path.realpath(mountdir) # as the links in /proc are
+    prefix = mountdir.rstrip('/') + '/'
+    me = str(os.getpid())
+    for d in os.listdir('/proc'):
+        if not d.isdigit() or d == me:
+            continue
+        fddir = os.path.join('/proc', d, 'fd')
+        try:
+            fds = os.listdir(fddir)
+        except OSError:
+            continue # gone, or not ours to look at
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fddir, fd))
+            except OSError:
+                continue
+            if target.startswith(prefix):
+                found.add(os.path.relpath(target, mountdir))
+    return found
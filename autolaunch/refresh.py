@@ -0,0 +1,140 @@
+"""
+Refreshing credentials ahead of time, and as soon as reads through URLFS fail for lack of them.
+
+Credentials whose auth handler can renew them without the user (see AuthBaseHandlerClass.refreshSilently) are
+refreshed refresh_ahead seconds before they expire (as recorded in the store, from getExpiry), so that reads
+through URLFS never wait for a refresh, nor fail partway through an analysis.
+
+URLFS only reports a failed read to whoever made it, so readers (such as the refresh glue in notebooks) report
+auth-related IO errors to /autolaunch/auth-error, which refreshes the credentials involved right away. Refreshes
+of the same credentials are coalesced: simultaneous failures cause a single refresh, which all of them wait for,
+and failures reported just after a refresh are taken care of by it.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from .auth import auth_handlers
+from ._blocking import run_blocking
+from .store import get_store
+from .urlfs import get_mount
+
+log = logging.getLogger(__name__)
+
+# counters since server start
+stats = {
+    'scheduled_refreshes': 0, # ahead of expiry
+    'error_refreshes': 0, # after a reported IO error
+    'interactive_refreshes': 0, # that turned out to need the user
+    'failed_refreshes': 0,
+}
+
+
+class RefreshScheduler:
+    """Refreshes the credentials of the sources under basedir. Must only be used from the event loop."""
+    refresh_ahead = 300 # seconds before expiry that credentials are refreshed
+    check_interval = 60 # seconds between looks at upcoming expiries (at most)
+    recent_window = 10 # seconds after a refresh that errors reported are considered taken care of by it
+    config_timeout = 30
+    reload_timeout = 10
+
+    def __init__(self, basedir):
+        self.configdir = os.path.join(basedir, '.remote-config')
+        self.mountdir = os.path.join(basedir, 'remote')
+        self._refreshing = {} # auth_uuid -> task refreshing it
+        self._refreshed = {} # auth_uuid -> when it was last refreshed
+        self._interactive = set() # auth_uuids whose credentials need the user to be refreshed
+        self._task = None
+
+    def start(self):
+        """Start refreshing credentials ahead of their expiry."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def refresh(self, auth_uuid, scheduled=False):
+        """
+        Refresh the credentials of auth_uuid without user interaction, unless already being (or just) refreshed.
+        Returns True if they were refreshed, False if that needs the user (see RefreshAuthHandler) or they are unknown.
+        """
+        task = self._refreshing.get(auth_uuid)
+        if task is None:
+            if not scheduled and time.monotonic() - self._refreshed.get(auth_uuid, -self.recent_window) < self.recent_window:
+                return True
+            stats['scheduled_refreshes' if scheduled else 'error_refreshes'] += 1
+            task = asyncio.ensure_future(self._refresh(auth_uuid))
+            self._refreshing[auth_uuid] = task
+            task.add_done_callback(lambda t: self._refreshing.pop(auth_uuid, None))
+        return await asyncio.shield(task)
+
+    def refreshed(self, auth_uuid):
+        """Note that the credentials of auth_uuid were just refreshed by the user."""
+        self._interactive.discard(auth_uuid)
+        self._refreshed[auth_uuid] = time.monotonic()
+
+    async def find_auth(self, path):
+        """Return the auth UUID of the credentials used to read path (under the URLFS mount), or None."""
+        path = os.path.relpath(os.path.join(self.mountdir, path), self.mountdir)
+        if path.startswith('..') or not os.path.isdir(self.configdir):
+            return None
+        store = await run_blocking(get_store, self.configdir, timeout=self.config_timeout)
+        return await run_blocking(store.find_auth_for_path, path, timeout=self.config_timeout)
+
+    async def _refresh(self, auth_uuid):
+        try:
+            store = await run_blocking(get_store, self.configdir, timeout=self.config_timeout)
+            found = await run_blocking(store.find_refresh_info, auth_uuid, timeout=self.config_timeout)
+            if found is None or found[1] is None or not (found[0] in auth_handlers):
+                return False
+            authhandler = await auth_handlers[found[0]].refreshSilently(auth_uuid, found[1])
+            if authhandler is None:
+                stats['interactive_refreshes'] += 1
+                self._interactive.add(auth_uuid)
+                return False
+            idxfiles = await run_blocking(store.replace_auth, auth_uuid, lambda token_hint, refresh_info: authhandler,
+                                          timeout=self.config_timeout)
+            if len(idxfiles) > 0 and await run_blocking(os.path.ismount, self.mountdir, timeout=self.reload_timeout,
+                                                        remote=True):
+                await get_mount(os.path.join(self.configdir, 'remote.config'), self.mountdir).reload(timeout=self.reload_timeout)
+            self._refreshed[authhandler.getAuthUUID()] = time.monotonic()
+            return True
+        except Exception:
+            stats['failed_refreshes'] += 1
+            raise
+
+    async def _run(self):
+        while True:
+            try:
+                delay = await self._refresh_expiring()
+            except Exception:
+                log.exception("autolaunch: refreshing expiring credentials failed")
+                delay = self.check_interval
+            await asyncio.sleep(delay)
+
+    async def _refresh_expiring(self):
+        # refresh what is due, and return how long until the next look
+        if not os.path.isdir(self.configdir):
+            return self.check_interval
+        store = await run_blocking(get_store, self.configdir, timeout=self.config_timeout)
+        now = time.time()
+        upcoming = await run_blocking(store.find_expiring, now + self.refresh_ahead + self.check_interval,
+                                      timeout=self.config_timeout)
+        delay = self.check_interval
+        due = []
+        for auth_uuid, expires in upcoming:
+            if auth_uuid in self._interactive:
+                continue
+            if expires - self.refresh_ahead <= now:
+                due.append(auth_uuid)
+            else:
+                delay = min(delay, expires - self.refresh_ahead - now)
+        for auth_uuid, result in zip(due, await asyncio.gather(*[self.refresh(u, scheduled=True) for u in due],
+                                                               return_exceptions=True)):
+            if isinstance(result, Exception):
+                log.warning("autolaunch: could not refresh credentials %s: %r", auth_uuid, result)
+        return max(delay, 1)
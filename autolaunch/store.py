@@ -0,0 +1,451 @@
+"""
+Transactional store for the state autolaunch keeps about remote data sources.
+
+Each launch adds one URLFS index file (remote.N) together with the auth headers URLFS must send for it,
+and the information needed to refresh those credentials later. This used to be appended to, and rewritten
+from, two tab-separated files (token-refresh.config and remote.config), which was neither safe under
+concurrent requests nor fast to search. It is now kept in a SQLite database (in WAL mode) in the
+.remote-config directory, indexed by auth UUID, and every change is made in a single transaction.
+
+The lines of the index files are also kept in the store, indexed by path, so that finding the source serving a
+file (find_index_entry) is a single lookup rather than a scan of every index file. Readers in other processes (such
+as notebooks finding cached copies) open the store read-only (get_store(configdir, readonly=True)), so that they
+never write to it, and do not invalidate the server's export.
+
+The store also caches which analysis handler recognized each remote file (see detect.py), keyed by the
+file's URL and validated by the size/mtime/ETag fields of its URLFS index line, so that relaunching the
+same data does not need to read it again.
+
+Launching the very same list of files again reuses its index file (found by a hash of its content) rather than
+adding another one, and compact() removes sources that are orphaned, expired or duplicated, so that the
+configuration URLFS reloads does not keep growing on long-lived servers.
+
+URLFS itself still reads remote.config, so that file (and token-refresh.config, for anything else that
+may read it) is re-exported atomically whenever the stored data changes. The exported lines are kept in memory,
+so that a change to a few sources (such as an auth refresh) only regenerates their lines, and nothing is
+exported (or reloaded) when nothing changed.
+
+All methods block, and should be called from a worker thread (see _blocking.run_blocking).
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import json
+import os
+
+db_name = 'autolaunch.sqlite'
+detection_cache_size = 10000 # entries; least recently used ones are evicted beyond this
+expired_retention = 30 * 24 * 3600 # seconds after their credentials expire that sources are compacted away
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    idxfile TEXT PRIMARY KEY,
+    auth_uuid TEXT NOT NULL,
+    token_hint TEXT NOT NULL,
+    refresh_info TEXT,
+    headers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sources_auth_uuid ON sources (auth_uuid);
+CREATE TABLE IF NOT EXISTS detections (
+    url TEXT PRIMARY KEY,
+    validators TEXT NOT NULL,
+    hint TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT NOT NULL,
+    idxfile TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+CREATE INDEX IF NOT EXISTS entries_idxfile ON entries (idxfile);
+"""
+
+# columns added to sources since it was first created, added to older stores when opened
+_SOURCES_COLUMNS = [
+    ("slot", "INTEGER"), # N of remote.N
+    ("content_hash", "TEXT"), # of the index file's lines (NULL if not known)
+    ("expires", "REAL"), # when the credentials expire (NULL if unknown)
+    ("indexed", "INTEGER"), # whether the index file's lines are in entries (NULL if not yet)
+]
+_SOURCES_INDEXES = """
+CREATE INDEX IF NOT EXISTS sources_slot ON sources (slot);
+CREATE INDEX IF NOT EXISTS sources_content_hash ON sources (content_hash, token_hint);
+CREATE INDEX IF NOT EXISTS sources_expires ON sources (expires);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(configdir, readonly=False):
+    """
+    Return the (shared, per configdir) ConfigStore, opening it if needed. If readonly, it is opened for lookups only
+    (as by processes other than the server), and None returned if there is no store yet.
+    """
+    with _stores_lock:
+        key = (configdir, readonly)
+        if key not in _stores:
+            if readonly and not os.path.isfile(os.path.join(configdir, db_name)):
+                return None
+            _stores[key] = ConfigStore(configdir, readonly)
+        return _stores[key]
+
+
+class ConfigStore:
+    def __init__(self, configdir, readonly=False):
+        self.configdir = configdir
+        self.remote_config = os.path.join(configdir, 'remote.config')
+        self.refresh_config = os.path.join(configdir, 'token-refresh.config')
+        path = os.path.join(configdir, db_name)
+        is_new = not os.path.isfile(path)
+        # One connection, serialized by our own lock: all callers are worker threads of the same process,
+        # and sqlite serializes against any other process.
+        self._lock = threading.RLock()
+        self._exported = None # idxfile -> (remote.config line, token-refresh.config line), in export order
+        self._exported_version = None # data_version when exported (which changes if other processes write)
+        self._exported_rowid = None # highest rowid exported
+        if readonly:
+            self._db = sqlite3.connect("file:" + path + "?mode=ro", uri=True, check_same_thread=False, isolation_level=None)
+            return
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._upgrade()
+        if is_new:
+            self._import_legacy()
+
+    def _upgrade(self):
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sources)")}
+        for name, kind in _SOURCES_COLUMNS:
+            if not (name in columns):
+                self._db.execute("ALTER TABLE sources ADD COLUMN " + name + " " + kind)
+        self._db.executescript(_SOURCES_INDEXES)
+        with self._transaction(export=False) as db:
+            for idxfile, in db.execute("SELECT idxfile FROM sources WHERE slot IS NULL").fetchall():
+                slot = os.path.basename(idxfile).rsplit(".", 1)[-1]
+                if slot.isdigit():
+                    db.execute("UPDATE sources SET slot = ? WHERE idxfile = ?", (int(slot), idxfile))
+            _index_sources(db)
+
+    def _transaction(self, export=True, changed=None):
+        return _Transaction(self, export, changed)
+
+    def _import_legacy(self):
+        # Carry over sources configured before the store existed.
+        if not os.path.isfile(self.refresh_config):
+            return
+        headers = {}
+        if os.path.isfile(self.remote_config):
+            with open(self.remote_config, "r") as f:
+                for l in f:
+                    lin = l.rstrip("\n").split("\t")
+                    headers[lin[0]] = lin[1:]
+        with self._transaction() as db:
+            with open(self.refresh_config, "r") as f:
+                for l in f:
+                    lin = l.rstrip("\n").split("\t")
+                    if len(lin) < 4:
+                        continue
+                    slot = lin[0].rsplit(".", 1)[-1]
+                    db.execute("INSERT OR REPLACE INTO sources (idxfile, auth_uuid, token_hint, refresh_info, headers, slot) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (lin[0], lin[1], lin[2], lin[3], json.dumps(headers.get(lin[0], [])),
+                                int(slot) if slot.isdigit() else None))
+            _index_sources(db)
+
+    def add_source(self, authhandler, token_hint, files_urlfs):
+        """
+        Register files_urlfs with the auth headers and refresh info of authhandler. If the very same list of files was
+        registered before (with the same kind of auth), its index file is reused, and only its credentials replaced
+        (it then wins over the sources added since, as a new index file would).
+        Otherwise a new index file is written (if files_urlfs is empty, more lines can be appended to it later).
+        Returns the path of the index file.
+        """
+        return self.add_sources([(authhandler, token_hint, files_urlfs)])[0]
+
+    def add_sources(self, sources):
+        """
+        Like add_source, for each (authhandler, token_hint, files_urlfs) in sources, all in a single transaction
+        (and export). Returns the paths of the index files.
+        """
+        idxfiles = []
+        with self._transaction(changed=idxfiles) as db:
+            for authhandler, token_hint, files_urlfs in sources:
+                content_hash = _content_hash(files_urlfs) if len(files_urlfs) > 0 else None
+                creds = (authhandler.getAuthUUID(), json.dumps(authhandler.getRefreshInfo()),
+                         json.dumps(authhandler.getAuthHeaders()), authhandler.getExpiry())
+                row = None
+                if content_hash is not None:
+                    row = db.execute("SELECT idxfile FROM sources WHERE content_hash = ? AND token_hint = ? "
+                                     "ORDER BY rowid DESC LIMIT 1", (content_hash, token_hint)).fetchone()
+                if row is not None and os.path.isfile(row[0]):
+                    idxfile = row[0]
+                    # moved after every other source, as a new one would be, so that it wins again
+                    db.execute("UPDATE sources SET rowid = (SELECT MAX(rowid) + 1 FROM sources), auth_uuid = ?, "
+                               "refresh_info = ?, headers = ?, expires = ? WHERE idxfile = ?", creds + (idxfile,))
+                else:
+                    slot = self._next_slot(db)
+                    idxfile = os.path.join(self.configdir, "remote." + str(slot))
+                    with open(idxfile, "w") as f:
+                        for fil in files_urlfs:
+                            f.write(fil + "\n")
+                    db.execute("INSERT OR REPLACE INTO sources (idxfile, token_hint, slot, content_hash, auth_uuid, "
+                               "refresh_info, headers, expires, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                               (idxfile, token_hint, slot, content_hash) + creds)
+                    db.execute("DELETE FROM entries WHERE idxfile = ?", (idxfile,))
+                    _index_lines(db, idxfile, files_urlfs)
+                idxfiles.append(idxfile)
+        return idxfiles
+
+    def append_lines(self, idxfile, lines):
+        """Append lines to the index file idxfile (as added with no lines, or fewer)."""
+        with self._transaction(export=False) as db:
+            _index_lines(db, idxfile, lines)
+            with open(idxfile, "a") as f:
+                for l in lines:
+                    f.write(l + "\n")
+
+    def _next_slot(self, db):
+        # one past the highest slot in use (skipping over any stray index files not in the store)
+        slot = db.execute("SELECT COALESCE(MAX(slot), -1) + 1 FROM sources").fetchone()[0]
+        while os.path.isfile(os.path.join(self.configdir, "remote." + str(slot))):
+            slot = slot + 1
+        return slot
+
+    def compact(self, retention=None):
+        """
+        Remove sources whose index file is gone, sources whose credentials expired more than retention seconds
+        (default: expired_retention) ago, and older duplicates of the same list of files; then delete index files no
+        longer registered. Returns a dictionary counting what was removed. URLFS should be reloaded afterwards.
+        """
+        if retention is None:
+            retention = expired_retention
+        removed = {'orphaned_sources': 0, 'expired_sources': 0, 'duplicate_sources': 0, 'orphaned_index_files': 0}
+        cutoff = time.time() - retention
+        with self._lock:
+            with self._transaction() as db:
+                doomed = []
+                seen = set()
+                rows = db.execute("SELECT idxfile, token_hint, content_hash, expires FROM sources "
+                                  "ORDER BY rowid DESC").fetchall()
+                for idxfile, token_hint, content_hash, expires in rows:
+                    if not os.path.isfile(idxfile):
+                        removed['orphaned_sources'] += 1
+                    elif expires is not None and expires < cutoff:
+                        removed['expired_sources'] += 1
+                    else:
+                        if content_hash is None:
+                            with open(idxfile, "r") as f:
+                                content_hash = _content_hash([l.rstrip("\n") for l in f])
+                            db.execute("UPDATE sources SET content_hash = ? WHERE idxfile = ?", (content_hash, idxfile))
+                        if not ((content_hash, token_hint) in seen):
+                            seen.add((content_hash, token_hint))
+                            continue
+                        removed['duplicate_sources'] += 1 # a newer source serves the same files
+                    doomed.append((idxfile,))
+                db.executemany("DELETE FROM sources WHERE idxfile = ?", doomed)
+                db.executemany("DELETE FROM entries WHERE idxfile = ?", doomed)
+                known = {row[0] for row in db.execute("SELECT idxfile FROM sources")}
+            for name in os.listdir(self.configdir):
+                fil = os.path.join(self.configdir, name)
+                if name.startswith("remote.") and name[7:].isdigit() and not (fil in known):
+                    os.remove(fil)
+                    removed['orphaned_index_files'] += 1
+        return removed
+
+    def find_refresh_info(self, auth_uuid):
+        """Return (token_hint, refresh_info) of a source using auth_uuid, or None if there is none."""
+        with self._lock:
+            row = self._db.execute("SELECT token_hint, refresh_info FROM sources WHERE auth_uuid = ? LIMIT 1",
+                                   (auth_uuid,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def find_expiring(self, before):
+        """Return (auth_uuid, expires) for the credentials expiring before the given time, soonest first."""
+        with self._lock:
+            return self._db.execute("SELECT auth_uuid, MIN(expires) FROM sources WHERE expires < ? "
+                                    "GROUP BY auth_uuid ORDER BY 2", (before,)).fetchall()
+
+    def find_auth_for_path(self, path):
+        """Return the auth UUID of the credentials URLFS uses to read path (relative to its mount), or None."""
+        entry = self.find_index_entry(path)
+        return None if entry is None else entry[0]
+
+    def find_index_entry(self, path):
+        """
+        Return (auth_uuid, index line) of the source serving path (relative to the URLFS mount), or None if no source
+        serves it. The newest source wins, as in URLFS.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT s.idxfile, s.auth_uuid, e.line FROM entries e JOIN sources s ON "
+                                    "s.idxfile = e.idxfile WHERE e.path = ? ORDER BY s.rowid DESC, e.rowid",
+                                    ("/" + path.strip("/"),)).fetchall()
+        for idxfile, auth_uuid, line in rows:
+            if os.path.isfile(idxfile):
+                return auth_uuid, line
+        return None
+
+    def replace_auth(self, auth_uuid, make_authhandler):
+        """
+        Atomically replace the credentials of every source using auth_uuid. make_authhandler(token_hint, refresh_info)
+        must return the auth handler holding the new credentials. Returns a dictionary mapping each affected index
+        file to its new auth headers.
+        """
+        idxfiles = {}
+        with self._transaction(changed=idxfiles) as db:
+            rows = db.execute("SELECT idxfile, token_hint, refresh_info FROM sources WHERE auth_uuid = ?",
+                              (auth_uuid,)).fetchall()
+            for idxfile, token_hint, refresh_info in rows:
+                ah = make_authhandler(token_hint, json.loads(refresh_info))
+                idxfiles[idxfile] = ah.getAuthHeaders()
+                db.execute("UPDATE sources SET auth_uuid = ?, refresh_info = ?, headers = ?, expires = ? WHERE idxfile = ?",
+                           (ah.getAuthUUID(), json.dumps(ah.getRefreshInfo()), json.dumps(idxfiles[idxfile]),
+                            ah.getExpiry(), idxfile))
+        return idxfiles
+
+    def lookup_detections(self, keys):
+        """
+        Look up cached detection results for keys, a list of (url, validators). Returns a dictionary mapping
+        each key with a valid cache entry to its hint ('' if no handler recognized that file).
+        """
+        found = {}
+        wanted = {}
+        for key in keys:
+            wanted.setdefault(key[0], set()).add(key[1])
+        urls = list(wanted)
+        with self._lock:
+            for i in range(0, len(urls), 500): # stay below sqlite's limit on host parameters
+                batch = urls[i:i+500]
+                rows = self._db.execute("SELECT url, validators, hint FROM detections WHERE url IN (" +
+                                        ",".join("?" * len(batch)) + ")", batch).fetchall()
+                for url, validators, hint in rows:
+                    if validators in wanted[url]:
+                        found[(url, validators)] = hint
+        return found
+
+    def record_detections(self, results):
+        """
+        Store detection results, a dictionary mapping (url, validators) to hint, marking them as most recently
+        used. Entries for the same url with different validators are replaced, and the least recently used
+        entries are evicted beyond detection_cache_size.
+        """
+        if len(results) == 0:
+            return
+        now = time.time()
+        with self._transaction(export=False) as db:
+            db.executemany("INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?)",
+                           [(key[0], key[1], hint, now) for key, hint in results.items()])
+            db.execute("DELETE FROM detections WHERE url IN (SELECT url FROM detections ORDER BY last_used DESC "
+                       "LIMIT -1 OFFSET ?)", (detection_cache_size,))
+
+    def export(self, changed=None):
+        """
+        (Re)write remote.config and token-refresh.config from the store, atomically. If changed (index files) is given,
+        only the lines of those are regenerated, and the others reused from the previous export.
+        """
+        with self._lock:
+            columns = "SELECT idxfile, auth_uuid, token_hint, refresh_info, headers, rowid FROM sources"
+            version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if changed is None or self._exported is None or version != self._exported_version:
+                self._exported = {}
+                self._exported_rowid = 0
+                for row in self._db.execute(columns + " ORDER BY rowid"):
+                    self._exported[row[0]] = _export_lines(row)
+                    self._exported_rowid = row[5]
+            else:
+                changed = list(changed)
+                rows = []
+                for i in range(0, len(changed), 500):
+                    batch = changed[i:i + 500]
+                    found = set()
+                    for row in self._db.execute(columns + " WHERE idxfile IN (" + ",".join("?" * len(batch)) + ")",
+                                                batch):
+                        rows.append(row)
+                        found.add(row[0])
+                    for idxfile in batch:
+                        if not (idxfile in found):
+                            self._exported.pop(idxfile, None)
+                last = self._exported_rowid
+                for row in sorted(rows, key=lambda row: row[5]):
+                    if row[5] > last:
+                        # new (or reused, and so moved) sources have the highest rowids: they go last
+                        self._exported.pop(row[0], None)
+                        self._exported_rowid = row[5]
+                    self._exported[row[0]] = _export_lines(row)
+            self._exported_version = version
+            lines = self._exported.values()
+            with open(self.remote_config + '.new', "w") as f:
+                f.write("".join(l[0] for l in lines))
+            with open(self.refresh_config + '.new', "w") as f:
+                f.write("".join(l[1] for l in lines))
+            os.replace(self.remote_config + '.new', self.remote_config)
+            os.replace(self.refresh_config + '.new', self.refresh_config)
+
+
+def _export_lines(row):
+    # the remote.config and token-refresh.config lines of a row of sources
+    return ("\t".join([row[0]] + json.loads(row[4])) + "\n", "\t".join(row[:4]) + "\n")
+
+
+def _index_lines(db, idxfile, lines):
+    # add the file lines of idxfile to entries
+    db.executemany("INSERT INTO entries (path, idxfile, line) VALUES (?, ?, ?)",
+                   [(l.split("\t", 2)[1], idxfile, l) for l in lines if l.startswith("F\t")])
+
+
+def _index_sources(db):
+    # add the lines of the index files of sources not indexed yet (as added before entries were kept) to entries
+    for idxfile, in db.execute("SELECT idxfile FROM sources WHERE indexed IS NULL").fetchall():
+        try:
+            with open(idxfile, "r") as f:
+                _index_lines(db, idxfile, [l.rstrip("\n") for l in f])
+        except FileNotFoundError:
+            pass
+        db.execute("UPDATE sources SET indexed = 1 WHERE idxfile = ?", (idxfile,))
+
+
+def _content_hash(lines):
+    h = hashlib.sha256()
+    for l in lines:
+        h.update(l.encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class _Transaction:
+    """
+    Context manager holding the store lock and an immediate (write) transaction, that is committed (and
+    exported, if export is set) on success, and rolled back on failure. If changed is given, it is filled in
+    (while in the transaction) with the index files changed, and only those are exported; none if it is empty.
+    """
+    def __init__(self, store, export=True, changed=None):
+        self.store = store
+        self.export = export
+        self.changed = changed
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        try:
+            self.store._db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.store._lock.release()
+            raise
+        return self.store._db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.store._db.execute("COMMIT")
+                if self.export and (self.changed is None or len(self.changed) > 0):
+                    self.store.export(self.changed)
+            else:
+                self.store._db.execute("ROLLBACK")
+        finally:
+            self.store._lock.release()
+        return False
@@ -0,0 +1,183 @@
+"""
+Glue for the URLFS file backend: mounting it, and asking running instances to reload their configuration.
+
+URLFS re-reads its whole configuration whenever it receives SIGUSR1, so reload requests are coalesced: a request
+made while no signal is on its way sends one right away, and all requests made while a signal is on its way, or
+within min_signal_interval seconds of it going out (while URLFS is still busy re-reading), are served by a single
+next one, sent at the end of that interval. Each request waits until a signal sent after it was made (and so
+covering the configuration changes made before it) has gone out. The process to signal is remembered from when we
+mounted URLFS ourselves; it is only looked up (among running processes) for mounts we did not create, or if the
+remembered process has gone away.
+"""
+from signal import SIGUSR1
+import asyncio
+import os
+
+from ._blocking import run_blocking, run_process
+
+mount_cmd = "/urlfs/src/mount.urlfs"
+min_signal_interval = 0.1 # seconds from a reload signal going out to the next one being sent
+
+# counters since server start
+stats = {
+    'reload_requests': 0,
+    'reloads': 0, # signals actually sent out (one per coalesced batch of requests)
+}
+
+_mounts = {}
+
+
+def get_mount(configfile, mountdir):
+    """Return the (shared) URLFSMount for configfile at mountdir."""
+    key = (configfile, mountdir)
+    if key not in _mounts:
+        _mounts[key] = URLFSMount(configfile, mountdir)
+    return _mounts[key]
+
+
+class URLFSMount:
+    """
+    A URLFS instance serving the index files listed in configfile at mountdir. Must only be used from the event loop.
+    """
+    def __init__(self, configfile, mountdir):
+        self.configfile = configfile
+        self.mountdir = mountdir
+        self.pids = None # processes serving the mount, if known
+        self._mount_lock = asyncio.Lock()
+        self._pending = None # future completed by the next reload signal
+        self._signalling = False # whether a signal is on its way
+
+    async def ensure_mounted(self, timeout=None):
+        """Mount URLFS if it is not already mounted. Returns True if it was mounted by this call."""
+        async with self._mount_lock:
+            if await run_blocking(os.path.ismount, self.mountdir, timeout=timeout, remote=True):
+                return False
+            await run_blocking(_ensure_mountpoint, self.mountdir, timeout=timeout)
+            proc = await asyncio.create_subprocess_exec(mount_cmd, self.configfile, self.mountdir)
+            # mount.urlfs normally daemonizes, in which case the process we started exits once mounted;
+            # if instead it stays in the foreground, it is the one serving the mount
+            deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+            while proc.returncode is None:
+                try:
+                    await asyncio.wait_for(proc.wait(), 0.1)
+                except asyncio.TimeoutError:
+                    if await run_blocking(os.path.ismount, self.mountdir, remote=True):
+                        self.pids = [proc.pid]
+                        return True
+                    if deadline is not None and asyncio.get_running_loop().time() > deadline:
+                        proc.kill()
+                        raise
+            self.pids = await run_blocking(_find_pids, self.mountdir, timeout=timeout)
+            return True
+
+    async def reload(self, timeout=None):
+        """
+        Ask URLFS to re-read its configuration, and wait until it has been signalled to do so (after this call).
+        """
+        stats['reload_requests'] += 1
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+            if not self._signalling:
+                self._start_signal(timeout)
+        await asyncio.wait_for(asyncio.shield(self._pending), timeout)
+
+    def _start_signal(self, timeout):
+        self._signalling = True
+        asyncio.ensure_future(self._signal(timeout))
+
+    async def _signal(self, timeout):
+        # from here on, new requests wait for the next signal, sent once this one has gone out
+        done, self._pending = self._pending, None
+        try:
+            await self._send_signal(timeout)
+            stats['reloads'] += 1
+            done.set_result(None)
+            # requests made while URLFS re-reads its configuration are batched into the next signal
+            await asyncio.sleep(min_signal_interval)
+        except Exception as e:
+            self.pids = None
+            done.set_exception(e)
+        finally:
+            self._signalling = False
+            if self._pending is not None:
+                self._start_signal(timeout)
+
+    async def _send_signal(self, timeout):
+        if self.pids is None or not all(map(_is_running, self.pids)):
+            self.pids = await run_blocking(_find_pids, self.mountdir, timeout=timeout)
+            if len(self.pids) == 0:
+                # fall back to pidof (multiple should not be found, but in case user also used it separately from us,
+                # reload all instances)
+                returncode, out = await run_process(["pidof", "mount.urlfs"], timeout=timeout, capture_output=True)
+                self.pids = list(map(int, out.split())) if returncode == 0 else []
+        for pid in self.pids:
+            os.kill(pid, SIGUSR1)
+
+
+def _ensure_mountpoint(mountdir):
+    if not os.path.isdir(mountdir):
+        os.mkdir(mountdir)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _find_pids(mountdir):
+    """
+    Find the URLFS processes serving mountdir, from /proc (where available; an empty list is returned otherwise).
+    """
+    pids = []
+    if not os.path.isdir('/proc'):
+        return pids
+    for d in os.listdir('/proc'):
+        if not d.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', d, 'cmdline'), 'rb') as f:
+                args = f.read().split(b'\0')
+        except OSError:
+            continue # gone, or not ours to look at
+        if os.path.basename(args[0]) == b'mount.urlfs' and os.fsencode(mountdir) in args:
+            pids.append(int(d))
+    return pids
+
+
+def locate(path):
+    """
+    For an (absolute) path under a URLFS mount set up by autolaunch (at <basedir>/remote, configured from
+    <basedir>/.remote-config), return (configdir, path relative to the mount); None for any other path.
+    """
+    d = os.path.dirname(path)
+    while os.path.dirname(d) != d:
+        configdir = os.path.join(os.path.dirname(d), '.remote-config')
+        if os.path.basename(d) == 'remote' and os.path.isdir(configdir):
+            return configdir, os.path.relpath(path, d)
+        d = os.path.dirname(d)
+    return None
+
+
+def index_entry_key(line):
+    """
+    Return (url, validators) identifying the remote content behind a file ('F') line of a URLFS index file,
+    where validators are the fields following the URL (size, mtime or ETag). Returns None for other lines,
+    and for lines without validators, as there is then no way to tell when the content changes.
+    """
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) < 4 or fields[0] != 'F':
+        return None
+    return fields[2], "\t".join(fields[3:])
+
+
+def index_entry_size(line):
+    """Return the size, in bytes, of a file ('F') line of a URLFS index file, or None if it is not known."""
+    fields = line.rstrip("\n").split("\t")
+    if len(fields) < 4 or fields[0] != 'F' or not fields[3].isdigit():
+        return None
+    return int(fields[3])
@@ -0,0 +1,112 @@
+"""
+Benchmark: provisioning many datasets with one POST /autolaunch/batch versus one GET /autolaunch per dataset, both
+sent one after the other (as a script launching datasets in turn would) and all at once.
+
+The real handlers are served by a Tornado app, with a stand-in for JupyterHandler (every request is from a logged
+in user) and for URLFS: the mount is always there, and every reload signal takes reload_cost seconds (URLFS
+re-reading its whole configuration; reloads are still coalesced as usual). Everything else (the config store, index
+files, identification) is real. The launched files are logs, which are never read (nor any notebook copied).
+
+    python benchmarks/bench_batch.py [datasets] [files per dataset] [reload cost in ms]
+"""
+from base64 import urlsafe_b64encode
+from urllib.parse import urlencode
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tornado import httpclient, web
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from autolaunch import _compat, urlfs
+
+reload_cost = 0.02
+
+
+class BenchBaseHandler(web.RequestHandler):
+    """Stands in for JupyterHandler: every request is from a logged in user, and the server is at /."""
+    base_url = '/'
+
+    def get_current_user(self):
+        return 'bench'
+
+
+# the handlers must be imported once their base class is set
+_compat._JupyterHandler = BenchBaseHandler
+from autolaunch import handlers
+from autolaunch.encoding import encode_files
+from autolaunch.launch import Launcher
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount that is always mounted already."""
+    async def ensure_mounted(self, timeout=None):
+        return False
+
+    async def _send_signal(self, timeout):
+        await asyncio.sleep(reload_cost)
+
+
+def dataset(n, nfiles):
+    files = ['F\t/sample-%03d/run-%03d.log\thttps://lims.example.org/data/sample-%03d/run-%03d.log\t0\t%d'
+             % (n, i, n, i, 1717200000 + i) for i in range(nfiles)]
+    token = urlsafe_b64encode(json.dumps({'token': 'token-%d' % n}).encode()).decode()
+    return {'auth_token': token, 'files': encode_files(files)}
+
+
+async def run(ndatasets, nfiles):
+    sock, port = bind_unused_port()
+    app = web.Application([
+        (r'/autolaunch', handlers.AutoLaunchHandler),
+        (r'/autolaunch/batch', handlers.BatchLaunchHandler),
+    ])
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=max(ndatasets, 10))
+    url = 'http://127.0.0.1:%d/autolaunch' % port
+    batch = [dataset(n, nfiles) for n in range(ndatasets)]
+
+    async def get(params):
+        response = await client.fetch(url + '?' + urlencode(params), follow_redirects=False, raise_error=False,
+                                      request_timeout=600)
+        assert response.code == 302, response.code
+
+    for name in ('GET, in turn', 'GET, at once', 'batch POST'):
+        basedir = tempfile.mkdtemp()
+        app.settings['server_root_dir'] = basedir
+        launcher = Launcher(basedir, '/')
+        configfile = os.path.join(launcher.configdir, 'remote.config')
+        urlfs._mounts[(configfile, launcher.mountdir)] = StandInMount(configfile, launcher.mountdir)
+        # set up the server root (as the first launch on a server would) before timing
+        await launcher.warm_up()
+        reloads = urlfs.stats['reloads']
+        start = time.perf_counter()
+        if name == 'GET, in turn':
+            for params in batch:
+                await get(params)
+        elif name == 'GET, at once':
+            await asyncio.gather(*[get(params) for params in batch])
+        else:
+            response = await client.fetch(url + '/batch', method='POST', body=json.dumps(batch), request_timeout=600)
+            assert all('url' in r for r in json.loads(response.body)['results'])
+        elapsed = time.perf_counter() - start
+        print("%-12s %4d datasets x %4d files: %8.3f s, %7.1f datasets/s, %4d reloads"
+              % (name, ndatasets, nfiles, elapsed, ndatasets / elapsed, urlfs.stats['reloads'] - reloads))
+    client.close()
+    server.stop()
+
+
+def main(ndatasets=50, nfiles=20, reload_ms=20):
+    global reload_cost
+    reload_cost = reload_ms / 1000
+    handlers.AutoLaunchHandler.background = False # time launches up to the redirect to the analysis
+    Launcher.prefetch = False
+    asyncio.run(run(ndatasets, nfiles))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,87 @@
+"""
+Benchmark: getting the data out of an MPMS3 .dat file by parsing it line by line in pure Python (as notebooks do),
+versus building the columnar cache once and loading (memory-mapping) it afterwards.
+
+    python benchmarks/bench_columnar.py [size in MB]
+"""
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+COLUMNS = ['Comment', 'Time Stamp (sec)', 'Temperature (K)', 'Magnetic Field (Oe)', 'Moment (emu)',
+           'M. Std. Err. (emu)', 'Transport Action', 'Averaging Time (sec)', 'Frequency (Hz)', 'Peak Amplitude (mm)',
+           'Center Position (mm)', 'Lockin Signal\' (V)', 'Lockin Signal\' [Mean] (V)', 'Range', 'M. Quad. Signal (Vpp)',
+           'Min. Temperature (K)', 'Max. Temperature (K)', 'Min. Field (Oe)', 'Max. Field (Oe)', 'Mass (grams)']
+
+
+def write_dat(fil, size, seed=0):
+    rnd = random.Random(seed)
+    with open(fil, "w") as f:
+        f.write("[Header]\n; generated\nTITLE,benchmark\nBYAPP,MPMS3,1.3.1\nINFO,bench,SAMPLE_MATERIAL\n")
+        f.write("DATATYPE,COMMENT,1\nDATATYPE,TIME,2\nSTARTUPAXIS,X,3\nSTARTUPAXIS,Y1,5\n[Data]\n")
+        f.write(",".join(COLUMNS) + "\n")
+        t = 1717200000.0
+        while f.tell() < size:
+            lines = []
+            for i in range(1000):
+                t += 0.7
+                temp = 300 * rnd.random()
+                row = ['', '%.3f' % t, '%.6g' % temp, '%.6g' % 1000.0, '%.6e' % (1e-4 / (temp + 1)), '%.3e' % 1e-8,
+                       '1', '%.3f' % 1.0, '14', '%.3f' % 5.0, '%.3f' % 33.4, '%.6e' % rnd.random(), '%.6e' % rnd.random(),
+                       '1', '%.6e' % rnd.random(), '%.6g' % (temp - 0.01), '%.6g' % (temp + 0.01), '', '', '0.012']
+                lines.append(",".join(row))
+            f.write("\n".join(lines) + "\n")
+
+
+def parse_python(fil):
+    columns = {}
+    with open(fil, "r") as f:
+        for l in f:
+            if l.strip() == '[Data]':
+                break
+        reader = csv.reader(f)
+        names = next(reader)
+        columns = {n: [] for n in names}
+        for row in reader:
+            for n, v in zip(names, row):
+                try:
+                    columns[n].append(float(v))
+                except ValueError:
+                    columns[n].append(float('nan'))
+    return columns
+
+
+def main(size_mb=100):
+    tmp = tempfile.mkdtemp()
+    os.environ['HOME'] = tmp # the cache of files outside URLFS lives in ~/.cache
+    from autolaunch.analysis.columnar import load_columns
+    fil = os.path.join(tmp, 'run.dat')
+    write_dat(fil, size_mb * 1024 * 1024)
+    size = os.path.getsize(fil) / 1024 / 1024
+
+    start = time.perf_counter()
+    temps = parse_python(fil)['Temperature (K)']
+    python = time.perf_counter() - start
+    start = time.perf_counter()
+    load_columns(fil, 'MPMS-MT')
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    header, data = load_columns(fil, 'MPMS-MT')
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    mean = float(data['Temperature (K)'].mean())
+    use = time.perf_counter() - start
+    assert abs(mean - sum(temps) / len(temps)) < 1e-6 * abs(mean)
+
+    print("%.0f MB, %d rows" % (size, len(temps)))
+    print("%-28s %10.3f s" % ('pure python parse', python))
+    print("%-28s %10.3f s" % ('build cache (first load)', build))
+    print("%-28s %10.3f ms" % ('load cached (mmap)', 1e3 * load))
+    print("%-28s %10.3f ms" % ('mean of a cached column', 1e3 * use))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
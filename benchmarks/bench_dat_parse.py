@@ -0,0 +1,73 @@
+"""
+Benchmark: throughput (MB/s) of the chunked .dat parser (analysis/qd.py) on a generated MPMS3 file, against
+parsing line by line in pure Python (on a prefix of the file only, as that takes much longer).
+
+    python benchmarks/bench_dat_parse.py [size in MB] [pure python prefix in MB]
+
+The generated data has blank fields throughout, and occasional comment rows and malformed lines.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from autolaunch.analysis import qd
+from bench_columnar import COLUMNS, parse_python
+
+
+def write_dat(fil, size, seed=0):
+    rnd = random.Random(seed)
+    block = []
+    for i in range(10000):
+        temp = 300 * rnd.random()
+        row = ['', '%.3f' % (1717200000 + 0.7 * i), '%.6g' % temp, '%.6g' % 1000.0, '%.6e' % (1e-4 / (temp + 1)),
+               '%.3e' % 1e-8, '1', '%.3f' % 1.0, '14', '%.3f' % 5.0, '%.3f' % 33.4, '%.6e' % rnd.random(),
+               '%.6e' % rnd.random(), '1', '%.6e' % rnd.random(), '%.6g' % (temp - 0.01), '%.6g' % (temp + 0.01), '', '',
+               '0.012']
+        if i % 2000 == 0:
+            row[0] = 'sample remounted' # comment row
+        if i % 5000 == 1:
+            row = row[:7] # cut short
+        block.append(",".join(row))
+    block = ("\n".join(block) + "\n").encode()
+    with open(fil, "wb") as f:
+        f.write(b"[Header]\nTITLE,benchmark\nBYAPP,MPMS3,1.3.1\n[Data]\n" + ",".join(COLUMNS).encode() + b"\n")
+        while f.tell() < size:
+            f.write(block)
+
+
+def prefix(fil, size):
+    out = fil + '.prefix'
+    with open(fil, "rb") as f, open(out, "wb") as g:
+        g.write(f.read(size))
+        g.write(f.readline())
+    return out
+
+
+def main(size_mb=2048, python_mb=100):
+    fil = os.path.join(tempfile.mkdtemp(), 'run.dat')
+    write_dat(fil, size_mb * 1024 * 1024)
+    size = os.path.getsize(fil) / 1024 / 1024
+
+    start = time.perf_counter()
+    rows = 0
+    with open(fil, "rb") as f:
+        header, batches = qd.read_dat(f)
+        for batch in batches:
+            rows += len(batch[COLUMNS[0]])
+    elapsed = time.perf_counter() - start
+    print("%-20s %8.0f MB %12d rows %8.2f s %8.1f MB/s" % ('chunked numpy', size, rows, elapsed, size / elapsed))
+
+    small = prefix(fil, python_mb * 1024 * 1024)
+    size = os.path.getsize(small) / 1024 / 1024
+    start = time.perf_counter()
+    rows = len(parse_python(small)[COLUMNS[0]])
+    elapsed = time.perf_counter() - start
+    print("%-20s %8.0f MB %12d rows %8.2f s %8.1f MB/s" % ('pure python', size, rows, elapsed, size / elapsed))
+    os.remove(small)
+    os.remove(fil)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,354 @@
+"""
+Benchmark: end-to-end latency of launches and of refresh-auth callbacks, through the real autolaunch handlers served
+by a Tornado app, with stand-ins for everything outside of autolaunch:
+
+- URLFS: the mount is a local directory holding the launched files (as written by the benchmark). Mounting takes
+  mount_cost and every reload signal reload_cost seconds (reloads are still coalesced as usual), and every read of
+  launched data waits read_latency seconds first, as a round trip to the remote server would.
+- The OTS callback (used for file lists longer than get_max_files) and an OAuth2 token endpoint (answering in
+  token_latency seconds) are served by the same app.
+
+Runs are swept along one axis at a time from a base point (or, with --grid, over every combination): concurrent
+requests, index entries per launch, and sources already configured. Every run is printed as one JSON object per line
+(p50/p99 latency, requests per second, mean time per phase; see autolaunch/metrics.py), on stdout or to --output, so
+that runs on different commits can be compared (--compare an earlier output prints the ratios).
+
+    python benchmarks/bench_e2e.py [--concurrency 1,10,100] [--files 1,1000,100000] [--sources 0,1000,10000] ...
+"""
+from base64 import urlsafe_b64encode
+from secrets import token_hex
+import argparse
+import asyncio
+import builtins
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from tornado import httpclient, web
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from autolaunch import _compat, detect, metrics, urlfs
+
+
+class BenchBaseHandler(web.RequestHandler):
+    """Stands in for JupyterHandler: every request is from a logged in user, and the server is at /."""
+    base_url = '/'
+
+    def get_current_user(self):
+        return 'bench'
+
+
+# the handlers must be imported once their base class is set
+_compat._JupyterHandler = BenchBaseHandler
+from autolaunch import handlers
+from autolaunch.auth.oauth2 import OAuth2AuthHandlerClass
+from autolaunch.encoding import encode_files
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+from autolaunch.urlfs import get_mount
+
+get_max_files = 1000 # longer file lists are passed through the OTS callback
+mount_cost = 0.2
+reload_cost = 0.02
+read_latency = 0.005
+token_latency = 0.02
+
+MPMS_DAT = b'[Header]\r\nTITLE,MPMS3 benchmark sample\r\n[Data]\r\nTime Stamp (sec),Temperature (K),Moment (emu)\r\n' + \
+    b''.join(b'%d,%.3f,%.6e\r\n' % (i, 300 - i * 0.01, 1e-4 * i) for i in range(200))
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount backed by a local directory (mountdir itself)."""
+    def __init__(self, configfile, mountdir):
+        super().__init__(configfile, mountdir)
+        self.mounted = False
+
+    async def ensure_mounted(self, timeout=None):
+        async with self._mount_lock:
+            if self.mounted:
+                return False
+            await asyncio.sleep(mount_cost)
+            os.makedirs(self.mountdir, exist_ok=True)
+            self.mounted = True
+            return True
+
+    async def _send_signal(self, timeout):
+        await asyncio.sleep(reload_cost)
+
+
+class SlowFile:
+    """A file whose reads each take read_latency seconds longer."""
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        time.sleep(read_latency)
+        return self.f.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+def slow_open(fil, mode='r', *args, **kwargs):
+    if fil.endswith('.log') and not os.path.exists(fil):
+        return SlowFile(io.BytesIO(b"x" * 1000))
+    return SlowFile(builtins.open(fil, mode, *args, **kwargs))
+
+
+class OTSHandler(web.RequestHandler):
+    """OTS callback: streams the parameters, then the index lines, of a launch registered in ots_launches."""
+    async def post(self, launch_id):
+        params, lines = self.settings['ots_launches'].pop(launch_id)
+        self.set_header('Content-Type', 'text/plain')
+        self.write(json.dumps(params) + "\n")
+        for i in range(0, len(lines), 10000):
+            self.write("\n".join(lines[i:i+10000]) + "\n")
+            await self.flush()
+
+
+class TokenHandler(web.RequestHandler):
+    """OAuth2 token endpoint granting whatever is asked."""
+    async def post(self):
+        await asyncio.sleep(token_latency)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'access_token': token_hex(16), 'refresh_token': token_hex(16), 'expires_in': 3600}))
+
+
+def oauth2_token(port):
+    client = {'client_id': 'bench', 'authorization_endpoint': 'http://127.0.0.1:%d/authorize' % port,
+              'token_endpoint': 'http://127.0.0.1:%d/token' % port}
+    client.update({'access_token': token_hex(16), 'refresh_token': token_hex(16), 'expires_in': 3600})
+    return urlsafe_b64encode(json.dumps(client).encode()).decode()
+
+
+def index_lines(name, nfiles, dat_every):
+    # every dat_every-th file is an MPMS3 .dat file, the rest are logs (not written, see slow_open) no handler recognizes
+    lines = []
+    for i in range(nfiles):
+        ext = 'dat' if i % dat_every == dat_every - 1 or nfiles == 1 else 'log'
+        lines.append('F\t/%s/run-%06d.%s\thttps://lims.example.org/data/%s/run-%06d.%s\t%d\t1717200000'
+                     % (name, i, ext, name, i, ext, len(MPMS_DAT) if ext == 'dat' else 1000 + i))
+    return lines
+
+
+def write_data(mountdir, lines):
+    for l in lines:
+        path = l.split('\t')[1]
+        if path.endswith('.dat'):
+            fil = os.path.join(mountdir, path[1:])
+            os.makedirs(os.path.dirname(fil), exist_ok=True)
+            with open(fil, "wb") as f:
+                f.write(MPMS_DAT)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def phase_means(before):
+    # mean seconds spent per phase (of all operations) since before (a copy of the phase histograms)
+    means = {}
+    for key, (counts, total) in metrics._histograms.get('autolaunch_phase_seconds', {}).items():
+        prev_counts, prev_total = before.get(key, ([0], 0.0))
+        n = sum(counts) - sum(prev_counts)
+        if n > 0:
+            labels = dict(key)
+            means[labels['operation'] + '/' + labels['phase']] = round(1e3 * (total - prev_total) / n, 3)
+    return means
+
+
+def snapshot():
+    return {k: (list(v[0]), v[1]) for k, v in metrics._histograms.get('autolaunch_phase_seconds', {}).items()}
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.sock, self.port = bind_unused_port()
+        self.basedir = None
+        self.app = web.Application([
+            (r'/autolaunch', handlers.AutoLaunchHandler),
+            (r'/autolaunch/refresh-auth/callback', handlers.RefreshAuthCallbackHandler),
+            (r'/ots/([0-9a-f]+)', OTSHandler),
+            (r'/token', TokenHandler),
+        ], ots_launches={})
+        self.server = HTTPServer(self.app, max_header_size=1024 * 1024)
+        self.server.add_sockets([self.sock])
+        self.client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=1000)
+        self.launch_ids = itertools.count()
+
+    def setup(self, nsources):
+        # a fresh server root, with nsources sources already configured
+        self.basedir = tempfile.mkdtemp(prefix='bench-e2e-')
+        self.app.settings['server_root_dir'] = self.basedir
+        for d in ('analysis', '.remote-config'):
+            os.makedirs(os.path.join(self.basedir, d))
+        store = get_store(os.path.join(self.basedir, '.remote-config'))
+        if nsources > 0:
+            store.add_sources([(OAuth2AuthHandlerClass(oauth2_token(self.port)), 'oauth2',
+                                index_lines('configured-%06d' % i, 1, 1)) for i in range(nsources)])
+        return store
+
+    def launch_request(self, nfiles):
+        name = 'launch-%06d' % next(self.launch_ids)
+        lines = index_lines(name, nfiles, self.args.dat_every)
+        write_data(os.path.join(self.basedir, 'remote'), lines)
+        params = {'auth_token': oauth2_token(self.port), 'auth_token_hint': 'oauth2'}
+        if nfiles <= get_max_files:
+            params['files'] = encode_files(lines)
+        else:
+            launch_id = token_hex(8)
+            self.app.settings['ots_launches'][launch_id] = (params, lines)
+            params = {'ots_callback_url': urlsafe_b64encode(('http://127.0.0.1:%d/ots/%s' % (self.port, launch_id))
+                                                            .encode()).decode().rstrip('=')}
+        return 'http://127.0.0.1:%d/autolaunch?%s' % (self.port, '&'.join(k + '=' + v for k, v in params.items()))
+
+    async def timed(self, urls, concurrency):
+        # fetch urls, at most concurrency at once; returns (latencies, errors, wall time)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = [0]
+
+        async def one(url):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await self.client.fetch(url, follow_redirects=False, raise_error=False, request_timeout=600)
+                latencies.append(time.perf_counter() - start)
+                if response.code not in (200, 302):
+                    errors[0] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(url) for url in urls])
+        return latencies, errors[0], time.perf_counter() - start
+
+    async def run_launches(self, concurrency, nfiles, nsources):
+        self.setup(nsources)
+        urls = [self.launch_request(nfiles) for i in range(max(self.args.requests, concurrency))]
+        # mount (once per server) before timing, as a server that already launched would have
+        await self.timed([self.launch_request(1)], 1)
+        before = snapshot()
+        latencies, errors, wall = await self.timed(urls, concurrency)
+        return self.result('launch', concurrency, nfiles, nsources, latencies, errors, wall, before)
+
+    async def run_refreshes(self, concurrency, nsources):
+        # every callback refreshes different credentials, so at least as many sources as requests are configured
+        nrequests = max(self.args.requests, concurrency)
+        nsources = max(nsources, nrequests)
+        store = self.setup(nsources)
+        uuids = [uuid for uuid, expires in store.find_expiring(float('inf'))]
+        urls = ['http://127.0.0.1:%d/autolaunch/refresh-auth/callback?state=%s&code=%s' % (self.port, uuid, token_hex(8))
+                for uuid in uuids[:nrequests]]
+        await get_mount(os.path.join(self.basedir, '.remote-config', 'remote.config'),
+                        os.path.join(self.basedir, 'remote')).ensure_mounted()
+        before = snapshot()
+        latencies, errors, wall = await self.timed(urls, concurrency)
+        return self.result('refresh_callback', concurrency, 1, nsources, latencies, errors, wall, before)
+
+    def result(self, scenario, concurrency, nfiles, nsources, latencies, errors, wall, before):
+        return {'scenario': scenario, 'concurrency': concurrency, 'files': nfiles, 'sources': nsources,
+                'requests': len(latencies), 'errors': errors,
+                'p50_ms': round(1e3 * percentile(latencies, 50), 3), 'p99_ms': round(1e3 * percentile(latencies, 99), 3),
+                'per_s': round(len(latencies) / wall, 3), 'phases_mean_ms': phase_means(before),
+                'read_latency_ms': 1e3 * read_latency, 'reload_cost_ms': 1e3 * reload_cost, 'commit': self.args.commit}
+
+
+def sweep(args):
+    # (concurrency, files, sources) of every run
+    axes = [args.concurrency, args.files, args.sources]
+    if args.grid:
+        return list(itertools.product(*axes))
+    base = [a[0] for a in axes]
+    runs = [tuple(base)]
+    for i, axis in enumerate(axes):
+        for v in axis[1:]:
+            runs.append(tuple(v if j == i else base[j] for j in range(3)))
+    return runs
+
+
+async def run(args, out):
+    bench = Bench(args)
+    for concurrency, nfiles, nsources in sweep(args):
+        results = [await bench.run_launches(concurrency, nfiles, nsources)]
+        if nfiles == args.files[0] and not args.no_refresh:
+            results.append(await bench.run_refreshes(concurrency, nsources))
+        for r in results:
+            out.write(json.dumps(r) + "\n")
+            out.flush()
+            print("%-16s %4d concurrent %7d files %7d sources: p50 %9.2f ms  p99 %9.2f ms  %8.1f/s  %d errors"
+                  % (r['scenario'], r['concurrency'], r['files'], r['sources'], r['p50_ms'], r['p99_ms'], r['per_s'], r['errors']),
+                  file=sys.stderr)
+
+
+def compare(old, new):
+    # ratios of new to old, for the runs found in both
+    def load(fil):
+        with open(fil, "r") as f:
+            return {(r['scenario'], r['concurrency'], r['files'], r['sources']): r for r in map(json.loads, f)}
+    old, new = load(old), load(new)
+    print("%-16s %5s %7s %7s %10s %10s %10s" % ('scenario', 'conc', 'files', 'sources', 'p50 x', 'p99 x', 'per_s x'))
+    for key in sorted(set(old) & set(new)):
+        o, n = old[key], new[key]
+        print("%-16s %5d %7d %7d %10.3f %10.3f %10.3f" % (key + (n['p50_ms'] / o['p50_ms'], n['p99_ms'] / o['p99_ms'],
+                                                                   n['per_s'] / o['per_s'])))
+
+
+def main():
+    global mount_cost, reload_cost, read_latency, token_latency
+    ints = lambda s: [int(v) for v in s.split(',')]
+    parser = argparse.ArgumentParser(description="End-to-end autolaunch benchmark")
+    parser.add_argument('--concurrency', type=ints, default=[1, 10, 100], help="concurrent requests (first is the base)")
+    parser.add_argument('--files', type=ints, default=[100, 1, 1000, 100000], help="index entries per launch")
+    parser.add_argument('--sources', type=ints, default=[0, 1000, 10000], help="sources configured beforehand")
+    parser.add_argument('--grid', action='store_true', help="run every combination, not one axis at a time")
+    parser.add_argument('--requests', type=int, default=20, help="requests per run (at least the concurrency)")
+    parser.add_argument('--dat-every', type=int, default=100, help="one in this many files is MPMS3 data")
+    parser.add_argument('--read-latency-ms', type=float, default=1e3 * read_latency)
+    parser.add_argument('--reload-ms', type=float, default=1e3 * reload_cost)
+    parser.add_argument('--mount-ms', type=float, default=1e3 * mount_cost)
+    parser.add_argument('--token-ms', type=float, default=1e3 * token_latency)
+    parser.add_argument('--no-refresh', action='store_true', help="only time launches")
+    parser.add_argument('--output', help="file to write results to (default: stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two earlier outputs, and exit")
+    args = parser.parse_args()
+    if args.compare:
+        return compare(*args.compare)
+
+    mount_cost, reload_cost = args.mount_ms / 1e3, args.reload_ms / 1e3
+    read_latency, token_latency = args.read_latency_ms / 1e3, args.token_ms / 1e3
+    try:
+        args.commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        args.commit = None
+
+    urlfs.URLFSMount = StandInMount
+    detect.open = slow_open # identification reads through the (stand-in) mount
+    handlers.AutoLaunchHandler.background = False # time launches up to the redirect to the analysis
+    Launcher.prefetch = False
+    Launcher.analysis_notebooks_src = tempfile.mkdtemp()
+    for sub, nb in (('MPMS', 'MPMS-CW.ipynb'), ('PPMS', 'PPMS-CW.ipynb')):
+        os.makedirs(os.path.join(Launcher.analysis_notebooks_src, sub))
+        with open(os.path.join(Launcher.analysis_notebooks_src, sub, nb), "w") as f:
+            f.write('{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}')
+    metrics.slow_trace_seconds = None
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        asyncio.run(run(args, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark: size and decode time of the plain and compact encodings of the /autolaunch "files" parameter, on
+index lists shaped like those of instrument data (one directory per sample, a few files per measurement).
+
+    python benchmarks/bench_files_encoding.py
+"""
+import random
+import timeit
+
+from autolaunch.encoding import decode_files, encode_files
+
+
+def index_lines(nfiles, seed=0):
+    rnd = random.Random(seed)
+    base = 'https://data.paradim.org/api/v1/files/download/4f3c2a1b-9e8d-47c6-b5a4-0123456789ab'
+    lines = ['D\t/MPMS3']
+    sample = 0
+    while len(lines) < nfiles:
+        sample += 1
+        d = '/MPMS3/2024-06-%02d_sample-%03d' % (sample % 28 + 1, sample)
+        lines.append('D\t' + d)
+        for run in range(rnd.randint(2, 8)):
+            for ext in ('.dat', '.rw.dat', '.log'):
+                p = '%s/%s_run%02d_MvsT%s' % (d, d.split('/')[-1], run, ext)
+                size = rnd.randint(10**4, 10**8)
+                mtime = 1717200000 + rnd.randint(0, 10**6)
+                lines.append('F\t%s\t%s%s\t%d\t%d' % (p, base, p, size, mtime))
+    return lines[:nfiles]
+
+
+def main():
+    print("%8s %12s %12s %8s %14s %14s" % ('files', 'plain B', 'compact B', 'ratio', 'plain decode', 'compact decode'))
+    for n in (10, 50, 200, 1000, 10000):
+        lines = index_lines(n)
+        plain = encode_files(lines, compact=False)
+        compact = encode_files(lines)
+        assert decode_files(plain) == lines and decode_files(compact) == lines
+        times = []
+        for data in (plain, compact):
+            number, total = timeit.Timer(lambda: decode_files(data)).autorange()
+            times.append(1e6 * total / number)
+        print("%8d %12d %12d %8.1f %11.0f us %11.0f us" % (n, len(plain), len(compact), len(plain) / len(compact),
+                                                          times[0], times[1]))
+    # how many files fit in a typical ~8 kB GET request (less room for the other parameters)
+    for compact in (False, True):
+        n = 1
+        while len(encode_files(index_lines(n + 1), compact=compact)) < 7000:
+            n += 1
+        print("files fitting in 7000 bytes (%s): %d" % ('compact' if compact else 'plain', n))
+
+
+if __name__ == '__main__':
+    main()
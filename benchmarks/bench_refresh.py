@@ -0,0 +1,56 @@
+"""
+Benchmark: latency of refreshing one credential (as the refresh-auth callback does) as the number of configured
+sources grows, against re-exporting the whole configuration from the store (as every refresh used to).
+
+    python benchmarks/bench_refresh.py [sources ...]
+"""
+import statistics
+import sys
+import tempfile
+import time
+
+from autolaunch.store import ConfigStore
+
+
+class StandInAuth:
+    def __init__(self, auth_uuid, token='token'):
+        self.auth_uuid = auth_uuid
+        self.token = token
+
+    def getAuthUUID(self):
+        return self.auth_uuid
+
+    def getRefreshInfo(self):
+        return {'initial_redirect': {'method': 'GET', 'endpoint': 'https://auth.example.org/login', 'params': {}}}
+
+    def getAuthHeaders(self):
+        return ['Authorization: Bearer ' + self.token]
+
+    def getExpiry(self):
+        return None
+
+
+def timed(func, repeat=50):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    return 1e3 * statistics.median(times)
+
+
+def main(sizes=(10, 1000, 10000)):
+    print("%8s %16s %16s" % ('sources', 'refresh (ms)', 'full export (ms)'))
+    for n in sizes:
+        store = ConfigStore(tempfile.mkdtemp())
+        store.add_sources([(StandInAuth('uuid-%d' % i), 'polyauth',
+                            ['F\t/sample-%d/run.dat\thttps://lims.example.org/data/%d/run.dat\t1000\t1717200000' % (i, i)])
+                           for i in range(n)])
+        target = 'uuid-%d' % (n // 2)
+        refresh = timed(lambda i: store.replace_auth(target, lambda hint, info: StandInAuth(target, 'token-%d' % i)))
+        full = timed(lambda i: store.export())
+        print("%8d %16.3f %16.3f" % (n, refresh, full))
+
+
+if __name__ == '__main__':
+    main(*([tuple(map(int, sys.argv[1:]))] if len(sys.argv) > 1 else []))
@@ -0,0 +1,74 @@
+"""
+Microbenchmark: identifying a file prefix with many analysis handlers installed, checking each handler's
+checkIsDataType in turn versus a single pass of the combined SignatureMatcher.
+
+    python benchmarks/bench_signatures.py [number of handlers]
+"""
+from io import BytesIO
+import sys
+import timeit
+
+from autolaunch.analysis.base import AnalysisBaseHandlerClass
+from autolaunch.analysis.signatures import Signature, SignatureMatcher
+
+
+class SyntheticHandlerClass(AnalysisBaseHandlerClass):
+    def __init__(self, n):
+        self.marker = b'INSTRUMENT-%04d' % n
+
+    def copyTemplate(self, dest, srcbasedir):
+        pass
+
+    def getAnalysisFileName(self):
+        return None
+
+    def getHint(self):
+        return self.marker.decode()
+
+    def getSignatures(self):
+        return [Signature(pattern=self.marker, max_lines=100)]
+
+    def checkIsDataType(self, data, filename=None):
+        # same line-by-line scan as the MPMS/PPMS handlers
+        i = 0
+        with BytesIO(data) as f:
+            for nv in f:
+                i += 1
+                if self.marker in nv:
+                    return True
+                if i >= 100:
+                    return False
+        return False
+
+
+def main(nhandlers=60):
+    handlers = {}
+    for n in range(nhandlers):
+        h = SyntheticHandlerClass(n)
+        handlers[h.getHint()] = h
+    last = list(handlers)[-1]
+    # 64k prefix of a typical instrument file, recognized by the last handler, near the end of its window
+    lines = [b'INFO,some header field,%d' % i for i in range(90)] + [handlers[last].marker]
+    data = b'\n'.join(lines) + b'\n'
+    data += b'1.0,2.0,3.0,4.0,5.0,6.0\n' * ((65536 - len(data)) // 24)
+    unknown = data.replace(handlers[last].marker, b'UNRECOGNIZED')
+
+    def sequential(d):
+        for hint in handlers:
+            if handlers[hint].checkIsDataType(d, 'x.dat'):
+                return hint
+        return None
+
+    matcher = SignatureMatcher(handlers)
+    assert sequential(data) == matcher.first(data, 'x.dat') == last
+    assert sequential(unknown) is None and matcher.first(unknown, 'x.dat') is None
+
+    print("%d handlers, %d byte prefix" % (nhandlers, len(data)))
+    for name, func in (('checkIsDataType loop', sequential), ('SignatureMatcher', lambda d: matcher.first(d, 'x.dat'))):
+        for label, d in (('match', data), ('no match', unknown)):
+            number, total = timeit.Timer(lambda: func(d)).autorange()
+            print("  %-22s %-9s %9.1f us/prefix" % (name, label, 1e6 * total / number))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
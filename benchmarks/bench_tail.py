@@ -0,0 +1,45 @@
+"""
+Benchmark: cost of refreshing the parsed contents of a growing .dat file with tail_columns, against parsing the
+whole file again, as a measurement appends to it.
+
+    python benchmarks/bench_tail.py [initial size in MB] [appended KB per step] [steps]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from autolaunch.analysis import qd
+from autolaunch.analysis.tail import tail_columns
+from bench_dat_parse import write_dat
+
+
+def main(size_mb=200, append_kb=64, steps=5):
+    fil = os.path.join(tempfile.mkdtemp(), 'run.dat')
+    write_dat(fil, size_mb * 1024 * 1024)
+    with open(fil, "rb") as f:
+        f.seek(os.path.getsize(fil) - 1024 * 1024)
+        f.readline()
+        lines = f.read() # the last rows, appended again and again
+
+    start = time.perf_counter()
+    header, data = tail_columns(fil)
+    print("%-24s %10.3f s  %10d rows" % ('first parse', time.perf_counter() - start, len(next(iter(data.values())))))
+    appended = (lines * (append_kb * 1024 // len(lines) + 1))[:append_kb * 1024] # may end mid-line, as while writing
+    for step in range(steps):
+        with open(fil, "ab") as f:
+            f.write(appended)
+        start = time.perf_counter()
+        header, data = tail_columns(fil)
+        tail = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(fil, "rb") as f:
+            full_rows = sum(len(b[next(iter(b))]) for b in qd.read_dat(f)[1])
+        full = time.perf_counter() - start
+        rows = len(next(iter(data.values())))
+        print("%-24s %10.3f ms %10d rows (full parse: %.3f s, %d rows)"
+              % ('refresh +%d KB' % append_kb, 1e3 * tail, rows, full, full_rows))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -14,6 +14,7 @@ setuptools.setup(
     include_package_data=True,
     platforms='any',
     install_requires=['jupyter_server>=1.10.1', 'tornado'],
+    extras_require={'parse': ['numpy'], 'pooling': ['pycurl']},
     data_files=[
         ('etc/jupyter/jupyter_server_config.d', ['autolaunch/etc/jupyter_server_config.d/autolaunch.json']),
         ('etc/jupyter/jupyter_notebook_config.d', ['autolaunch/etc/jupyter_notebook_config.d/autolaunch.json'])
@@ -0,0 +1,113 @@
+from base64 import urlsafe_b64encode
+import asyncio
+import builtins
+import json
+import os
+import tempfile
+import threading
+import time
+
+from tornado import httpclient, web
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autolaunch import _blocking, detect, urlfs
+from autolaunch._blocking import run_blocking
+from autolaunch.encoding import encode_files
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+
+MPMS_DAT = b'[Header]\r\nBYAPP,MPMS3,1.3.1\r\n[Data]\r\nTime Stamp (sec),Temperature (K)\r\n1,300\r\n'
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount backed by a local directory (mountdir itself), mounted and reloaded at no cost."""
+    async def ensure_mounted(self, timeout=None):
+        os.makedirs(self.mountdir, exist_ok=True)
+        return False
+
+    async def reload(self, timeout=None):
+        pass
+
+
+class LaunchHandler(web.RequestHandler):
+    async def get(self):
+        launcher = Launcher(self.settings['basedir'], '/')
+        launcher.prefetch = False
+        launcher.analysis_notebooks_src = self.settings['notebooks']
+        self.write(await launcher.run({k: self.get_argument(k) for k in self.request.arguments}))
+
+
+class ConfigHandler(web.RequestHandler):
+    # local work only, as refresh-auth requests do
+    async def get(self):
+        store = await run_blocking(get_store, os.path.join(self.settings['basedir'], '.remote-config'), timeout=30)
+        self.write(str(await run_blocking(store.find_auth_for_path, 'elsewhere/run.dat', timeout=30)))
+
+
+class SlowMountTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.release = threading.Event()
+        self.blocked = 0
+        self.lock = threading.Lock()
+        urlfs._mounts[(os.path.join(self.basedir, '.remote-config', 'remote.config'), os.path.join(self.basedir, 'remote'))] = \
+            StandInMount(None, os.path.join(self.basedir, 'remote'))
+
+        def stuck_open(fil, mode='r', *args, **kwargs):
+            # reads of launched files hang until released, as on a remote server that stopped answering
+            with self.lock:
+                self.blocked += 1
+            self.release.wait()
+            return builtins.open(fil, mode, *args, **kwargs)
+
+        detect.open = stuck_open
+        super().setUp()
+
+    def tearDown(self):
+        self.release.set()
+        del detect.open
+        super().tearDown()
+
+    def get_app(self):
+        notebooks = tempfile.mkdtemp()
+        os.makedirs(os.path.join(notebooks, 'MPMS'))
+        with open(os.path.join(notebooks, 'MPMS', 'MPMS-CW.ipynb'), "w") as f:
+            f.write('{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}')
+        return web.Application([(r'/launch', LaunchHandler), (r'/config', ConfigHandler)], basedir=self.basedir,
+                               notebooks=notebooks)
+
+    def get_http_client(self):
+        return httpclient.AsyncHTTPClient(force_instance=True, max_clients=100)
+
+    def launch_url(self, i):
+        lines = ['F\t/launch-%d/run-%d.dat\thttps://lims.example.org/data/%d/%d.dat\t%d\t1717200000'
+                 % (i, j, i, j, len(MPMS_DAT)) for j in range(8)]
+        for l in lines:
+            fil = os.path.join(self.basedir, 'remote', l.split('\t')[1][1:])
+            os.makedirs(os.path.dirname(fil), exist_ok=True)
+            with open(fil, "wb") as f:
+                f.write(MPMS_DAT)
+        client = {'client_id': 'test', 'token_endpoint': 'http://127.0.0.1:1/token', 'access_token': 'a%d' % i}
+        token = urlsafe_b64encode(json.dumps(client).encode()).decode()
+        return '/launch?auth_token_hint=oauth2&auth_token=%s&files=%s' % (token, encode_files(lines))
+
+    @gen_test(timeout=60)
+    async def test_local_work_not_stalled(self):
+        launches = [self.http_client.fetch(self.get_url(self.launch_url(i)), raise_error=False, request_timeout=60)
+                    for i in range(2 * _blocking.max_workers)]
+        start = time.monotonic()
+        while self.blocked < _blocking.remote_workers:
+            self.assertLess(time.monotonic() - start, 10, "launches never got to reading their files")
+            await asyncio.sleep(0.01)
+        # every remote worker is stuck; requests doing local work still get through promptly
+        for i in range(5):
+            start = time.monotonic()
+            response = await self.http_client.fetch(self.get_url('/config'), request_timeout=10)
+            self.assertLess(time.monotonic() - start, 1.0)
+            self.assertEqual(response.body, b'None')
+        self.assertEqual(self.blocked, _blocking.remote_workers)
+        self.release.set()
+        for launch in launches:
+            response = await launch
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, b'/lab/tree/analysis/MPMS-CW.ipynb')
@@ -0,0 +1,144 @@
+import builtins
+import os
+import tempfile
+import threading
+import unittest
+
+from autolaunch import detect
+from autolaunch.analysis import analysis_handlers
+from autolaunch.store import get_store
+
+MPMS_DAT = b'[Header]\nBYAPP,MPMS3,1.3.1\n[Data]\nTime Stamp (sec),Temperature (K)\n1,300\n'
+PPMS_DAT = b'[Header]\nBYAPP,PPMS ACMS,1.0\n[Data]\nTime Stamp (sec),Temperature (K)\n1,300\n'
+
+
+class IdentifyTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def write(self, name, data):
+        fil = os.path.join(self.dir, name)
+        with open(fil, "wb") as f:
+            f.write(data)
+        return fil
+
+    async def test_bounded_reads(self):
+        # only MPMS data: PPMS-MT never matches, yet not every file is read looking for it
+        files = [self.write('run-%d.dat' % i, MPMS_DAT) for i in range(1000)]
+        before = detect.stats['files_read']
+        hints = await detect.detect_analysis_hints(files, analysis_handlers, max_fruitless_reads=50)
+        self.assertEqual(hints, ['MPMS-MT'])
+        self.assertLessEqual(detect.stats['files_read'] - before, 1 + 50 + 4)
+
+    async def test_new_type_resets_bound(self):
+        files = [self.write('mpms-%d.dat' % i, MPMS_DAT) for i in range(40)] + [self.write('ppms.dat', PPMS_DAT)]
+        self.assertEqual(await detect.detect_analysis_hints(files, analysis_handlers, max_fruitless_reads=50),
+                         ['MPMS-MT', 'PPMS-MT'])
+        self.assertEqual(await detect.detect_analysis_hints(files, analysis_handlers, max_fruitless_reads=20),
+                         ['MPMS-MT'])
+        self.assertEqual(await detect.detect_analysis_hints(files, analysis_handlers, max_fruitless_reads=None),
+                         ['MPMS-MT', 'PPMS-MT'])
+
+    async def test_resolved_without_reads(self):
+        files = [self.write(name, MPMS_DAT) for name in ['plot.png', 'report.pdf', 'notes.txt', 'sequence.log']]
+        before = dict(detect.stats)
+        self.assertEqual(await detect.detect_analysis_hints(files, analysis_handlers), [])
+        self.assertEqual(detect.stats['files_read'], before['files_read'])
+        self.assertEqual(detect.stats['files_by_metadata'] - before['files_by_metadata'], 4)
+
+    async def test_likely_first(self):
+        # the .dat file is read first, whatever its place in the list
+        files = [self.write('export-%d.csv' % i, PPMS_DAT) for i in range(10)] + [self.write('run.dat', MPMS_DAT)]
+        before = detect.stats['files_read']
+        self.assertEqual(await detect.detect_analysis_hint(files, analysis_handlers, concurrency=1), 'MPMS-MT')
+        self.assertEqual(detect.stats['files_read'] - before, 1)
+        self.assertEqual(await detect.detect_analysis_hints(files, analysis_handlers), ['MPMS-MT', 'PPMS-MT'])
+
+    async def test_none_recognized(self):
+        files = [self.write('notes-%d.dat' % i, b'nothing to see\n') for i in range(200)]
+        before = detect.stats['files_read']
+        self.assertEqual(await detect.detect_analysis_hint(files, analysis_handlers, max_fruitless_reads=10), '')
+        self.assertLessEqual(detect.stats['files_read'] - before, 10 + 4)
+
+
+def index_line(fil, size=1000, validators='1717200000'):
+    name = os.path.basename(fil)
+    return 'F\t/%s\thttps://lims.example.org/%s\t%d\t%s' % (name, name, size, validators)
+
+
+class CacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, '.remote-config'))
+        self.store = get_store(os.path.join(self.dir, '.remote-config'))
+
+    def write(self, name, data):
+        fil = os.path.join(self.dir, name)
+        with open(fil, "wb") as f:
+            f.write(data)
+        return fil
+
+    async def identify(self, files, lines, **kwargs):
+        # (hints, files read)
+        before = detect.stats['files_read']
+        hints = await detect.detect_analysis_hints(files, analysis_handlers, index_lines=lines, cache=self.store,
+                                                   **kwargs)
+        return hints, detect.stats['files_read'] - before
+
+    async def test_relaunch_not_read(self):
+        files = [self.write('mpms.dat', MPMS_DAT), self.write('ppms.dat', PPMS_DAT)]
+        lines = [index_line(fil) for fil in files]
+        self.assertEqual(await self.identify(files, lines), (['MPMS-MT', 'PPMS-MT'], 2))
+        before = detect.stats['files_by_cache']
+        self.assertEqual(await self.identify(files, lines), (['MPMS-MT', 'PPMS-MT'], 0))
+        self.assertEqual(detect.stats['files_by_cache'] - before, 2)
+
+    async def test_changed_validators(self):
+        fil = self.write('run.dat', MPMS_DAT)
+        self.assertEqual(await self.identify([fil], [index_line(fil)]), (['MPMS-MT'], 1))
+        # other data at the same URL: a different size, mtime or ETag misses the cache, and the file is read again
+        self.write('run.dat', PPMS_DAT)
+        for line in [index_line(fil, size=2000), index_line(fil, validators='1717300000'),
+                     index_line(fil, validators='1717200000\t"etag-2"')]:
+            self.assertEqual(await self.identify([fil], [line]), (['PPMS-MT'], 1))
+            self.assertEqual(await self.identify([fil], [line]), (['PPMS-MT'], 0))
+
+    async def test_timed_out_not_cached(self):
+        stuck, fil = self.write('stuck.dat', MPMS_DAT), self.write('run.dat', PPMS_DAT)
+        lines = [index_line(stuck), index_line(fil)]
+        release = threading.Event()
+        detect.open = lambda name, *args, **kwargs: (name != stuck or release.wait()) and builtins.open(name, *args,
+                                                                                                       **kwargs)
+        try:
+            self.assertEqual(await self.identify([stuck, fil], lines, timeout=0.2), (['PPMS-MT'], 2))
+        finally:
+            release.set()
+            del detect.open
+        self.assertEqual(self.store._db.execute("SELECT url FROM detections").fetchall(),
+                         [('https://lims.example.org/run.dat',)])
+        self.assertEqual(await self.identify([stuck, fil], lines), (['MPMS-MT', 'PPMS-MT'], 1))
+
+    async def test_cancelled_not_cached(self):
+        # the read of big.dat is still going on when run.dat settles it: it is cancelled, and not cached
+        fil, big = self.write('run.dat', MPMS_DAT), self.write('big.dat', b'x' * (detect.max_read_size * 2))
+        lines = [index_line(fil), index_line(big, size=detect.max_read_size * 2)]
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_open(name, *args, **kwargs):
+            if name == big:
+                reading.set()
+                release.wait()
+            else:
+                reading.wait()
+            return builtins.open(name, *args, **kwargs)
+
+        detect.open = slow_open
+        try:
+            hint = await detect.detect_analysis_hint([fil, big], analysis_handlers, concurrency=2,
+                                                     index_lines=lines, cache=self.store)
+            self.assertEqual(hint, 'MPMS-MT')
+        finally:
+            release.set()
+            del detect.open
+        self.assertEqual(await self.identify([big], lines[1:]), ([], 1))
+        self.assertEqual(await self.identify([big], lines[1:]), ([], 0))
@@ -0,0 +1,62 @@
+from base64 import urlsafe_b64encode
+import json
+import unittest
+import zlib
+
+from autolaunch import encoding
+from autolaunch.encoding import decode_files, encode_files
+
+
+def line(path, url=None, size=1000, mtime=1717200000):
+    return 'F\t%s\t%s\t%d\t%d' % (path, url or 'https://lims.example.org/data' + path, size, mtime)
+
+
+class FilesEncodingTest(unittest.TestCase):
+    def roundtrip(self, lines):
+        for compact in [True, False]:
+            data = encode_files(lines, compact)
+            self.assertEqual(data.startswith(encoding.compact_marker), compact)
+            self.assertEqual(decode_files(data), lines)
+
+    def test_shared_prefixes(self):
+        lines = [line('/sample/run-%03d.dat' % i, size=1000 + i) for i in range(200)]
+        self.roundtrip(lines)
+        # front-coding pays off: the shared directory and URL are not spelled out again
+        self.assertLess(len(encode_files(lines)), len(encode_files(lines, compact=False)) / 4)
+
+    def test_no_shared_prefixes(self):
+        self.roundtrip([line('/a/x.dat'), line('/b.dat', 'http://other.example.com/b', 5, 1),
+                        'D\t/c', line('/a/x.dat'), 'F\t/d\thttps://lims.example.org/d\t7\t1\t"etag"', line('/e')])
+
+    def test_prefix_of_previous(self):
+        # fields that are all (or more than) the field before, and fields containing ':'
+        self.roundtrip([line('/run.dat'), line('/run.dat.bak'), line('/run'), line('/run:1.dat'), line('/run:1.dat')])
+
+    def test_non_ascii(self):
+        self.roundtrip([line('/Probe μ/Messung-ä.dat'), line('/Probe μ/Messung-ö.dat'), line('/试样/运行 1.dat'),
+                        line('/試料/😀.dat')])
+
+    def test_empty(self):
+        self.roundtrip([])
+
+    def test_legacy_plain(self):
+        # as built by launch links from before the compact format, with base64 padding
+        lines = [line('/sample/run.dat'), line('/sample/Probe μ.dat')]
+        data = urlsafe_b64encode(json.dumps(lines).encode()).decode()
+        self.assertEqual(decode_files(data), lines)
+        self.assertEqual(decode_files(data.rstrip('=')), lines)
+        self.assertEqual(decode_files(encode_files(lines, compact=False)), lines)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            decode_files('~9abc')
+        deflater = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        bomb = deflater.compress(b'0:x' * (encoding.max_decoded_size // 3 + 1)) + deflater.flush()
+        with self.assertRaisesRegex(ValueError, 'too large'):
+            decode_files(encoding.compact_marker + urlsafe_b64encode(bomb).decode())
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            decode_files(encode_files([line('/run.dat')])[:-4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+from base64 import urlsafe_b64encode
+from urllib.parse import urlencode
+import builtins
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from jupyter_server.auth.identity import IdentityProvider, User
+from jupyter_server.serverapp import ServerApp
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autolaunch import detect, urlfs
+from autolaunch._compat import get_base_handler
+from autolaunch.encoding import encode_files
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+
+get_base_handler(ServerApp()) # as when the extension is loaded, before its handlers are imported
+from autolaunch import handlers
+
+MPMS_DAT = b'[Header]\r\nBYAPP,MPMS3,1.3.1\r\n[Data]\r\nTime Stamp (sec),Temperature (K)\r\n1,300\r\n'
+PPMS_DAT = b'[Header]\r\nBYAPP,PPMS ACMS,1.0\r\n[Data]\r\nTime Stamp (sec),Temperature (K)\r\n1,300\r\n'
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount backed by a local directory (mountdir itself), mounted and reloaded at no cost."""
+    reloads = 0
+
+    async def ensure_mounted(self, timeout=None):
+        os.makedirs(self.mountdir, exist_ok=True)
+        return False
+
+    async def reload(self, timeout=None):
+        self.reloads += 1
+
+
+class StandInIdentity(IdentityProvider):
+    """Every request is from the same user, authenticated by token (as API clients are)."""
+    def get_user(self, handler):
+        return User('test')
+
+    def is_token_authenticated(self, handler):
+        return True
+
+
+class HandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.mount = StandInMount(None, os.path.join(self.basedir, 'remote'))
+        urlfs._mounts[(os.path.join(self.basedir, '.remote-config', 'remote.config'), self.mount.mountdir)] = self.mount
+        notebooks = tempfile.mkdtemp()
+        for kind in ['MPMS', 'PPMS']:
+            os.makedirs(os.path.join(notebooks, kind))
+            with open(os.path.join(notebooks, kind, kind + '-CW.ipynb'), "w") as f:
+                f.write('{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}')
+        patcher = mock.patch.object(Launcher, 'analysis_notebooks_src', notebooks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def get_app(self):
+        return web.Application([
+            (r'/autolaunch', handlers.AutoLaunchHandler),
+            (r'/autolaunch/batch', handlers.BatchLaunchHandler),
+            (r'/autolaunch/jobs/([0-9a-f]+)', handlers.LaunchJobHandler),
+            (r'/autolaunch/jobs/([0-9a-f]+)/events', handlers.LaunchJobEventsHandler),
+        ], base_url='/', server_root_dir=self.basedir, identity_provider=StandInIdentity(), xsrf_cookies=False)
+
+    def params(self, name, data=MPMS_DAT, files=2):
+        # launch parameters for files (with data) in directory name
+        lines = ['F\t/%s/run-%d.dat\thttps://lims.example.org/%s/%d.dat\t%d\t1717200000' % (name, i, name, i, len(data))
+                 for i in range(files)]
+        for l in lines:
+            fil = os.path.join(self.basedir, 'remote', l.split('\t')[1][1:])
+            os.makedirs(os.path.dirname(fil), exist_ok=True)
+            with open(fil, "wb") as f:
+                f.write(data)
+        client = {'client_id': 'test', 'token_endpoint': 'http://127.0.0.1:1/token', 'access_token': name}
+        return {'auth_token_hint': 'oauth2', 'auth_token': urlsafe_b64encode(json.dumps(client).encode()).decode(),
+                'files': encode_files(lines)}
+
+    async def events(self, job_url, streaming_callback=None):
+        response = await self.http_client.fetch(self.get_url(job_url + '/events'),
+                                                streaming_callback=streaming_callback)
+        self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+        return response
+
+
+class LaunchJobTest(HandlerTest):
+    async def start(self, params):
+        response = await self.http_client.fetch(self.get_url('/autolaunch?' + urlencode(params)),
+                                                follow_redirects=False, raise_error=False)
+        self.assertEqual(response.code, 302)
+        self.assertRegex(response.headers['Location'], r'^/autolaunch/jobs/[0-9a-f]{32}$')
+        return response.headers['Location']
+
+    @gen_test(timeout=30)
+    async def test_launch(self):
+        release = threading.Event()
+        # reads hang until the progress page listens, so that it is shown the launch as it goes
+        detect.open = lambda *args, **kwargs: release.wait() and builtins.open(*args, **kwargs)
+        chunks = []
+        try:
+            job_url = await self.start(self.params('sample'))
+            response = await self.http_client.fetch(self.get_url(job_url), follow_redirects=False)
+            self.assertIn(b'EventSource("' + job_url.encode() + b'/events")', response.body)
+            await self.events(job_url, lambda chunk: chunks.append(chunk) or release.set())
+        finally:
+            release.set()
+            del detect.open
+        self.assertGreater(len(chunks), 1)
+        events = [json.loads(e[len('data: '):]) for e in b''.join(chunks).decode().split('\n\n') if len(e) > 0]
+        self.assertEqual(events[0], {'phase': 'decoding parameters'})
+        self.assertIn({'phase': 'identifying data'}, events)
+        self.assertEqual(events[-1], {'phase': 'done', 'url': '/lab/tree/analysis/MPMS-CW.ipynb'})
+        # once done, the job page sends the browser on
+        response = await self.http_client.fetch(self.get_url(job_url), follow_redirects=False, raise_error=False)
+        self.assertEqual((response.code, response.headers['Location']), (302, '/lab/tree/analysis/MPMS-CW.ipynb'))
+
+    @gen_test(timeout=30)
+    async def test_duplicate(self):
+        params = self.params('twice')
+        with mock.patch.object(Launcher, 'run', autospec=True, side_effect=Launcher.run) as run:
+            job_url = await self.start(params)
+            self.assertEqual(await self.start(params), job_url)
+            await self.events(job_url)
+            self.assertEqual(await self.start(params), job_url) # just finished
+            self.assertNotEqual(await self.start(self.params('other')), job_url)
+        self.assertEqual(run.call_count, 2)
+
+    @gen_test(timeout=30)
+    async def test_failed(self):
+        params = dict(self.params('broken'), files='~9abc')
+        job_url = await self.start(params)
+        response = await self.events(job_url)
+        events = [json.loads(e[len('data: '):]) for e in response.body.decode().split('\n\n') if len(e) > 0]
+        self.assertEqual(events[-1], {'phase': 'failed', 'error': 'ValueError'})
+        response = await self.http_client.fetch(self.get_url(job_url), follow_redirects=False)
+        self.assertEqual(response.code, 200) # shows the failure, rather than going anywhere
+        # a failed launch is not reused: trying again starts over
+        self.assertNotEqual(await self.start(params), job_url)
+        response = await self.http_client.fetch(self.get_url('/autolaunch/jobs/' + '0' * 32), raise_error=False)
+        self.assertEqual(response.code, 404)
+
+
+class BatchLaunchTest(HandlerTest):
+    async def post(self, body):
+        return await self.http_client.fetch(self.get_url('/autolaunch/batch'), method='POST', body=body,
+                                            raise_error=False)
+
+    @gen_test(timeout=30)
+    async def test_batch(self):
+        batch = [self.params('mpms'), dict(self.params('unknown'), auth_token_hint='nonesuch'),
+                 dict(self.params('broken'), files='~9abc'), self.params('ppms', PPMS_DAT),
+                 dict(self.params('hinted'), analysis_hint='PPMS-MT'), {'auth_token_hint': 'oauth2', 'files': 'W10'}]
+        response = await self.post(json.dumps({'launches': batch}))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.body)['results'], [
+            {'url': '/lab/tree/analysis/MPMS-CW.ipynb', 'analysis_hints': ['MPMS-MT']},
+            {'error': 'unknown auth_token_hint'},
+            {'error': 'ValueError'},
+            {'url': '/lab/tree/analysis/PPMS-CW.ipynb', 'analysis_hints': ['PPMS-MT']},
+            {'url': '/lab/tree/analysis/PPMS-CW.ipynb', 'analysis_hints': ['PPMS-MT']},
+            {'url': '/lab/tree/analysis', 'analysis_hints': []},
+        ])
+        # the valid launches were all registered at once
+        self.assertEqual(self.mount.reloads, 1)
+        store = get_store(os.path.join(self.basedir, '.remote-config'))
+        for name in ['mpms', 'ppms', 'hinted']:
+            self.assertIsNotNone(store.find_index_entry(name + '/run-0.dat'))
+        for name in ['unknown', 'broken']:
+            self.assertIsNone(store.find_index_entry(name + '/run-0.dat'))
+
+    @gen_test(timeout=30)
+    async def test_malformed(self):
+        for body in ['not json', '{"no launches": []}', '[1, 2]', '{"launches": "x"}']:
+            response = await self.post(body)
+            self.assertEqual(response.code, 400, body)
+        response = await self.post('[]')
+        self.assertEqual(json.loads(response.body), {'results': []})
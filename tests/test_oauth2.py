@@ -0,0 +1,103 @@
+from secrets import token_hex
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+import asyncio
+import json
+import time
+
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autolaunch.auth import oauth2
+from autolaunch.auth.oauth2 import OAuth2AuthHandlerClass
+
+
+class TokenHandler(web.RequestHandler):
+    """OAuth2 token endpoint: grants any code or refresh token but 'revoked'."""
+    async def post(self):
+        form = {k: v[0] for k, v in parse_qs(self.request.body.decode()).items()}
+        self.settings['requests'].append(form)
+        self.set_header('Content-Type', 'application/json')
+        if 'revoked' in (form.get('code'), form.get('refresh_token')):
+            self.set_status(400)
+            return self.finish(json.dumps({'error': 'invalid_grant'}))
+        self.finish(json.dumps({'access_token': token_hex(16), 'refresh_token': token_hex(16), 'expires_in': 3600}))
+
+
+class DiscoveryHandler(web.RequestHandler):
+    """OpenID Connect discovery of the issuer at the server root, taking a moment to answer."""
+    async def get(self):
+        self.settings['discoveries'].append(self.request.path)
+        await asyncio.sleep(0.05)
+        self.set_header('Content-Type', 'application/json')
+        base = self.request.protocol + '://' + self.request.host
+        self.finish(json.dumps({'issuer': base, 'authorization_endpoint': base + '/authorize',
+                                'token_endpoint': base + '/token'}))
+
+
+class OAuth2Test(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        oauth2._discovery.clear()
+
+    def get_app(self):
+        self.requests = []
+        self.discoveries = []
+        return web.Application([(r'/token', TokenHandler), (r'/.well-known/openid-configuration', DiscoveryHandler)],
+                               requests=self.requests, discoveries=self.discoveries)
+
+    def refresh_info(self, refresh_token=None, discovered=False):
+        client = {'client_id': 'test', 'client_secret': 's3cret'}
+        if discovered:
+            client['issuer'] = self.get_url('')
+        else:
+            client.update({'authorization_endpoint': self.get_url('/authorize'), 'token_endpoint': self.get_url('/token')})
+        refresh_info = {'client': client}
+        if refresh_token is not None:
+            refresh_info['refresh_token'] = refresh_token
+        return refresh_info
+
+    @gen_test
+    async def test_from_callback(self):
+        handler = SimpleNamespace(request=SimpleNamespace(protocol='https', host='hub.example.org'), base_url='/user/x/')
+        authhandler = await OAuth2AuthHandlerClass.fromCallback('uuid-1', 'the-code', self.refresh_info(), handler)
+        self.assertEqual(self.requests, [{'grant_type': 'authorization_code', 'code': 'the-code', 'client_id': 'test',
+                                          'client_secret': 's3cret',
+                                          'redirect_uri': 'https://hub.example.org/user/x/autolaunch/refresh-auth/callback'}])
+        self.assertEqual(authhandler.getAuthUUID(), 'uuid-1')
+        self.assertEqual(len(authhandler.getAuthHeaders()), 1)
+        self.assertIsNotNone(authhandler.getRefreshInfo()['refresh_token'])
+        self.assertAlmostEqual(authhandler.getExpiry(), time.time() + 3600, delta=60)
+        self.assertIsNone(await OAuth2AuthHandlerClass.fromCallback('uuid-1', 'revoked', self.refresh_info(), handler))
+
+    @gen_test
+    async def test_refresh_silently(self):
+        authhandler = await OAuth2AuthHandlerClass.refreshSilently('uuid-1', self.refresh_info('rt-1'))
+        self.assertEqual(self.requests[-1]['grant_type'], 'refresh_token')
+        self.assertEqual(self.requests[-1]['refresh_token'], 'rt-1')
+        self.assertEqual(authhandler.getAuthUUID(), 'uuid-1')
+        self.assertNotEqual(authhandler.getRefreshInfo()['refresh_token'], 'rt-1')
+        self.assertEqual(authhandler.getRefreshInfo()['client'], self.refresh_info()['client'])
+
+    @gen_test
+    async def test_refresh_needs_user(self):
+        # refused (invalid_grant), or no refresh token at all: the user goes through the authorization flow again
+        self.assertIsNone(await OAuth2AuthHandlerClass.refreshSilently('uuid-1', self.refresh_info('revoked')))
+        self.assertEqual(len(self.requests), 1)
+        self.assertIsNone(await OAuth2AuthHandlerClass.refreshSilently('uuid-1', self.refresh_info()))
+        self.assertEqual(len(self.requests), 1)
+        redirect = await OAuth2AuthHandlerClass.getRedirectInfo(self.refresh_info(discovered=True))
+        self.assertEqual(redirect['endpoint'], self.get_url('/authorize'))
+        self.assertEqual(redirect['params']['client_id'], 'test')
+
+    @gen_test
+    async def test_discovery_shared(self):
+        issuer = self.get_url('')
+        results = await asyncio.gather(*[oauth2.discover(issuer) for i in range(10)])
+        self.assertEqual(self.discoveries, ['/.well-known/openid-configuration'])
+        self.assertEqual(results[0]['token_endpoint'], self.get_url('/token'))
+        # later requests (of the same issuer) use the cached metadata
+        await OAuth2AuthHandlerClass.refreshSilently('uuid-1', self.refresh_info('rt-1', discovered=True))
+        await OAuth2AuthHandlerClass.refreshSilently('uuid-2', self.refresh_info('rt-2', discovered=True))
+        self.assertEqual(len(self.discoveries), 1)
+        self.assertEqual([r['refresh_token'] for r in self.requests], ['rt-1', 'rt-2'])
@@ -0,0 +1,214 @@
+from base64 import urlsafe_b64encode
+import asyncio
+import builtins
+import json
+import os
+import tempfile
+import threading
+
+from tornado import web
+from tornado.httpclient import HTTPClientError
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autolaunch import detect, ots, urlfs
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+
+NFILES = 100000
+PARAMS = {'auth_token': 'x', 'auth_token_hint': 'oauth2'}
+MPMS_DAT = b'[Header]\nBYAPP,MPMS3,1.3.1\n[Data]\nTime Stamp (sec),Temperature (K)\n1,300\n'
+PPMS_DAT = b'[Header]\nBYAPP,PPMS ACMS,1.0\n[Data]\nTime Stamp (sec),Temperature (K)\n1,300\n'
+
+
+def index_line(i):
+    return 'F\t/sample/run-%06d.dat\thttps://lims.example.org/data/sample/run-%06d.dat?%s\t1000\t1717200000' \
+        % (i, i, 'x' * 200)
+
+
+class OTSHandler(web.RequestHandler):
+    """OTS callback: the parameters and NFILES index lines, streamed (or as JSON, as an error, or redirected)."""
+    async def post(self, form):
+        sent = self.settings['sent']
+        if form == 'moved':
+            return self.redirect('/ots/streamed', status=307)
+        if form == 'json':
+            self.set_header('Content-Type', 'application/json')
+            return self.finish(json.dumps(dict(PARAMS, files=[index_line(i) for i in range(NFILES)])))
+        if form == 'error':
+            self.set_status(500)
+        self.set_header('Content-Type', 'text/plain')
+        self.write(json.dumps(PARAMS) + "\n")
+        for i in range(0, NFILES, 1000):
+            self.write("".join(index_line(j) + "\n" for j in range(i, i + 1000)))
+            await self.flush()
+            sent[0] = i + 1000
+
+
+class StreamOTSTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.sent = [0]
+        return web.Application([(r'/ots/(\w+)', OTSHandler)], sent=self.sent)
+
+    async def receive(self, form):
+        stream = ots.stream_ots(self.get_url('/ots/' + form), timeout=60)
+        params = await stream.__anext__()
+        lines = []
+        async for batch in stream:
+            lines.extend(batch)
+        return params, lines
+
+    @gen_test(timeout=60)
+    async def test_streamed(self):
+        params, lines = await self.receive('streamed')
+        self.assertEqual(params, PARAMS)
+        self.assertEqual(len(lines), NFILES)
+        self.assertEqual(lines[-1], index_line(NFILES - 1))
+
+    @gen_test(timeout=60)
+    async def test_redirected(self):
+        params, lines = await self.receive('moved')
+        self.assertEqual(params, PARAMS)
+        self.assertEqual(len(lines), NFILES)
+
+    @gen_test(timeout=60)
+    async def test_json(self):
+        params, lines = await self.receive('json')
+        self.assertEqual(params, PARAMS)
+        self.assertEqual(lines, [index_line(i) for i in range(NFILES)])
+
+    @gen_test(timeout=60)
+    async def test_error_body_not_parsed(self):
+        stream = ots.stream_ots(self.get_url('/ots/error'), timeout=60)
+        with self.assertRaises(HTTPClientError) as cm:
+            await stream.__anext__()
+        self.assertEqual(cm.exception.code, 500)
+
+    @gen_test(timeout=60)
+    async def test_backpressure(self):
+        stream = ots.stream_ots(self.get_url('/ots/streamed'), timeout=60)
+        await stream.__anext__()
+        received = len(await stream.__anext__())
+        await asyncio.sleep(0.5)
+        # a consumer that does not keep up holds back the sender
+        self.assertLess(self.sent[0], NFILES // 2)
+        async for batch in stream:
+            received += len(batch)
+        self.assertEqual(received, NFILES)
+
+    @gen_test(timeout=60)
+    async def test_closed_early(self):
+        stream = ots.stream_ots(self.get_url('/ots/streamed'), timeout=60)
+        await stream.__anext__()
+        await stream.__anext__()
+        await stream.aclose()
+        # the rest of the response is still read (and dropped), so the sender is not left hanging
+        for i in range(100):
+            if self.sent[0] == NFILES:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(self.sent[0], NFILES)
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount backed by a local directory (mountdir itself), mounted and reloaded at no cost."""
+    async def ensure_mounted(self, timeout=None):
+        os.makedirs(self.mountdir, exist_ok=True)
+        return False
+
+    async def reload(self, timeout=None):
+        pass
+
+
+class RecordingLauncher(Launcher):
+    """Launcher recording how many files each identification is given, and the task running it."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.identified = []
+        self.tasks = []
+
+    async def _identify(self, files, file_lines, store):
+        self.identified.append(len(files))
+        self.tasks.append(asyncio.current_task())
+        return await super()._identify(files, file_lines, store)
+
+
+class LaunchOTSHandler(web.RequestHandler):
+    """OTS callback for a launch: NFILES index lines (PPMS data first), or a list cut short after some."""
+    async def post(self, form):
+        client = {'client_id': 'test', 'token_endpoint': 'http://127.0.0.1:1/token', 'access_token': 'x'}
+        params = {'auth_token_hint': 'oauth2', 'auth_token': urlsafe_b64encode(json.dumps(client).encode()).decode()}
+        self.set_header('Content-Type', 'text/plain')
+        self.write(json.dumps(params) + "\n")
+        for i in range(0, NFILES, 1000):
+            self.write("".join(index_line(j) + "\n" for j in range(i, i + 1000)))
+            await self.flush()
+            if form == 'cut':
+                await self.settings['cut'].wait()
+                self.request.connection.stream.close()
+                return
+
+
+class LaunchOTSTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        mountdir = os.path.join(self.basedir, 'remote')
+        urlfs._mounts[(os.path.join(self.basedir, '.remote-config', 'remote.config'), mountdir)] = \
+            StandInMount(None, mountdir)
+        # only the first files exist: identification must never get to the others
+        os.makedirs(os.path.join(mountdir, 'sample'))
+        for i in range(300):
+            with open(os.path.join(mountdir, 'sample', 'run-%06d.dat' % i), "wb") as f:
+                f.write(PPMS_DAT if i == 0 else MPMS_DAT)
+        self.notebooks = tempfile.mkdtemp()
+        for kind in ('MPMS', 'PPMS'):
+            os.makedirs(os.path.join(self.notebooks, kind))
+            with open(os.path.join(self.notebooks, kind, kind + '-CW.ipynb'), "w") as f:
+                f.write('{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}')
+        self.launcher = RecordingLauncher(self.basedir, '/')
+        self.launcher.analysis_notebooks_src = self.notebooks
+        super().setUp()
+
+    def get_app(self):
+        self.cut = asyncio.Event()
+        return web.Application([(r'/ots/(\w+)', LaunchOTSHandler)], cut=self.cut)
+
+    def ots_url(self, form):
+        return urlsafe_b64encode(self.get_url('/ots/' + form).encode()).decode().rstrip('=')
+
+    @gen_test(timeout=60)
+    async def test_launch(self):
+        before = detect.stats['files_read']
+        url = await self.launcher.launch_ots(self.ots_url('streamed'), '')
+        self.assertEqual(url, '/autolaunch/landing?notebook=PPMS-CW.ipynb&notebook=MPMS-CW.ipynb')
+        # found while the list was still arriving (in the first files received): nothing left to identify afterwards
+        self.assertEqual(len(self.launcher.identified), 1)
+        self.assertGreaterEqual(self.launcher.identified[0], self.launcher.ots_early_files)
+        self.assertLessEqual(detect.stats['files_read'] - before, self.launcher.detect_concurrency + 1)
+        store = get_store(os.path.join(self.basedir, '.remote-config'))
+        self.assertIsNotNone(store.find_index_entry('sample/run-%06d.dat' % (NFILES - 1)))
+
+    @gen_test(timeout=60)
+    async def test_candidates_bounded(self):
+        self.launcher.ots_early_files = NFILES + 1 # identify once the whole list is in
+        self.launcher.ots_max_candidates = 500
+        url = await self.launcher.launch_ots(self.ots_url('streamed'), '')
+        self.assertEqual(url, '/autolaunch/landing?notebook=PPMS-CW.ipynb&notebook=MPMS-CW.ipynb')
+        self.assertEqual(self.launcher.identified, [500])
+
+    @gen_test(timeout=60)
+    async def test_list_cut_short(self):
+        release = threading.Event()
+        # reads hang, so that identification is still going on when the list breaks off
+        detect.open = lambda *args, **kwargs: release.wait() and builtins.open(*args, **kwargs)
+        try:
+            launch = asyncio.ensure_future(self.launcher.launch_ots(self.ots_url('cut'), ''))
+            while len(self.launcher.tasks) == 0:
+                await asyncio.sleep(0.01)
+            self.cut.set()
+            with self.assertRaises(HTTPClientError):
+                await launch
+            await asyncio.wait(self.launcher.tasks, timeout=5)
+            self.assertTrue(self.launcher.tasks[0].cancelled())
+        finally:
+            release.set()
+            del detect.open
@@ -0,0 +1,47 @@
+from base64 import urlsafe_b64encode
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from autolaunch import metrics, prefetch
+from autolaunch.auth.oauth2 import OAuth2AuthHandlerClass
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+
+LINES = ['F\t/sample/cached.dat\thttps://lims.example.org/sample/cached.dat\t5\t1717200000',
+         'F\t/sample/other.dat\thttps://lims.example.org/sample/other.dat\t5\t1717200000']
+
+
+class ReaderStatsTest(unittest.TestCase):
+    def setUp(self):
+        basedir = tempfile.mkdtemp()
+        self.configdir = os.path.join(basedir, '.remote-config')
+        self.mountdir = os.path.join(basedir, 'remote')
+        os.makedirs(os.path.join(self.mountdir, 'sample'))
+        os.makedirs(os.path.join(self.configdir, prefetch.cache_subdir))
+        token = urlsafe_b64encode(json.dumps({'client_id': 'test', 'access_token': 'x'}).encode()).decode()
+        get_store(self.configdir).add_source(OAuth2AuthHandlerClass(token), 'oauth2', LINES)
+        with open(os.path.join(self.configdir, prefetch.cache_subdir, prefetch.cache_key(LINES[0])), "wb") as f:
+            f.write(b"12345")
+        prefetch.get_prefetcher(self.mountdir, self.configdir)
+
+    def tearDown(self):
+        prefetch._prefetchers.clear()
+
+    def test_off_by_default(self):
+        self.assertFalse(Launcher.prefetch)
+
+    def test_hits_of_other_processes(self):
+        # a kernel looking up copies, as analysis.columnar does
+        script = ("import sys\nfrom autolaunch.prefetch import local_copy\n"
+                  "for path in sys.argv[1:]:\n    print(local_copy(path))\n")
+        out = subprocess.run([sys.executable, '-c', script] +
+                             [os.path.join(self.mountdir, 'sample', name) for name in ('cached.dat', 'other.dat', 'cached.dat')],
+                             check=True, capture_output=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertEqual(out.stdout.decode().split()[1], 'None')
+        rendered = metrics.render().splitlines()
+        self.assertIn('autolaunch_prefetch_hits_total 2', rendered)
+        self.assertIn('autolaunch_prefetch_misses_total 1', rendered)
@@ -0,0 +1,96 @@
+from io import BytesIO
+import math
+import unittest
+
+from autolaunch.analysis import qd
+
+HEADER = b"[Header]\nTITLE,qd test\nBYAPP,MPMS3,1.3.1\n[Data]\nComment,Time,Temperature (K),Moment (emu)\n"
+COLUMNS = ['Comment', 'Time', 'Temperature (K)', 'Moment (emu)']
+NAN = float('nan')
+
+
+def values(batch):
+    # rows of a parsed batch, NaN as None (as NaN != NaN)
+    return [[None if math.isnan(v) else v for v in row] for row in zip(*(batch[c] for c in COLUMNS))]
+
+
+def read(data, nrows=None):
+    header, batches = qd.read_dat(BytesIO(data), nrows)
+    return header, [values(batch) for batch in batches]
+
+
+class ReadDatTest(unittest.TestCase):
+    def tearDown(self):
+        qd.chunk_size = 8 * 1024 * 1024
+
+    def test_rows(self):
+        header, batches = read(HEADER + b",1,300.5,1e-4\n,2,299.5,-2.5E-05\n")
+        self.assertEqual(header, ['TITLE,qd test', 'BYAPP,MPMS3,1.3.1'])
+        self.assertEqual(batches, [[[None, 1, 300.5, 1e-4], [None, 2, 299.5, -2.5e-5]]])
+
+    def test_blank_fields(self):
+        _, batches = read(HEADER + b",1,,\n,,,\n1,,3,\n,,,4\n")
+        self.assertEqual(batches, [[[None, 1, None, None], [None] * 4, [1, None, 3, None], [None, None, None, 4]]])
+
+    def test_blank_and_text_rows(self):
+        _, batches = read(HEADER + b",1,300,1\n\n  \nsample remounted,2,299,2\nnan,3,inf,-inf\n")
+        self.assertEqual(batches, [[[None, 1, 300, 1], [None, 2, 299, 2], [None, 3, math.inf, -math.inf]]])
+
+    def test_quoted(self):
+        _, batches = read(HEADER + b'"field, quoted",1,300,1\n,2,"299",2\n')
+        self.assertEqual(batches, [[[None, 1, 300, 1], [None, 2, 299, 2]]])
+
+    def test_short_and_long_rows(self):
+        _, batches = read(HEADER + b",1,300\n,2\n,3,298,3,extra,fields\n,4,297,4\n")
+        self.assertEqual(batches, [[[None, 1, 300, None], [None, 2, None, None], [None, 3, 298, 3], [None, 4, 297, 4]]])
+
+    def test_crlf(self):
+        data = HEADER.replace(b"\n", b"\r\n") + b",1,300,1\r\n,2,,2\r\n"
+        header, batches = read(data)
+        self.assertEqual(header, ['TITLE,qd test', 'BYAPP,MPMS3,1.3.1'])
+        self.assertEqual(batches, [[[None, 1, 300, 1], [None, 2, None, 2]]])
+
+    def test_not_numbers(self):
+        # made of the bytes numbers are, but not numbers: only those lines are converted field by field
+        rows = b"".join(b",%d,%d,1\n" % (i, 300 - i) for i in range(1000))
+        parse_line = qd._parse_line
+        parsed = []
+        qd._parse_line = lambda l, ncols: parsed.append(l) or parse_line(l, ncols)
+        try:
+            _, batches = read(HEADER + rows + b",-,e,1.2.3\n" + rows)
+        finally:
+            qd._parse_line = parse_line
+        self.assertIn(b",-,e,1.2.3", parsed)
+        self.assertLessEqual(len(parsed), qd.min_convert_lines)
+        self.assertEqual(len(batches[0]), 2001)
+        self.assertEqual(batches[0][1000], [None] * 4)
+        self.assertEqual(batches[0][1001], [None, 0, 300, 1])
+
+    def test_split_across_chunks(self):
+        qd.chunk_size = 7
+        rows = b"".join(b",%d,%d.25,%de-3\n" % (i, 300 - i, i) for i in range(100))
+        _, batches = read(HEADER + rows, nrows=30)
+        self.assertEqual([len(b) for b in batches], [30, 30, 30, 10])
+        self.assertEqual(sum(batches, []), [[None, i, 300 - i + 0.25, float("%de-3" % i)] for i in range(100)])
+
+    def test_last_line_unterminated(self):
+        _, batches = read(HEADER + b",1,300,1\n,2,299,2")
+        self.assertEqual(batches, [[[None, 1, 300, 1], [None, 2, 299, 2]]])
+
+    def test_empty_data(self):
+        header, batches = read(HEADER)
+        self.assertEqual(header, ['TITLE,qd test', 'BYAPP,MPMS3,1.3.1'])
+        self.assertEqual(batches, [[]])
+        _, batches = read(HEADER + b"\n\n")
+        self.assertEqual(batches, [[]])
+
+
+class ParseRowsTest(unittest.TestCase):
+    def test_parse_rows(self):
+        batch = qd.parse_rows(b",1,,1\r\n\nnote,2,299,2\n,3,298,\n", COLUMNS)
+        self.assertEqual(values(batch), [[None, 1, None, 1], [None, 2, 299, 2], [None, 3, 298, None]])
+        self.assertEqual(values(qd.parse_rows(b"", COLUMNS)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from base64 import urlsafe_b64encode
+from secrets import token_hex
+from urllib.parse import parse_qs
+import asyncio
+import json
+import os
+import tempfile
+
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autolaunch import refresh
+from autolaunch.auth.oauth2 import OAuth2AuthHandlerClass
+from autolaunch.refresh import RefreshScheduler
+from autolaunch.store import get_store
+
+
+class TokenHandler(web.RequestHandler):
+    """OAuth2 token endpoint: renews any refresh token but 'revoked', taking a moment to."""
+    async def post(self):
+        form = {k: v[0] for k, v in parse_qs(self.request.body.decode()).items()}
+        self.settings['requests'].append(form)
+        await asyncio.sleep(0.05)
+        self.set_header('Content-Type', 'application/json')
+        if form.get('refresh_token') == 'revoked':
+            self.set_status(400)
+            return self.finish(json.dumps({'error': 'invalid_grant'}))
+        self.finish(json.dumps({'access_token': token_hex(16), 'refresh_token': token_hex(16), 'expires_in': 3600}))
+
+
+class RefreshSchedulerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.basedir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.basedir, '.remote-config'))
+        self.store = get_store(os.path.join(self.basedir, '.remote-config'))
+        self.scheduler = RefreshScheduler(self.basedir)
+
+    def get_app(self):
+        self.requests = []
+        return web.Application([(r'/token', TokenHandler)], requests=self.requests)
+
+    def add_source(self, name, expires_in, refresh_token=None):
+        # returns the auth UUID of a new source serving name/run.dat
+        client = {'client_id': 'test', 'authorization_endpoint': self.get_url('/authorize'),
+                  'token_endpoint': self.get_url('/token'), 'access_token': token_hex(16),
+                  'refresh_token': refresh_token or token_hex(16), 'expires_in': expires_in}
+        authhandler = OAuth2AuthHandlerClass(urlsafe_b64encode(json.dumps(client).encode()).decode())
+        self.store.add_sources([(authhandler, 'oauth2', ['F\t/%s/run.dat\thttps://lims.example.org/%s/run.dat\t1000\t0'
+                                                         % (name, name)])])
+        return authhandler.getAuthUUID()
+
+    @gen_test
+    async def test_refresh_expiring(self):
+        due = self.add_source('due', 60)
+        later = self.add_source('later', 3600)
+        refresh_token = self.store.find_refresh_info(due)[1]['refresh_token']
+        delay = await self.scheduler._refresh_expiring()
+        self.assertEqual([(r['grant_type'], r['refresh_token']) for r in self.requests], [('refresh_token', refresh_token)])
+        self.assertNotEqual(self.store.find_refresh_info(due)[1]['refresh_token'], refresh_token)
+        # both now expire in an hour: nothing due before the next look
+        self.assertEqual(sorted(u for u, e in self.store.find_expiring(float('inf'))), sorted([due, later]))
+        self.assertEqual(delay, self.scheduler.check_interval)
+        await self.scheduler._refresh_expiring()
+        self.assertEqual(len(self.requests), 1)
+
+    @gen_test
+    async def test_coalesced(self):
+        auth_uuid = self.add_source('sample', 3600)
+        before = refresh.stats['error_refreshes']
+        results = await asyncio.gather(*[self.scheduler.refresh(auth_uuid) for i in range(20)])
+        self.assertEqual(results, [True] * 20)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(refresh.stats['error_refreshes'] - before, 1)
+        # errors reported just after are taken care of by that refresh
+        self.assertTrue(await self.scheduler.refresh(auth_uuid))
+        self.assertEqual(len(self.requests), 1)
+
+    @gen_test
+    async def test_auth_error_path(self):
+        auth_uuid = self.add_source('sample', 3600)
+        self.add_source('other', 3600)
+        self.assertEqual(await self.scheduler.find_auth('sample/run.dat'), auth_uuid)
+        self.assertIsNone(await self.scheduler.find_auth('elsewhere/run.dat'))
+        self.assertIsNone(await self.scheduler.find_auth('../sample/run.dat'))
+        self.assertTrue(await self.scheduler.refresh(await self.scheduler.find_auth('sample/run.dat')))
+        self.assertEqual(len(self.requests), 1)
+
+    @gen_test
+    async def test_needs_user(self):
+        auth_uuid = self.add_source('sample', 60, refresh_token='revoked')
+        before = refresh.stats['interactive_refreshes']
+        self.assertFalse(await self.scheduler.refresh(auth_uuid))
+        self.assertEqual(refresh.stats['interactive_refreshes'] - before, 1)
+        # left for the user: no more attempts ahead of expiry
+        await self.scheduler._refresh_expiring()
+        self.assertEqual(len(self.requests), 1)
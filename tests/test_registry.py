@@ -0,0 +1,40 @@
+from importlib.metadata import EntryPoint
+import json
+import unittest
+
+from autolaunch import _registry
+from autolaunch._registry import HandlerRegistry
+
+
+class HandlerRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = _registry.entry_points
+
+    def tearDown(self):
+        _registry.entry_points = self.saved
+
+    def test_entry_points_as_dictionary(self):
+        # as returned by python < 3.10
+        ep = EntryPoint(name='JSON', value='json:loads', group='test.handlers')
+        _registry.entry_points = lambda: {'test.handlers': [ep], 'other': []}
+        registry = HandlerRegistry('test.handlers', {'DUMPS': 'json:dumps'})
+        self.assertEqual(list(registry), ['DUMPS', 'JSON'])
+        self.assertIs(registry['JSON'], json.loads)
+
+    def test_builtin_first(self):
+        registry = HandlerRegistry('autolaunch.no_such_group', {'B': 'json:dumps', 'A': 'json:loads'})
+        self.assertEqual(list(registry), ['B', 'A'])
+        self.assertNotIn('C', registry)
+
+    def test_discover(self):
+        # as the server extension does before serving: no lookup of entry points happens afterwards
+        lookups = []
+        _registry.entry_points = lambda: lookups.append(1) or {}
+        registry = HandlerRegistry('test.handlers', {'LOADS': 'json:loads'})
+        self.assertEqual(lookups, [])
+        registry.discover()
+        self.assertEqual(lookups, [1])
+        self.assertIn('LOADS', registry)
+        self.assertNotIn('DUMPS', registry)
+        self.assertEqual(len(registry), 1)
+        self.assertEqual(lookups, [1])
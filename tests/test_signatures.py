@@ -0,0 +1,119 @@
+import random
+import re
+import tempfile
+import threading
+import unittest
+
+from autolaunch import detect
+from autolaunch.analysis import analysis_handlers
+from autolaunch.analysis.signatures import Signature, SignatureMatcher, get_matcher
+
+
+class Handler:
+    def __init__(self, *sigs):
+        self.sigs = list(sigs)
+
+    def getSignatures(self):
+        return self.sigs
+
+
+def sequential(handlers, data, filename):
+    # the hints of handlers recognizing data, checking every signature of every handler on its own, in order
+    found = []
+    for hint, handler in handlers.items():
+        for sig in handler.getSignatures():
+            if not sig.matchesFilename(filename):
+                continue
+            if sig.regex is None:
+                found.append(hint)
+                break
+            regex = re.compile(sig.regex)
+            if any(sig.max_lines is None or data.count(b"\n", 0, pos) < sig.max_lines
+                   for pos in range(len(data) + 1) if regex.match(data, pos)):
+                found.append(hint)
+                break
+    return found
+
+
+class SignatureMatcherTest(unittest.TestCase):
+    def test_literal_prefix_of_another(self):
+        handlers = {'A': Handler(Signature(pattern=b'PPMS')), 'B': Handler(Signature(pattern=b'PPMS ACMS'))}
+        matcher = SignatureMatcher(handlers)
+        self.assertEqual(matcher.match(b'PPMS ACMS'), ['A', 'B'])
+        self.assertEqual(matcher.first(b'PPMS ACMS'), 'A')
+        self.assertEqual(matcher.match(b'PPMS ACM'), ['A'])
+
+    def test_literal_hiding_regex(self):
+        handlers = {'A': Handler(Signature(pattern=b'MPMS3', filename_globs=['*.foo'])),
+                    'B': Handler(Signature(regex=rb'MPMS\d'))}
+        matcher = SignatureMatcher(handlers)
+        self.assertEqual(matcher.match(b'MPMS3', 'x.dat'), ['B'])
+        self.assertEqual(matcher.match(b'MPMS3', 'x.foo'), ['A', 'B'])
+
+    def test_max_lines_hiding_other(self):
+        handlers = {'A': Handler(Signature(pattern=b'QD', max_lines=1)), 'B': Handler(Signature(regex=rb'QD\w+'))}
+        matcher = SignatureMatcher(handlers)
+        self.assertEqual(matcher.match(b'x\nQDx'), ['B'])
+
+    def test_builtin_handlers_any_filename(self):
+        matcher = SignatureMatcher(analysis_handlers)
+        for name in ['run.dat', 'run.csv', 'run', 'dir/RUN.DAT']:
+            self.assertIsNone(matcher.fromMetadata(name, 1000))
+            self.assertEqual(matcher.first(b'[Header]\nBYAPP,MPMS3,1.3.1\n', name), 'MPMS-MT')
+            self.assertEqual(matcher.first(b'[Header]\nBYAPP,PPMS ACMS,1.0\n', name), 'PPMS-MT')
+        self.assertEqual([matcher.isLikely(name) for name in ['run.dat', 'dir/RUN.DAT', 'run.csv', 'run']],
+                         [True, True, False, False])
+
+    def test_builtin_handlers_non_data(self):
+        matcher = SignatureMatcher(analysis_handlers)
+        for name in ['plot.png', 'dir/Report.PDF', 'notes.txt', 'sequence.log', 'analysis.ipynb']:
+            self.assertEqual(matcher.fromMetadata(name, 1000), '')
+            self.assertFalse(matcher.isLikely(name))
+
+    def test_partial_read_same_as_full(self):
+        # PPMS ACMS in the first 4k, but MPMS3 (from the handler ordered first) only further on
+        data = (b'[Header]\nBYAPP,PPMS ACMS,1.0\n' + b''.join(b'INFO,%s\n' % (b'x' * 70) for i in range(60)) +
+                b'BYAPP,MPMS3,1.3.1\n[Data]\n')
+        self.assertGreater(data.index(b'MPMS3'), detect.initial_read_size)
+        self.assertEqual(data.count(b'\n', 0, data.index(b'MPMS3')), 62)
+        matcher = get_matcher(analysis_handlers)
+        self.assertEqual(matcher.first(data[:detect.max_read_size], 'run.dat'), 'MPMS-MT')
+        self.assertFalse(matcher.isSettled('PPMS-MT', data[:detect.initial_read_size], 'run.dat'))
+        with tempfile.NamedTemporaryFile(suffix='.dat') as f:
+            f.write(data)
+            f.flush()
+            self.assertEqual(detect._classify_file(f.name, matcher, threading.Event()), ('MPMS-MT', len(data)))
+        # the first 100 lines all seen: nothing ordered before can match any more
+        data = b'BYAPP,PPMS ACMS,1.0\n' + b'x\n' * 100 + b'MPMS3\n'
+        self.assertTrue(matcher.isSettled('PPMS-MT', data, 'run.dat'))
+        self.assertTrue(matcher.isSettled('MPMS-MT', data[:10], 'run.dat'))
+
+    def test_same_as_sequential(self):
+        rnd = random.Random(0)
+        words = [b'PP', b'PPMS', b'PPMS ACMS', b'MPMS3', b'MPMS', b'QD', b'ACMS']
+        regexes = [rb'MPMS\d', rb'P+MS', rb'(?i:ppms)', rb'AC\w*']
+        names = ['a.dat', 'b.txt', 'dir/c.DAT', None]
+        for trial in range(300):
+            handlers = {}
+            for h in range(rnd.randint(1, 5)):
+                sigs = []
+                for k in range(rnd.randint(1, 2)):
+                    kwargs = {'max_lines': rnd.choice([None, 1, 2, 3]),
+                              'filename_globs': rnd.choice([None, ['*.dat'], ['*.txt', '*.csv']])}
+                    if rnd.random() < 0.6:
+                        kwargs['pattern'] = rnd.choice(words)
+                    elif rnd.random() < 0.9:
+                        kwargs['regex'] = rnd.choice(regexes)
+                    sigs.append(Signature(**kwargs))
+                handlers['H%d' % h] = Handler(*sigs)
+            matcher = SignatureMatcher(handlers)
+            for sample in range(10):
+                data = b''.join(rnd.choice(words + [b' ', b'\n', b'x', b'3']) for i in range(rnd.randint(0, 12)))
+                filename = rnd.choice(names)
+                expected = sequential(handlers, data, filename)
+                self.assertEqual(matcher.match(data, filename), expected, (data, filename))
+                self.assertEqual(matcher.first(data, filename), expected[0] if len(expected) > 0 else None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+from base64 import urlsafe_b64encode
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from autolaunch import metrics, urlfs
+from autolaunch import store as store_module
+from autolaunch.auth.oauth2 import OAuth2AuthHandlerClass
+from autolaunch.launch import Launcher
+from autolaunch.store import get_store
+
+
+def authhandler(name):
+    return OAuth2AuthHandlerClass(urlsafe_b64encode(json.dumps({'client_id': 'test', 'access_token': name})
+                                                    .encode()).decode())
+
+
+def line(path, size=1000):
+    return 'F\t/%s\thttps://lims.example.org/%s\t%d\t1717200000' % (path, path, size)
+
+
+class IndexEntryTest(unittest.TestCase):
+    def setUp(self):
+        self.configdir = os.path.join(tempfile.mkdtemp(), '.remote-config')
+        os.makedirs(self.configdir)
+        self.store = get_store(self.configdir)
+
+    def test_newest_source_wins(self):
+        old, new = authhandler('old'), authhandler('new')
+        self.store.add_sources([(old, 'oauth2', [line('a/run.dat'), line('a/other.dat')]),
+                                (new, 'oauth2', [line('a/run.dat', 2000)])])
+        self.assertEqual(self.store.find_index_entry('a/run.dat'), (new.getAuthUUID(), line('a/run.dat', 2000)))
+        self.assertEqual(self.store.find_index_entry('/a/other.dat/'), (old.getAuthUUID(), line('a/other.dat')))
+        self.assertIsNone(self.store.find_index_entry('a'))
+        self.assertIsNone(self.store.find_index_entry('b/run.dat'))
+
+    def test_reused_source_wins(self):
+        first, second, again = authhandler('first'), authhandler('second'), authhandler('again')
+        idxfile = self.store.add_source(first, 'oauth2', [line('a/run.dat')])
+        other = self.store.add_source(second, 'oauth2', [line('a/run.dat', 2000)])
+        self.assertEqual(self.store.find_auth_for_path('a/run.dat'), second.getAuthUUID())
+        # the same files launched again: the index file is reused, and serves them again
+        self.assertEqual(self.store.add_source(again, 'oauth2', [line('a/run.dat')]), idxfile)
+        self.assertEqual(self.store.find_index_entry('a/run.dat'), (again.getAuthUUID(), line('a/run.dat')))
+        with open(self.store.remote_config, "r") as f:
+            exported = f.read()
+        self.assertEqual([l.split("\t")[0] for l in exported.splitlines()], [other, idxfile])
+        self.store.export()
+        with open(self.store.remote_config, "r") as f:
+            self.assertEqual(f.read(), exported)
+        self.assertEqual(self.store.compact()['duplicate_sources'], 0)
+
+    def test_refresh_incremental(self):
+        refreshed, others = authhandler('refreshed'), [authhandler('other-%d' % i) for i in range(50)]
+        idxfiles = self.store.add_sources([(refreshed if i % 10 == 0 else others[i], 'oauth2', [line('%d/run.dat' % i)])
+                                           for i in range(50)])
+        before = {}
+        for fil in idxfiles:
+            with open(fil, "r") as f:
+                before[fil] = (os.stat(fil).st_mtime_ns, f.read())
+        with open(self.store.remote_config, "r") as f:
+            exported = f.read().splitlines()
+        export_lines = store_module._export_lines
+        regenerated = []
+        store_module._export_lines = lambda row: regenerated.append(row[0]) or export_lines(row)
+        try:
+            new = authhandler('new')
+            changed = self.store.replace_auth(refreshed.getAuthUUID(), lambda token_hint, refresh_info: new)
+        finally:
+            store_module._export_lines = export_lines
+        self.assertEqual(sorted(changed), sorted(idxfiles[::10]))
+        # only the lines of the refreshed sources were regenerated, and none of the index files touched
+        self.assertEqual(sorted(regenerated), sorted(idxfiles[::10]))
+        for fil in idxfiles:
+            with open(fil, "r") as f:
+                self.assertEqual((os.stat(fil).st_mtime_ns, f.read()), before[fil])
+        with open(self.store.remote_config, "r") as f:
+            lines = f.read().splitlines()
+        self.assertEqual([l.split("\t")[0] for l in lines], idxfiles)
+        self.assertEqual([i for i in range(50) if lines[i] != exported[i]], list(range(0, 50, 10)))
+        self.assertEqual(self.store.find_auth_for_path('10/run.dat'), new.getAuthUUID())
+        self.store.export()
+        with open(self.store.remote_config, "r") as f:
+            self.assertEqual(f.read().splitlines(), lines)
+
+    def test_appended_lines(self):
+        ah = authhandler('ots')
+        idxfile = self.store.add_source(ah, 'oauth2', [])
+        self.store.append_lines(idxfile, [line('ots/%d.dat' % i) for i in range(3)])
+        self.assertEqual(self.store.find_auth_for_path('ots/2.dat'), ah.getAuthUUID())
+        with open(idxfile, "r") as f:
+            self.assertEqual(f.read().splitlines(), [line('ots/%d.dat' % i) for i in range(3)])
+
+    def test_removed_sources(self):
+        idxfile = self.store.add_source(authhandler('gone'), 'oauth2', [line('gone/run.dat')])
+        os.remove(idxfile)
+        self.assertIsNone(self.store.find_index_entry('gone/run.dat'))
+        self.store.compact()
+        self.assertEqual(self.store._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0], 0)
+
+    def test_sources_from_before(self):
+        ah = authhandler('before')
+        self.store.add_source(ah, 'oauth2', [line('before/run.dat')])
+        # as added by a version that did not keep entries
+        self.store._db.execute("DELETE FROM entries")
+        self.store._db.execute("UPDATE sources SET indexed = NULL")
+        self.store._db.close()
+        store_module._stores.clear()
+        self.assertEqual(get_store(self.configdir).find_auth_for_path('before/run.dat'), ah.getAuthUUID())
+
+    def test_readonly(self):
+        ah = authhandler('ro')
+        idxfile = self.store.add_source(ah, 'oauth2', [line('ro/run.dat')])
+        version = self.store._db.execute("PRAGMA data_version").fetchone()[0]
+        # a notebook looking up the source of a file, in another process
+        script = ("import sys\nfrom autolaunch.store import get_store\n"
+                  "print(get_store(sys.argv[1], readonly=True).find_auth_for_path('ro/run.dat'))\n")
+        out = subprocess.run([sys.executable, '-c', script, self.configdir], check=True, capture_output=True,
+                             env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        self.assertEqual(out.stdout.decode().strip(), ah.getAuthUUID())
+        self.assertEqual(self.store._db.execute("PRAGMA data_version").fetchone()[0], version)
+        with self.assertRaises(sqlite3.OperationalError):
+            get_store(self.configdir, readonly=True).append_lines(idxfile, [line('ro/more.dat')])
+        self.assertIsNone(self.store.find_index_entry('ro/more.dat'))
+        self.assertIsNone(get_store(os.path.join(self.configdir, 'nothing'), readonly=True))
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount that is always mounted already, counting reloads."""
+    reloads = 0
+
+    async def ensure_mounted(self, timeout=None):
+        return False
+
+    async def reload(self, timeout=None):
+        self.reloads += 1
+
+
+class LauncherCompactTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.launcher = Launcher(self.basedir, '/')
+        self.mount = StandInMount(None, self.launcher.mountdir)
+        urlfs._mounts[(os.path.join(self.launcher.configdir, 'remote.config'), self.launcher.mountdir)] = self.mount
+
+    def phases(self, operation):
+        return {dict(key)['phase'] for key in metrics._histograms.get('autolaunch_phase_seconds', {})
+                if dict(key)['operation'] == operation}
+
+    async def test_compact_traced(self):
+        self.assertIsNone(await self.launcher.compact())
+        os.makedirs(self.launcher.configdir)
+        os.remove(get_store(self.launcher.configdir).add_source(authhandler('gone'), 'oauth2', [line('run.dat')]))
+        with mock.patch('os.path.ismount', return_value=True):
+            self.assertEqual((await self.launcher.compact())['orphaned_sources'], 1)
+        self.assertEqual(self.mount.reloads, 1)
+        self.assertEqual(self.phases('compact'), {'compact', 'mount', 'reload'})
+        self.assertEqual(metrics._counters['autolaunch_operations_total'][(('operation', 'compact'),
+                                                                          ('outcome', 'ok'))], 1)
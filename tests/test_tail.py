@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from autolaunch.analysis.tail import TailReader
+
+HEADER = b"[Header]\nTITLE,tail test\nBYAPP,MPMS3,1.3.1\n[Data]\nTime,Temperature (K),Moment (emu)\n"
+
+
+def rows(start, n, scale=1.0):
+    return b"".join(b"%d,%.3f,%.6e\n" % (i, scale * (300 - i), 1e-4 * i) for i in range(start, start + n))
+
+
+class TailReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.fil = os.path.join(tempfile.mkdtemp(), 'run.dat')
+
+    def write(self, data, mode="wb"):
+        with open(self.fil, mode) as f:
+            f.write(data)
+
+    def reader(self):
+        return TailReader(self.fil, 'MPMS-MT')
+
+    def test_appended_rows(self):
+        self.write(HEADER + rows(0, 10))
+        reader = self.reader()
+        self.assertEqual(reader.refresh(), 10)
+        self.write(rows(10, 5) + b"15,28", "ab") # the last line still being written
+        self.assertEqual(reader.refresh(), 5)
+        self.write(b"5.000,1.5e-03\n", "ab")
+        self.assertEqual(reader.refresh(), 1)
+        self.assertEqual(list(reader.columns()['Time']), list(range(16)))
+        self.assertEqual(reader.reparses, 0)
+
+    def test_truncated(self):
+        self.write(HEADER + rows(0, 10))
+        reader = self.reader()
+        reader.refresh()
+        self.write(HEADER + rows(0, 3))
+        reader.refresh()
+        self.assertEqual(reader.reparses, 1)
+        self.assertEqual(list(reader.columns()['Time']), [0, 1, 2])
+
+    def test_rewritten_larger(self):
+        self.write(HEADER + rows(0, 10))
+        reader = self.reader()
+        reader.refresh()
+        # a new run in the same file: other (and more) rows, with the same header
+        self.write(HEADER + rows(100, 20, 2.0))
+        reader.refresh()
+        self.assertEqual(reader.reparses, 1)
+        self.assertEqual(reader.names, ['Time', 'Temperature (K)', 'Moment (emu)'])
+        self.assertEqual(reader.header, ['TITLE,tail test', 'BYAPP,MPMS3,1.3.1'])
+        self.assertEqual(list(reader.columns()['Time']), list(range(100, 120)))
+        self.assertAlmostEqual(reader.columns()['Temperature (K)'][0], 400.0)
+
+    def test_rewritten_same_size(self):
+        self.write(HEADER + rows(0, 10))
+        reader = self.reader()
+        reader.refresh()
+        self.write(HEADER.replace(b'tail test', b'tail TEST') + rows(0, 10))
+        reader.refresh()
+        self.assertEqual(reader.reparses, 1)
+        self.assertEqual(reader.header[0], 'TITLE,tail TEST')
+        self.assertEqual(list(reader.columns()['Time']), list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
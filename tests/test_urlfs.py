@@ -0,0 +1,74 @@
+import asyncio
+import time
+import unittest
+
+from autolaunch import urlfs
+
+
+class StandInMount(urlfs.URLFSMount):
+    """URLFS mount whose reload signals go out at once (as when its process is known), recording when each did."""
+    def __init__(self):
+        super().__init__(None, None)
+        self.signals = []
+
+    async def _send_signal(self, timeout):
+        self.signals.append(time.monotonic())
+
+
+class ReloadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_single_reload_not_delayed(self):
+        mount = StandInMount()
+        start = time.monotonic()
+        await mount.reload()
+        self.assertEqual(len(mount.signals), 1)
+        self.assertLess(mount.signals[0] - start, 0.01)
+
+    async def test_simultaneous_reloads(self):
+        mount = StandInMount()
+        await asyncio.gather(*[mount.reload() for i in range(10)])
+        self.assertEqual(len(mount.signals), 1)
+
+    async def test_burst(self):
+        # launches finishing one after the other, over less than the minimum interval
+        mount = StandInMount()
+
+        async def launch(i):
+            await asyncio.sleep(i * urlfs.min_signal_interval / 100)
+            await mount.reload()
+
+        await asyncio.gather(*[launch(i) for i in range(40)])
+        self.assertEqual(len(mount.signals), 2)
+
+    async def test_reloads_while_in_flight(self):
+        mount = StandInMount()
+        first = asyncio.ensure_future(mount.reload())
+        await asyncio.sleep(0.01)
+        # requested after the first signal went out: served by a single next one, once the interval is over
+        later = [asyncio.ensure_future(mount.reload()) for i in range(5)]
+        await asyncio.sleep(0.01)
+        later.append(asyncio.ensure_future(mount.reload()))
+        await first
+        self.assertEqual(len(mount.signals), 1)
+        await asyncio.gather(*later)
+        self.assertEqual(len(mount.signals), 2)
+        self.assertGreaterEqual(mount.signals[1] - mount.signals[0], urlfs.min_signal_interval)
+        # once the interval after the last signal is over, the next one goes out right away again
+        await asyncio.sleep(urlfs.min_signal_interval * 1.5)
+        start = time.monotonic()
+        await mount.reload()
+        self.assertEqual(len(mount.signals), 3)
+        self.assertLess(mount.signals[2] - start, 0.01)
+
+    async def test_failed_signal(self):
+        mount = StandInMount()
+
+        async def fail(timeout):
+            raise ProcessLookupError()
+
+        mount._send_signal = fail
+        with self.assertRaises(ProcessLookupError):
+            await mount.reload()
+        self.assertIsNone(mount.pids)
+        mount._send_signal = StandInMount._send_signal.__get__(mount)
+        await mount.reload()
+        self.assertEqual(len(mount.signals), 1)